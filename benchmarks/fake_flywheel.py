@@ -0,0 +1,446 @@
+"""An in-process stand-in for the parts of the Flywheel API this gear uses
+
+`FakeFlywheel` holds an in-memory hierarchy (groups, projects, subjects, sessions,
+acquisitions and their files) and `FakeFlywheelServer` serves it over HTTP on
+localhost, so that the real `flywheel.Client` (and `ac.AsyncClient`) can be pointed at
+it with `FakeFlywheelServer.api_key`.  Every request is counted per endpoint, and
+per-request latency and error rates can be injected.
+"""
+from collections import Counter, defaultdict
+import bisect
+import copy
+from datetime import datetime, timezone
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import operator
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlparse
+
+from flywheel.flywheel import SDK_VERSION
+
+CONTAINER_TYPES = {
+    "groups": "group",
+    "projects": "project",
+    "subjects": "subject",
+    "sessions": "session",
+    "acquisitions": "acquisition",
+    "analyses": "analysis",
+}
+
+
+# The comparisons `_parse_filters` understands, e.g. modified>2021-06-01T00:00:00
+FILTER_OPERATORS = {"=": operator.eq, ">": operator.gt, "<": operator.lt}
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeFlywheel:
+    """An in-memory flywheel hierarchy
+
+    Args:
+        latency (float): Seconds to wait before answering each request
+        error_rate (float): The fraction of requests answered with `error_status`
+        error_status (integer): The HTTP status code of injected errors
+        seed (integer): Seed for the injected errors
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=503, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.release = SDK_VERSION
+        self.user = {"_id": "benchmark@flywheel.io", "email": "benchmark@flywheel.io"}
+
+        self.containers = {}
+        self.children = defaultdict(list)
+        self.file_data = {}
+        self.calls = Counter()
+        self.bytes_received = 0
+
+        self._found = {}
+        self._ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def new_id(self):
+        return f"{next(self._ids):024x}"
+
+    def add(self, container_type, label, parent=None, **fields):
+        container = {
+            "_id": fields.pop("_id", None) or self.new_id(),
+            "label": label,
+            "container_type": container_type,
+            "parents": {},
+            "info": {},
+            "files": [],
+            "created": now(),
+            "modified": now(),
+        }
+        if parent is not None:
+            container["parents"] = dict(parent["parents"])
+            container["parents"][parent["container_type"]] = parent["_id"]
+            self.children[parent["_id"]].append(container)
+        container.update(fields)
+        self.containers[container["_id"]] = container
+        self._found.clear()
+        return container
+
+    def add_file(self, container, name, info=None, file_type="dicom"):
+        file_ = {
+            "name": name,
+            "file_id": self.new_id(),
+            "type": file_type,
+            "info": info or {},
+            "parents": dict(container["parents"], **{container["container_type"]: container["_id"]}),
+            "parent_ref": {"type": container["container_type"], "id": container["_id"]},
+            "size": 0,
+            "created": now(),
+            "modified": now(),
+        }
+        container["files"].append(file_)
+        return file_
+
+    def find(self, container_type, filters):
+        """List containers of a type matching filters (e.g. parents.project=<id>)
+
+        Results are sorted by id, and memoized until the next container is added, since
+        paging through a listing repeats the same query.
+        """
+        key = (container_type, tuple(filters))
+        if key not in self._found:
+            results = [
+                container
+                for container in self.containers.values()
+                if container["container_type"] == container_type
+                and all(_compare(_lookup(container, k), op, v) for k, op, v in filters)
+            ]
+            results.sort(key=lambda c: c["_id"])
+            self._found[key] = (results, [c["_id"] for c in results])
+        return self._found[key]
+
+    def find_page(self, container_type, filters, after_id=None, limit=0):
+        results, ids = self.find(container_type, filters)
+        start = bisect.bisect_right(ids, after_id) if after_id else 0
+        end = start + limit if limit else len(results)
+        return results[start:end]
+
+    def set_info(self, container_id, body):
+        with self._lock:
+            container = self.containers[container_id]
+            if "replace" in body:
+                container["info"] = copy.deepcopy(body["replace"])
+            for key, value in body.get("set", {}).items():
+                # Like the API, "$" and "." in keys are sanitized, so a dotted key
+                # sets a top level field rather than a nested one
+                key = key.replace("$", "-").replace(".", "_")
+                container["info"][key] = copy.deepcopy(value)
+            for key in body.get("delete", []):
+                container["info"].pop(key, None)
+            container["modified"] = now()
+            self._found.clear()
+
+    def upload_file(self, container, name, data):
+        """Store an uploaded file, replacing the file of the same name, if any"""
+        with self._lock:
+            container["files"] = [f for f in container["files"] if f["name"] != name]
+            file_ = self.add_file(container, name, file_type=None)
+            file_["size"] = len(data)
+            self.file_data[(container["_id"], name)] = data
+            container["modified"] = now()
+            self._found.clear()
+        return file_
+
+    def inject(self):
+        """Wait out the injected latency, and return an error status if one is injected"""
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            return self.error_status
+        return None
+
+
+def _lookup(container, key):
+    value = container
+    for part in key.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _compare(value, op, expected):
+    if value is None:
+        return op == "=" and expected is None
+    return FILTER_OPERATORS[op](str(value), expected)
+
+
+def _parse_filters(filter_string):
+    filters = []
+    for term in filter_string.split(","):
+        match = re.match(r"^([^=<>]+)([=<>])(.*)$", term)
+        if match is None:
+            continue
+        key, op, value = match.groups()
+        filters.append((key.strip(), op, value.strip().strip('"')))
+    return filters
+
+
+def _parse_multipart(content_type, data):
+    """The (file name, content) of each file in a multipart/form-data body"""
+    message = BytesParser().parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + data
+    )
+    return [
+        (part.get_filename(), part.get_payload(decode=True))
+        for part in message.get_payload()
+        if part.get_filename()
+    ]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which stalls on delayed ACK's otherwise
+    disable_nagle_algorithm = True
+    fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        if isinstance(body, bytes):
+            data, content_type = body, "application/octet-stream"
+        else:
+            data = json.dumps(body).encode() if body is not None else b""
+            content_type = "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length) if length else b""
+        self.fake.bytes_received += len(data)
+        content_type = self.headers.get("Content-Type") or ""
+        if content_type.startswith("multipart/form-data"):
+            return _parse_multipart(content_type, data)
+        return json.loads(data) if data else None
+
+    def _handle(self, method):
+        fake = self.fake
+        url = urlparse(self.path)
+        path = unquote(url.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self._read_body() if method in ("POST", "PUT", "PATCH") else None
+
+        route, response = self._route(method, path, query, body)
+        fake.calls[f"{method} {route}"] += 1
+
+        error = fake.inject()
+        if error is not None:
+            self._send(error, {"message": "injected error"}, {"Retry-After": "0"})
+            return
+
+        if response is None:
+            self._send(404, {"message": f"{path} not found"})
+        else:
+            self._send(200, response)
+
+    def _route(self, method, path, query, body):
+        fake = self.fake
+        parts = [p for p in path.split("/") if p][1:]  # drop the leading "api"
+
+        if parts == ["users", "self"]:
+            return "/users/self", fake.user
+
+        if parts == ["auth", "status"]:
+            origin = {"type": "user", "id": fake.user["_id"]}
+            return "/auth/status", {"origin": origin, "user_is_admin": False, "is_device": False}
+
+        if parts == ["config"]:
+            return "/config", {"features": {}, "signed_url": False}
+
+        if parts == ["version"]:
+            return "/version", {"flywheel_release": fake.release, "release": fake.release}
+
+        if len(parts) == 2 and parts[0] == "containers":
+            return "/containers/{id}", fake.containers.get(parts[1])
+
+        if len(parts) == 1 and parts[0] in CONTAINER_TYPES:
+            # A paged listing: ?filter=...&limit=...&after_id=...
+            results = fake.find_page(
+                CONTAINER_TYPES[parts[0]],
+                _parse_filters(query.get("filter", "")),
+                query.get("after_id"),
+                int(query.get("limit") or 0),
+            )
+            return f"/{parts[0]}", results
+
+        if len(parts) >= 2 and parts[0] in CONTAINER_TYPES:
+            container = fake.containers.get(parts[1])
+            if len(parts) == 2:
+                return f"/{parts[0]}/{{id}}", container
+
+            if len(parts) == 3 and parts[2] == "info" and container is not None:
+                fake.set_info(container["_id"], body or {})
+                return f"/{parts[0]}/{{id}}/info", {"modified": 1}
+
+            if method == "POST" and len(parts) == 3 and parts[2] == "files" and container:
+                uploaded = [fake.upload_file(container, name, data) for name, data in body]
+                return f"/{parts[0]}/{{id}}/files", uploaded
+
+            if len(parts) == 4 and parts[2] == "files" and container is not None:
+                data = fake.file_data.get((container["_id"], parts[3]))
+                return f"/{parts[0]}/{{id}}/files/{{name}}", data
+
+            if len(parts) == 3 and parts[2] in CONTAINER_TYPES and container is not None:
+                child_type = CONTAINER_TYPES[parts[2]]
+                results = [
+                    child
+                    for child in fake.children[container["_id"]]
+                    if child["container_type"] == child_type
+                ]
+                return f"/{parts[0]}/{{id}}/{parts[2]}", results
+
+            return f"/{parts[0]}/{{id}}/{'/'.join(parts[2:])}", None
+
+        return path, None
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+
+class FakeFlywheelServer:
+    """Serves a `FakeFlywheel` over HTTP on localhost from a background thread
+
+    Use it as a context manager:
+
+        with FakeFlywheelServer(fake) as server:
+            fw = flywheel.Client(server.api_key)
+    """
+
+    def __init__(self, fake):
+        handler = type("Handler", (_Handler,), {"fake": fake})
+        self.fake = fake
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    @property
+    def api_key(self):
+        return f"127.0.0.1:{self.port}:__force_insecure:benchmark-key"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def generate_project(
+    fake,
+    n_subjects,
+    sessions_per_subject=1,
+    acquisitions_per_session=1,
+    files_per_acquisition=1,
+    group_id="benchmark",
+    project_label="Benchmark",
+):
+    """Generate a synthetic project of DICOM files, each with UID's in its info
+
+    Returns:
+        project (dict): the project container
+        analysis (dict): an analysis on the project, to use as the gear destination
+
+    """
+    group = fake.containers.get(group_id) or fake.add("group", group_id, _id=group_id)
+    project = fake.add("project", project_label, group)
+    analysis = fake.add("analysis", "import-rois", project)
+
+    for a in range(n_subjects):
+        subject = fake.add("subject", f"sub-{a:05d}", project)
+        for b in range(sessions_per_subject):
+            session = fake.add("session", f"ses-{b:03d}", subject)
+            for c in range(acquisitions_per_session):
+                acquisition = fake.add("acquisition", f"acq-{c:03d}", session)
+                for d in range(files_per_acquisition):
+                    study = f"1.2.826.0.1.{a}.{b}"
+                    series = f"{study}.{c}"
+                    fake.add_file(
+                        acquisition,
+                        f"image-{a}-{b}-{c}-{d}.dcm",
+                        {
+                            "StudyInstanceUID": study,
+                            "SeriesInstanceUID": series,
+                            "SOPInstanceUID": f"{series}.{d}",
+                            "PatientID": subject["label"],
+                        },
+                    )
+
+    return project, analysis
+
+
+def generate_rows(fake, project, rows_per_session):
+    """Generate CSV rows with `rows_per_session` distinct ROI's for every session
+
+    Returns:
+        rows (list): dicts with the columns described in "Sample.csv"
+
+    """
+    group_id = project["parents"]["group"]
+    rows = []
+    for subject in fake.children[project["_id"]]:
+        if subject["container_type"] != "subject":
+            continue
+
+        for session in fake.children[subject["_id"]]:
+            files = [
+                file_
+                for acquisition in fake.children[session["_id"]]
+                for file_ in acquisition["files"]
+            ]
+            for i in range(rows_per_session if files else 0):
+                file_ = files[i % len(files)]
+                offset = i // len(files)
+                rows.append(
+                    {
+                        "group": group_id,
+                        "project": project["label"],
+                        "subject": subject["label"],
+                        "session": session["label"],
+                        "file": file_["name"],
+                        "x min": 10.0 + offset,
+                        "x max": 50.5 + offset,
+                        "y min": 20.25,
+                        "y max": 80.75,
+                        "roi type": "RectangleRoi" if i % 2 else "EllipticalRoi",
+                        "description": f"roi {i}",
+                    }
+                )
+
+    return rows
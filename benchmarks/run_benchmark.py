@@ -0,0 +1,192 @@
+"""End-to-end benchmarks of `run.main` against the fake flywheel server
+
+For every combination of row count and rows-per-session, a synthetic project and CSV
+are generated, and the gear is run against a `FakeFlywheelServer` in a child process
+(so that its peak RSS is measured on its own).  The wall time, peak RSS and the API
+calls the server received are recorded for each run.
+
+Run it from the repository root, e.g.:
+
+    python -m benchmarks.run_benchmark --rows 1000 10000 --rows-per-session 1 10 \\
+        --latency 0.01 --output benchmark_results.json
+"""
+import argparse
+import csv
+import json
+import logging
+import math
+from pathlib import Path
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import fake_flywheel as ff
+from utils.import_data import SUCCESS_STATUSES
+
+log = logging.getLogger(__name__)
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def write_csv(rows, csv_file):
+    with open(csv_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_case(n_rows, rows_per_session, args, work_dir):
+    """Generate a project and CSV with `n_rows` rows, and import it with the gear
+
+    Args:
+        n_rows (integer): The number of CSV rows to import
+        rows_per_session (integer): The number of ROI's to import into each session
+        args (argparse.Namespace): The benchmark options
+        work_dir (Pathlike): A directory for the CSV file and the gear's output
+
+    Returns:
+        result (dict): The parameters and measurements of the run
+
+    """
+    fake = ff.FakeFlywheel(args.latency, args.error_rate, seed=args.seed)
+    n_sessions = math.ceil(n_rows / rows_per_session)
+    project, analysis = ff.generate_project(
+        fake,
+        n_sessions,
+        files_per_acquisition=min(rows_per_session, args.files_per_session),
+    )
+    rows = ff.generate_rows(fake, project, rows_per_session)[:n_rows]
+
+    case_dir = Path(work_dir) / f"{n_rows}_{rows_per_session}"
+    case_dir.mkdir(parents=True, exist_ok=True)
+    csv_file = case_dir / "rois.csv"
+    write_csv(rows, csv_file)
+
+    gear_args = {
+        "csv_file": str(csv_file),
+        "output_dir": str(case_dir),
+        "destination": {"id": analysis["_id"]},
+        "dry_run": args.dry_run,
+        "max_workers": args.max_workers,
+        "async_requests": args.async_requests,
+        "max_in_flight": args.max_in_flight,
+        "chunk_size": args.chunk_size,
+    }
+
+    with ff.FakeFlywheelServer(fake) as server:
+        gear_args["api_key"] = server.api_key
+        child = subprocess.run(
+            [sys.executable, "-m", "benchmarks.run_benchmark", "--child", json.dumps(gear_args)],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+        )
+
+    if child.returncode != 0:
+        log.error(child.stderr)
+        raise Exception(f"Benchmark of {n_rows} rows failed")
+
+    result = {
+        "rows": n_rows,
+        "rows_per_session": rows_per_session,
+        "sessions": n_sessions,
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "max_workers": args.max_workers,
+        "async_requests": args.async_requests,
+        "max_in_flight": args.max_in_flight,
+        "chunk_size": args.chunk_size,
+        "dry_run": args.dry_run,
+    }
+    result.update(json.loads(child.stdout.strip().splitlines()[-1]))
+    with open(case_dir / "Data_Import_Status_report.csv", newline="") as f:
+        statuses = [row["Gear_Status"] for row in csv.DictReader(f)]
+    result["rows_imported"] = sum(status in SUCCESS_STATUSES for status in statuses)
+    result["api_calls"] = sum(fake.calls.values())
+    result["api_calls_by_endpoint"] = dict(sorted(fake.calls.items()))
+    result["bytes_sent"] = fake.bytes_received
+
+    return result
+
+
+def run_child(gear_args):
+    """Run the gear in this (child) process, and print its measurements as json"""
+    logging.basicConfig(level=logging.WARNING)
+    import run
+
+    gear_args["output_dir"] = Path(gear_args["output_dir"])
+    start = time.perf_counter()
+    exit_status = run.main(first_row=1, delimiter=",", **gear_args)
+    wall_time = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        json.dumps(
+            {
+                "exit_status": exit_status,
+                "wall_time": round(wall_time, 3),
+                "peak_rss_mb": round(peak_rss / 1024, 1),
+            }
+        )
+    )
+
+
+def format_result(result):
+    return (
+        f"{result['rows']:>7} rows {result['rows_per_session']:>4}/session: "
+        f"{result['rows_imported']:>7} imported "
+        f"{result['wall_time']:>8.2f} s {result['api_calls']:>7} calls "
+        f"{result['peak_rss_mb']:>7.1f} MB (exit {result['exit_status']})"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--rows-per-session", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument(
+        "--files-per-session",
+        type=int,
+        default=10,
+        help="The most files to create in each session; rows are spread across them",
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-workers", type=int, default=1)
+    parser.add_argument("--async-requests", action="store_true")
+    parser.add_argument("--max-in-flight", type=int, default=100)
+    parser.add_argument("--chunk-size", type=int, default=0)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--output", help="Write the results to this json file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        run_child(json.loads(args.child))
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s", force=True)
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_rows in args.rows:
+            for rows_per_session in args.rows_per_session:
+                result = run_case(n_rows, rows_per_session, args, work_dir)
+                log.info(format_result(result))
+                results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,21 +6,52 @@ import logging
 import flywheel
 import flywheel_gear_toolkit as gt
 
-from utils import load_data as ld, import_data as id, csv_utils as cu
+from utils import load_data as ld, import_data as id, csv_utils as cu, async_client as ac
+from utils import cache_utils as cache, metrics_utils as mu, journal_utils as jr
+from utils import scheduler_utils as sched, progress_utils as pu
+from utils import ROI_Template as ROI, hierarchy_cache_utils as hc, plan_utils as pl
 
 log = logging.getLogger()
 
 
-def main(csv_file, first_row, delimiter, api_key, dry_run, output_dir, destination):
+def main(
+    csv_file,
+    first_row,
+    delimiter,
+    api_key,
+    dry_run,
+    output_dir,
+    destination,
+    max_workers=1,
+    async_requests=False,
+    chunk_size=0,
+    cache_size=1024,
+    cache_ttl=0,
+    journal_file=None,
+    delta_import=False,
+    requests_per_second=0,
+    max_retries=5,
+    progress_interval=30,
+    match_by=id.MATCH_BY_LABELS,
+    report_format="csv",
+    route_by_project=False,
+    hierarchy_cache=None,
+    plan_file=None,
+    max_in_flight=100,
+):
     """Imports ROI's from a CSV file into Flywheel
 
     This function initializes a flywheel Client, loads a CSV file, ingests that data
     into a format that can be used to generate ROI's, uploads those to flywheel, and
-    saves a report.
+    saves a report, along with metrics on the API calls made and the time each phase
+    took.
     Args:
-        csv_file (Pathlike): The location of the CSV file for ROI import
-        first_row (integer): The row in the CSV file that contains the headers of the
-            columns.  Data is assumed to be below this row.
+        csv_file (Pathlike): The location of the CSV file for ROI import.  An excel
+            workbook (.xlsx or .xlsm) is also accepted, and all its sheets are imported,
+            as are parquet and feather files, of which only the columns the gear uses
+            are loaded.
+        first_row (integer): The row in the CSV file (or in each sheet) that contains
+            the headers of the columns.  Data is assumed to be below this row.
         delimiter (string): The type of delimiter used in this file.
         api_key (string): The flywheel API key of the user running this gear.
         dry_run (boolean): Sets if the gear is going to perform a dry-run (will not
@@ -28,6 +59,36 @@ def main(csv_file, first_row, delimiter, api_key, dry_run, output_dir, destinati
         output_dir (Pathlike): The directory to save gear outputs to
         group (Flywheel.Group): The group that the gear is being run in.
         project (Flyhweel.Project): The project that the gear is being run in.
+        max_workers (integer): The number of sessions to import concurrently.
+        async_requests (boolean): Read and write sessions with the asyncio client,
+            keeping up to `max_in_flight` requests in flight.
+        chunk_size (integer): If greater than 0, stream the CSV file in chunks of this
+            many rows instead of loading it all at once.  Excel sheets are always
+            streamed, in chunks of this many rows or a chunk per sheet.
+        cache_size (integer): The number of containers to keep in the client's cache.
+        cache_ttl (float): Seconds after which a cached container expires (0 to never
+            expire).
+        journal_file (Pathlike): The journal of a previous run of this import.  Rows it
+            committed are skipped.
+        delta_import (boolean): Only import the rows that are not already on their
+            session (by fingerprint).
+        requests_per_second (float): The most API requests to make per second (0 for no
+            limit).
+        max_retries (integer): The number of times to retry a request that failed with a
+            transient error (e.g. 429 or 503).
+        progress_interval (float): The least number of seconds between two progress
+            lines in the log (0 for none).
+        match_by (string): Match rows to files by their labels and file name
+            ("labels") or by their DICOM UID's ("dicom_uids").
+        report_format (string): Write the status report as "csv", gzip-compressed
+            "csv.gz" or "parquet".
+        route_by_project (boolean): Import each row into the project named in its
+            group and project columns, rather than the project the gear runs in.
+        hierarchy_cache (string): Keep the project snapshots in an SQLite cache, as an
+            attachment of the project ("project") or at this path.  None for no cache.
+        plan_file (Pathlike): The plan written by a dry run of this import.  If given,
+            the ROI's it planned are written without matching or building them again.
+        max_in_flight (integer): The most requests the asyncio client keeps in flight.
 
     Returns:
         exit_status (integer): indicates if the script was successful (0) or encountered
@@ -35,31 +96,160 @@ def main(csv_file, first_row, delimiter, api_key, dry_run, output_dir, destinati
     """
 
     exit_status = 0
+    metrics = mu.Metrics()
+    journal = None
+    plan = None
+    plan_entries = None
 
     try:
-        # Initialize the flywheel client using an API-ket
-        fw = flywheel.Client(api_key)
+        # Initialize the flywheel client using an API-ket.  Every API call is recorded
+        # in `metrics` and paced (and retried) by the scheduler, and containers fetched
+        # by id are cached, since many rows share the same sessions and acquisitions.
+        scheduler = sched.RequestScheduler(requests_per_second, max_retries, metrics=metrics)
+        fw = mu.InstrumentedClient(flywheel.Client(api_key), metrics)
+        fw = sched.ScheduledClient(fw, scheduler)
+        fw = cache.CachedClient(fw, cache_size, cache_ttl)
 
         destination = fw.get(destination['id'])
         group = fw.get_group(destination.parents.group)
         project = fw.get_project(destination.parents.project)
         log.debug(f'working in project {project.label}')
 
-        # We now assume that this data is being uploaded to the group/project that the gear is being run on.
+        # Unless rows are routed by their group/project columns, we assume that this data
+        # is being uploaded to the group/project that the gear is being run on.
+
+        # Record every row that is written, so an interrupted import can be resumed
+        journal = jr.Journal(output_dir / jr.JOURNAL_FILE, journal_file)
+
+        # Reuse the snapshots of earlier runs, only listing what changed since then.
+        # Applying a plan loads no snapshots.
+        snapshot_cache = None
+        if hierarchy_cache and plan_file is None:
+            snapshot_cache = hc.open_hierarchy_cache(project, hierarchy_cache)
+
+        # A dry run records the ROI's it built, so that they can be written later (by
+        # passing the plan back in) without matching and building them again
+        if plan_file is not None:
+            plan_entries = pl.read_plan(plan_file)
+        elif dry_run:
+            plan = pl.Plan(output_dir / pl.PLAN_FILE)
+
+        async_client = None
+        if async_requests:
+            async_client = ac.AsyncClient(
+                api_key, max_in_flight=max_in_flight, metrics=metrics, scheduler=scheduler
+            )
+
+        report_columns = None
+        if ld.is_excel_file(csv_file):
+            # Excel workbooks are always streamed, a sheet (or chunk) at a time, while
+            # the next sheets are parsed in parallel
+            chunks = ld.iter_excel_dataframe(csv_file, first_row, chunk_size)
+            # Sheets may not share their columns, so the report has all of them
+            report_columns = ld.get_excel_headers(csv_file, first_row)
+        elif chunk_size > 0 and ld.is_arrow_file(csv_file):
+            # Only the columns the gear reads are loaded from parquet/feather files
+            chunks = ld.iter_arrow_dataframe(csv_file, chunk_size, ROI.INPUT_HDRS)
+        elif chunk_size > 0:
+            # Stream the csv file, importing and reporting one chunk at a time
+            chunks = ld.iter_text_dataframe(csv_file, first_row, delimiter, chunk_size)
+        else:
+            chunks = None
+
+        if chunks is not None and chunk_size > 0:
+            # Bring the rows of each session into one chunk, so it is read and written
+            # once, however the file is sorted
+            chunks = ld.group_chunks_by_session(
+                chunks, chunk_size, id.SESSION_COLUMNS[match_by]
+            )
+
+        if chunks is not None:
+            progress = pu.ProgressReporter(None, progress_interval, metrics)
+            id.import_data_stream(
+                fw,
+                chunks,
+                group,
+                project,
+                output_dir,
+                dry_run,
+                max_workers,
+                async_client,
+                journal,
+                delta_import,
+                progress,
+                match_by,
+                report_format,
+                route_by_project,
+                snapshot_cache,
+                plan,
+                plan_entries,
+                report_columns,
+            )
+            if snapshot_cache is not None:
+                snapshot_cache.save(upload=not dry_run)
+            return exit_status
 
         # import the csv file as a dataframe
-        df = ld.load_text_dataframe(csv_file, first_row, delimiter)
-
-        # Format the data for ROI's from the data headers and upload to flywheel
-        df = id.import_data(fw, df, group, project, dry_run)
+        with mu.phase(fw, "load"):
+            if ld.is_arrow_file(csv_file):
+                df = ld.load_arrow_dataframe(csv_file, ROI.INPUT_HDRS)
+            else:
+                df = ld.load_text_dataframe(csv_file, first_row, delimiter)
+
+        progress = pu.ProgressReporter(len(df), progress_interval, metrics)
+        if plan_entries is not None:
+            df = id.apply_plan(
+                fw,
+                df,
+                plan_entries,
+                dry_run,
+                max_workers,
+                journal=journal,
+                delta=delta_import,
+                progress=progress,
+            )
+        else:
+            # Format the data for ROI's from the data headers and upload to flywheel,
+            # into the gear's project, or each row's own project
+            import_data = id.import_data_by_project if route_by_project else id.import_data
+            df = import_data(
+                fw,
+                df,
+                group,
+                project,
+                dry_run,
+                max_workers,
+                async_client,
+                journal=journal,
+                delta=delta_import,
+                progress=progress,
+                match_by=match_by,
+                hierarchy_cache=snapshot_cache,
+                plan=plan,
+            )
+        if plan is not None:
+            plan.record_results(df)
+        if snapshot_cache is not None:
+            snapshot_cache.save(upload=not dry_run)
 
         # Save a report
-        cu.save_df_to_csv(df, output_dir)
+        with mu.phase(fw, "report"):
+            with cu.ReportWriter(output_dir, report_format) as report:
+                report.write(df)
 
     except Exception as e:
         log.exception(e)
         exit_status = 1
 
+    finally:
+        if journal is not None:
+            journal.close()
+        if plan is not None:
+            plan.close()
+        if plan_entries is not None:
+            plan_entries.close()
+        metrics.save(output_dir)
+
     return exit_status
 
 
@@ -81,6 +271,24 @@ def process_gear_inputs(context):
             rite data)
         output_dir (Pathlike): The directory to save gear outputs to
         log (logging.Logger): A logger to be used in the rest of the gear.
+        max_workers (integer): The number of sessions to import concurrently.
+        async_requests (boolean): Read and write sessions with the asyncio client.
+        max_in_flight (integer): The most requests the asyncio client keeps in flight.
+        chunk_size (integer): The number of rows to stream at a time (0 to load the
+            whole file).
+        cache_size (integer): The number of containers to keep in the client's cache.
+        cache_ttl (float): Seconds after which a cached container expires.
+        journal_file (Pathlike): The journal of a previous run to resume, or None
+        delta_import (boolean): Only import the rows that are not already on their
+            session.
+        requests_per_second (float): The most API requests to make per second.
+        max_retries (integer): The number of times to retry a transient failure.
+        progress_interval (float): The least number of seconds between progress lines.
+        match_by (string): How rows are matched to files, "labels" or "dicom_uids".
+        report_format (string): The format of the status report.
+        route_by_project (boolean): Route rows by their group/project columns.
+        hierarchy_cache (string): Where to keep the hierarchy cache, if anywhere.
+        plan_file (Pathlike): The plan of a dry run to apply, or None
 
     """
 
@@ -92,11 +300,14 @@ def process_gear_inputs(context):
         if inp["base"] == "api-key" and inp["key"]:
             api_key = inp["key"]
 
-    # Setup basic logging and log the configuration for this job
-    if config["gear_log_level"] == "INFO":
+    # Setup basic logging and log the configuration for this job.  "SUMMARY" logs at
+    # the INFO level, but without the messages logged for every row.
+    log_level = config["gear_log_level"]
+    if log_level in ("INFO", "SUMMARY"):
         context.init_logging("info")
     else:
         context.init_logging("debug")
+    pu.set_row_logging(log_level != "SUMMARY")
     context.log_config()
 
     # Get the path of the CSV file provided by the user
@@ -122,7 +333,7 @@ def process_gear_inputs(context):
 
     # Extract the various config options from the gear's config.json file.
     # These options are created in the manifest and set by the user upon runtime.
-    dry_run = config.get("dry-run", False)
+    dry_run = config.get("dry_run", False)
     log.debug(f"dry_run is {dry_run}")
 
     first_row = config.get("first_row", 1)
@@ -131,6 +342,57 @@ def process_gear_inputs(context):
     delimiter = config.get("delimiter", ",")
     log.debug(f"Using Delimiter: {delimiter}")
 
+    max_workers = max(config.get("max_workers", 1), 1)
+    log.debug(f"Importing with {max_workers} workers")
+
+    async_requests = config.get("async_requests", False)
+    log.debug(f"async_requests is {async_requests}")
+
+    max_in_flight = max(config.get("max_in_flight", 100), 1)
+    log.debug(f"Keeping up to {max_in_flight} async requests in flight")
+
+    chunk_size = config.get("chunk_size", 0)
+    log.debug(f"Streaming {chunk_size} rows at a time")
+
+    delta_import = config.get("delta_import", False)
+    log.debug(f"delta_import is {delta_import}")
+
+    match_by = config.get("match_by", id.MATCH_BY_LABELS)
+    log.debug(f"Matching rows to files by {match_by}")
+
+    report_format = config.get("report_format", "csv")
+    log.debug(f"Writing the status report as {report_format}")
+
+    route_by_project = config.get("route_by_project", False)
+    log.debug(f"route_by_project is {route_by_project}")
+
+    hierarchy_cache = config.get("hierarchy_cache") or None
+    log.debug(f"Hierarchy cache: {hierarchy_cache}")
+
+    requests_per_second = config.get("requests_per_second", 0)
+    max_retries = config.get("max_retries", 5)
+    log.debug(
+        f"Making up to {requests_per_second or 'unlimited'} requests per second, "
+        f"with {max_retries} retries"
+    )
+
+    progress_interval = config.get("progress_interval", 30)
+    log.debug(f"Logging progress every {progress_interval} seconds")
+
+    cache_size = config.get("cache_size", 1024)
+    cache_ttl = config.get("cache_ttl", 0)
+    log.debug(f"Caching up to {cache_size} containers for {cache_ttl or 'unlimited'} seconds")
+
+    # The journal of a previous, interrupted run is optional
+    journal_file = context.get_input_path("journal")
+    if journal_file is not None:
+        log.info(f"Resuming the import recorded in {journal_file}")
+
+    # So is the plan of a dry run, which is then applied
+    plan_file = context.get_input_path("plan")
+    if plan_file is not None:
+        log.info(f"Applying the plan {plan_file}")
+
     # Check to make sure we have a valid destination container for this gear.
     destination_level = context.destination.get("type")
     if destination_level is None:
@@ -147,7 +409,31 @@ def process_gear_inputs(context):
     # dest_container = fw.get(destination_id)
     # project = dest_container.parents.get("project")
 
-    return csv_file, first_row, delimiter, api_key, dry_run, output_dir, destination
+    return (
+        csv_file,
+        first_row,
+        delimiter,
+        api_key,
+        dry_run,
+        output_dir,
+        destination,
+        max_workers,
+        async_requests,
+        chunk_size,
+        cache_size,
+        cache_ttl,
+        journal_file,
+        delta_import,
+        requests_per_second,
+        max_retries,
+        progress_interval,
+        match_by,
+        report_format,
+        route_by_project,
+        hierarchy_cache,
+        plan_file,
+        max_in_flight,
+    )
 
 
 if __name__ == "__main__":
@@ -159,8 +445,48 @@ if __name__ == "__main__":
         api_key,
         dry_run,
         output_dir,
-        destination
+        destination,
+        max_workers,
+        async_requests,
+        chunk_size,
+        cache_size,
+        cache_ttl,
+        journal_file,
+        delta_import,
+        requests_per_second,
+        max_retries,
+        progress_interval,
+        match_by,
+        report_format,
+        route_by_project,
+        hierarchy_cache,
+        plan_file,
+        max_in_flight,
     ) = process_gear_inputs(gt.GearToolkitContext())
 
-    result = main(csv_file, first_row, delimiter, api_key, dry_run, output_dir, destination)
+    result = main(
+        csv_file,
+        first_row,
+        delimiter,
+        api_key,
+        dry_run,
+        output_dir,
+        destination,
+        max_workers,
+        async_requests,
+        chunk_size,
+        cache_size,
+        cache_ttl,
+        journal_file,
+        delta_import,
+        requests_per_second,
+        max_retries,
+        progress_interval,
+        match_by,
+        report_format,
+        route_by_project,
+        hierarchy_cache,
+        plan_file,
+        max_in_flight,
+    )
     sys.exit(result)
\ No newline at end of file
@@ -0,0 +1,62 @@
+import csv
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import run  # noqa: E402
+from benchmarks import fake_flywheel as ff  # noqa: E402
+
+
+@pytest.fixture
+def fake_project():
+    """A fake Flywheel server with a project of one subject, session and file"""
+    fake = ff.FakeFlywheel()
+    project, analysis = ff.generate_project(fake, 1)
+    with ff.FakeFlywheelServer(fake) as server:
+        yield fake, project, analysis, server
+
+
+@pytest.fixture
+def import_rows(fake_project, tmp_path):
+    """Import a list of row dicts with `run.main`, returning the status report"""
+    fake, project, analysis, server = fake_project
+    runs = []
+
+    def import_rows_(rows, **kwargs):
+        output_dir = tmp_path / f"run{len(runs)}"
+        output_dir.mkdir()
+        csv_file = output_dir / "input.csv"
+        with open(csv_file, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+        run.main(
+            csv_file,
+            1,
+            ",",
+            server.api_key,
+            kwargs.pop("dry_run", False),
+            output_dir,
+            {"id": analysis["_id"]},
+            **kwargs,
+        )
+        runs.append(output_dir)
+        return pd.read_csv(output_dir / "Data_Import_Status_report.csv")
+
+    return import_rows_
+
+
+def session_rois(fake):
+    """Every measurement on the fake server's sessions"""
+    return [
+        roi
+        for container in fake.containers.values()
+        if container.get("container_type") == "session"
+        for rois in container["info"].get("ohifViewer", {}).get("measurements", {}).values()
+        for roi in rois
+    ]
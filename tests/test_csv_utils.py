@@ -0,0 +1,181 @@
+import numpy as np
+import pandas as pd
+
+from utils import ROI_Template as ROI
+from utils import csv_utils as cu
+from utils import load_data as ld
+
+
+def frame(**columns):
+    return pd.DataFrame(columns)
+
+
+def error_list(errors):
+    return [None if pd.isnull(error) else error for error in errors]
+
+
+ROWS = {
+    ROI.SUBJECT_HDR: ["sub-1", "sub-1", "sub-2"],
+    ROI.SESSION_HDR: ["ses-1", "ses-1", "ses-1"],
+    ROI.MAPPING_COLUMN: ["a.dcm", "a.dcm", "b.dcm"],
+    ROI.XMIN_HDR: [10, 20, 30],
+    ROI.YMIN_HDR: [10, 20, 30],
+    ROI.XMAX_HDR: [15, 25, 35],
+    ROI.YMAX_HDR: [15, 25, 35],
+    ROI.ROITYPE_HDR: ["RectangleRoi", "RectangleRoi", "EllipticalRoi"],
+    ROI.DESCRIPTION_HDR: ["one", "two", None],
+}
+
+
+def test_row_hashes_do_not_depend_on_the_parsed_type():
+    ints = frame(**{ROI.XMIN_HDR: [10, 11], "label": ["a", None]})
+    floats = frame(**{ROI.XMIN_HDR: [10.0, 11.0], "label": ["a", np.nan]})
+    text = frame(**{ROI.XMIN_HDR: ["10", "11"], "label": ["a", None]})
+
+    hashes = cu.get_row_hashes(ints).tolist()
+    assert cu.get_row_hashes(floats).tolist() == hashes
+    assert cu.get_row_hashes(text).tolist() == hashes
+
+
+def test_row_hashes_do_not_depend_on_the_other_rows():
+    df = pd.DataFrame(ROWS)
+    # One non-whole value turns the whole column into floats
+    wider = pd.concat([df, pd.DataFrame({**ROWS, ROI.XMIN_HDR: [10.5] * 3})], ignore_index=True)
+
+    assert wider[ROI.XMIN_HDR].dtype == float
+    assert cu.get_row_hashes(wider)[:3].tolist() == cu.get_row_hashes(df).tolist()
+    assert cu.get_row_hashes(df.iloc[1:]).tolist() == cu.get_row_hashes(df)[1:].tolist()
+
+
+def test_row_hashes_ignore_column_order_empty_columns_and_the_report():
+    df = pd.DataFrame(ROWS)
+    hashes = cu.get_row_hashes(df).tolist()
+
+    shuffled = df[df.columns[::-1]]
+    report = df.assign(Gear_Status="Success", Gear_FW_Location="x", Gear_Error=None)
+    empty = df.assign(location=None)
+
+    assert cu.get_row_hashes(shuffled).tolist() == hashes
+    assert cu.get_row_hashes(report).tolist() == hashes
+    assert cu.get_row_hashes(empty).tolist() == hashes
+
+
+def test_row_hashes_change_with_the_content():
+    df = pd.DataFrame(ROWS)
+    edited = df.copy()
+    edited.loc[1, ROI.DESCRIPTION_HDR] = "edited"
+    # The same values in another column are another row
+    swapped = df.rename(columns={ROI.XMIN_HDR: ROI.YMIN_HDR, ROI.YMIN_HDR: ROI.XMIN_HDR})
+    swapped[ROI.XMIN_HDR] = [1, 2, 3]
+
+    hashes = cu.get_row_hashes(df)
+    assert hashes.is_unique
+    assert (cu.get_row_hashes(edited) == hashes).tolist() == [True, False, True]
+    assert not cu.get_row_hashes(swapped).isin(hashes).any()
+
+
+def test_row_keys_are_the_file_and_roi_type():
+    df = pd.DataFrame(ROWS)
+    keys = cu.get_row_keys(df)
+
+    # Rows on the same file with the same roi type share a key, whatever their content
+    assert keys[0] == keys[1]
+    assert keys[0] != keys[2]
+    assert cu.get_row_keys(df.assign(**{ROI.ROITYPE_HDR: "EllipticalRoi"}))[0] != keys[0]
+
+
+def test_row_keys_do_not_depend_on_the_row_order():
+    df = pd.DataFrame(ROWS)
+    keys = cu.get_row_keys(df)
+    inserted = pd.concat([df.iloc[[2]], df], ignore_index=True)
+
+    assert cu.get_row_keys(df.iloc[::-1]).sort_index().tolist() == keys.tolist()
+    assert cu.get_row_keys(inserted)[1:].tolist() == keys.tolist()
+
+
+def test_validate_rows_flags_the_first_problem_of_each_row():
+    df = pd.DataFrame(
+        {
+            **ROWS,
+            ROI.SUBJECT_HDR: ["sub-1", None, "sub-2"],
+            ROI.XMIN_HDR: [10, 20, "abc"],
+            ROI.ROITYPE_HDR: ["RectangleRoi", "Nope", "Nope"],
+        }
+    )
+
+    errors = cu.validate_rows(df)
+
+    assert error_list(errors) == [
+        None,
+        f"no {ROI.SUBJECT_HDR}",
+        f"{ROI.XMIN_HDR} is not a finite number",
+    ]
+
+
+def test_validate_rows_flags_invalid_roi_types_and_duplicates():
+    df = pd.DataFrame(ROWS)
+    df = pd.concat([df, df.iloc[[0]]], ignore_index=True)
+    df.loc[2, ROI.ROITYPE_HDR] = "Polygon"
+
+    errors = cu.validate_rows(df)
+
+    assert error_list(errors) == [None, None, "invalid roi type Polygon", "duplicate of row 0"]
+
+
+def test_validate_rows_needs_the_match_columns():
+    df = pd.DataFrame(ROWS)
+
+    assert cu.validate_rows(df, cu.UID_COLUMNS).tolist() == [
+        f"missing column {ROI.SOPINSTANCEUID_HDR}"
+    ] * 3
+    assert cu.validate_rows(df.drop(columns=ROI.YMAX_HDR)).notnull().all()
+    assert cu.validate_rows(df.assign(**{ROI.UUID_KWD: "x"})).notnull().all()
+
+
+def test_measurements_have_python_values_and_none_for_missing_cells():
+    df = ld.to_native(
+        pd.DataFrame(
+            dict(ROWS, **{ROI.MEAN_HDR: [1.5, np.nan, 2.0], ROI.DESCRIPTION_HDR: ["a", np.nan, "c"]})
+        )
+    )
+    assert df[ROI.MEAN_HDR].dtype == float
+    assert df[ROI.DESCRIPTION_HDR].tolist() == ["a", None, "c"]
+
+    measurements = cu.get_measurements_from_df(df)
+    stats = [measurements[i][ROI.CACHEDSTATS_KWD] for i in df.index]
+    assert [s[ROI.MEAN_KWD] for s in stats] == [1.5, None, 2.0]
+    assert [type(s[ROI.AREA_KWD]) for s in stats] == [float] * 3
+    assert [measurements[i][ROI.DESCRIPTION_KWD] for i in df.index] == ["a", None, "c"]
+
+
+def write_report(tmp_path, report_format, chunks, columns=None):
+    with cu.ReportWriter(tmp_path, report_format, columns) as report:
+        for chunk in chunks:
+            report.write(chunk)
+    if report_format == "parquet":
+        return pd.read_parquet(report.path).fillna("")
+    return pd.read_csv(report.path, dtype=str, keep_default_na=False)
+
+
+def test_report_chunks_are_written_by_column_name(tmp_path):
+    chunks = [
+        frame(a=["1"], b=["x"], Status=["Success"]),
+        frame(b=["y"], c=["2"], a=["3"], Status=["Failed"]),
+    ]
+    for report_format in ["csv", "csv.gz", "parquet"]:
+        report = write_report(tmp_path, report_format, chunks, columns=["a", "c", "b"])
+        assert list(report.columns) == ["a", "c", "b", "Status"]
+        assert report.to_dict("list") == {
+            "a": ["1", "3"],
+            "c": ["", "2"],
+            "b": ["x", "y"],
+            "Status": ["Success", "Failed"],
+        }
+
+
+def test_report_leaves_out_columns_not_in_its_header(tmp_path, caplog):
+    chunks = [frame(a=["1"], Status=["Success"]), frame(a=["2"], d=["?"], Status=["Failed"])]
+    for report_format in ["csv", "parquet"]:
+        report = write_report(tmp_path, report_format, chunks)
+        assert report.to_dict("list") == {"a": ["1", "2"], "Status": ["Success", "Failed"]}
+    assert "['d'] are not in the report's header" in caplog.text
@@ -0,0 +1,124 @@
+from conftest import session_rois
+
+
+def roi(description, x_min):
+    """A row placing a RectangleRoi on the fake project's only file"""
+    return {
+        "subject": "sub-00000",
+        "session": "ses-000",
+        "file": "image-0-0-0-0.dcm",
+        "x min": x_min,
+        "x max": x_min + 20,
+        "y min": 10,
+        "y max": 30,
+        "roi type": "RectangleRoi",
+        "description": description,
+    }
+
+
+A = roi("A", 0)
+B = roi("B", 40)
+C = roi("C", 80)
+X = roi("X", 120)
+
+
+def descriptions(fake):
+    return sorted(r["description"] for r in session_rois(fake))
+
+
+def test_inserted_row_keeps_the_rows_below(fake_project, import_rows):
+    fake = fake_project[0]
+    import_rows([A, B], delta_import=True)
+
+    report = import_rows([X, A, B], delta_import=True)
+
+    assert report["Gear_Status"].tolist() == ["Success", "Unchanged", "Unchanged"]
+    assert descriptions(fake) == ["A", "B", "X"]
+
+
+def test_inserted_row_keeps_the_rows_below_in_chunks(fake_project, import_rows):
+    fake = fake_project[0]
+    import_rows([A, B], delta_import=True, chunk_size=1)
+
+    report = import_rows([X, A, B], delta_import=True, chunk_size=1)
+
+    assert report["Gear_Status"].tolist() == ["Success", "Unchanged", "Unchanged"]
+    assert descriptions(fake) == ["A", "B", "X"]
+
+
+def test_deleted_row_leaves_the_others_unchanged(fake_project, import_rows):
+    fake = fake_project[0]
+    import_rows([A, B, C], delta_import=True)
+
+    report = import_rows([A, C], delta_import=True)
+
+    assert report["Gear_Status"].tolist() == ["Unchanged", "Unchanged"]
+    # Delta imports don't delete the ROI's of rows taken out of the file
+    assert descriptions(fake) == ["A", "B", "C"]
+
+
+def test_reordered_rows_are_unchanged(fake_project, import_rows):
+    fake = fake_project[0]
+    import_rows([A, B, C], delta_import=True)
+
+    report = import_rows([C, A, B], delta_import=True)
+
+    assert report["Gear_Status"].tolist() == ["Unchanged"] * 3
+    assert descriptions(fake) == ["A", "B", "C"]
+
+
+def test_edited_row_replaces_its_roi(fake_project, import_rows):
+    fake = fake_project[0]
+    import_rows([A, B], delta_import=True)
+
+    report = import_rows([dict(A, description="A2"), B], delta_import=True)
+
+    assert report["Gear_Status"].tolist() == ["Success", "Unchanged"]
+    assert descriptions(fake) == ["A2", "B"]
+
+
+def test_edited_row_with_unchanged_coordinates_is_not_a_duplicate(
+    fake_project, import_rows
+):
+    fake = fake_project[0]
+    import_rows([A], delta_import=True)
+
+    report = import_rows([dict(A, description="A2")], delta_import=True)
+
+    assert report["Gear_Status"].tolist() == ["Success"]
+    assert descriptions(fake) == ["A2"]
+
+
+def test_inserted_and_edited_rows(fake_project, import_rows):
+    fake = fake_project[0]
+    import_rows([A, B], delta_import=True)
+
+    report = import_rows([X, dict(A, **{"x min": 5}, description="A2"), B], delta_import=True)
+
+    assert report["Gear_Status"].tolist() == ["Success", "Success", "Unchanged"]
+    assert descriptions(fake) == ["A2", "B", "X"]
+    assert len(session_rois(fake)) == 3
+
+
+def test_plan_of_an_edit_replaces_the_roi(fake_project, import_rows, tmp_path):
+    fake = fake_project[0]
+    import_rows([A, B], delta_import=True)
+    rows = [X, dict(A, description="A2"), B]
+
+    import_rows(rows, delta_import=True, dry_run=True)
+    assert descriptions(fake) == ["A", "B"]
+    plan_file = tmp_path / "run1" / "Data_Import_Plan.jsonl.gz"
+    report = import_rows(rows, delta_import=True, plan_file=plan_file)
+
+    assert report["Gear_Status"].tolist() == ["Success", "Success", "Unchanged"]
+    assert descriptions(fake) == ["A2", "B", "X"]
+
+
+def test_without_delta_an_edited_row_is_added(fake_project, import_rows):
+    fake = fake_project[0]
+    import_rows([A])
+
+    report = import_rows([A, dict(A, description="A2")])
+
+    assert report["Gear_Status"].tolist() == ["Failed", "Failed"]
+    assert descriptions(fake) == ["A"]
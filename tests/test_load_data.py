@@ -0,0 +1,60 @@
+import pandas as pd
+
+from utils import csv_utils as cu
+from utils import load_data as ld
+
+
+def chunks_of(df, chunk_size):
+    return (df.iloc[start : start + chunk_size] for start in range(0, len(df), chunk_size))
+
+
+def grouped(sessions, chunk_size):
+    df = pd.DataFrame({"subject": "sub-1", "session": sessions, "n": range(len(sessions))})
+    chunks = ld.group_chunks_by_session(
+        chunks_of(df, chunk_size), chunk_size, ["subject", "session"]
+    )
+    return [chunk["session"].tolist() for chunk in chunks]
+
+
+def test_contiguous_sessions_keep_the_file_order():
+    chunks = grouped(["a", "a", "a", "b", "b", "c", "d", "d"], 2)
+
+    assert chunks == [["a", "a", "a"], ["b", "b"], ["c"], ["d", "d"]]
+
+
+def test_spread_sessions_are_brought_into_one_chunk():
+    sessions = ["a", "b", "c", "a", "b", "c", "d", "a"]
+    chunks = grouped(sessions, 3)
+
+    assert sorted(session for chunk in chunks for session in chunk) == sorted(sessions)
+    for session in "abcd":
+        assert sum(session in chunk for chunk in chunks) == 1
+
+
+def test_rows_keep_their_index():
+    sessions = ["a", "b", "a", "b"]
+    df = pd.DataFrame({"subject": "sub-1", "session": sessions, "n": range(4)})
+    chunks = list(ld.group_chunks_by_session(chunks_of(df, 1), 1, ["subject", "session"]))
+
+    assert pd.concat(chunks).sort_index().equals(df)
+    for chunk in chunks:
+        assert (chunk.index == chunk["n"]).all()
+
+
+def test_chunks_without_the_session_columns_are_given_back():
+    df = pd.DataFrame({"subject": ["sub-1", "sub-2"], "n": [0, 1]})
+    chunks = list(ld.group_chunks_by_session(chunks_of(df, 1), 1, ["subject", "session"]))
+
+    assert [chunk["n"].tolist() for chunk in chunks] == [[0], [1]]
+
+
+def test_arrow_files_keep_the_forbidden_columns(tmp_path, caplog):
+    path = tmp_path / "rois.parquet"
+    pd.DataFrame({"subject": ["sub-1"], "imagePath": ["a$$$b"], "notes": ["?"]}).to_parquet(path)
+
+    df = ld.load_arrow_dataframe(path, ["subject", "session"])
+
+    assert list(df.columns) == ["subject", "imagePath"]
+    assert "['notes']" in caplog.text
+    errors = cu.validate_rows(df, cu.LABEL_COLUMNS)
+    assert errors.tolist() == ["forbidden column imagePath"]
@@ -0,0 +1,32 @@
+import pandas as pd
+
+from utils import plan_utils as pl
+
+
+def test_read_plan_looks_up_each_row(tmp_path):
+    plan = pl.Plan(tmp_path / pl.PLAN_FILE)
+    plan.record("ses-1", [(0, "a1", "file-1", "g/p/s", {"x": 1}), (2, "c3", "file-1", "g/p/s", {"x": 3})])
+    plan.record_results(
+        pd.DataFrame(
+            {"Gear_Status": ["Failed"], "Gear_FW_Location": [None], "Gear_Error": ["no file"]},
+            index=[1],
+        )
+    )
+    plan.close()
+
+    entries = pl.read_plan(tmp_path / pl.PLAN_FILE)
+    try:
+        assert len(entries) == 3 and 2 in entries and 3 not in entries
+        assert entries.get(2) == {
+            "index": 2,
+            "row": "c3",
+            "file_id": "file-1",
+            "address": "g/p/s",
+            "measurement": {"x": 3},
+            "session_id": "ses-1",
+        }
+        assert entries.get(1) == {"index": 1, "status": "Failed", "address": None, "error": "no file"}
+        assert entries.get(0)["measurement"] == {"x": 1}
+        assert entries.get(3) is None
+    finally:
+        entries.close()
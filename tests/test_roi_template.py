@@ -0,0 +1,131 @@
+from utils import ROI_Template as ROI
+
+
+def measurement(x1, y1=0.0, tool_type="RectangleRoi", sop="1.2.3", **fields):
+    return {
+        ROI.HANDLE_KWD: {
+            ROI.START_KWD: {ROI.X_KWD: x1, ROI.Y_KWD: y1},
+            ROI.END_KWD: {ROI.X_KWD: x1 + 10, ROI.Y_KWD: y1 + 10},
+        },
+        ROI.SOPINSTANCEUID_KWD: sop,
+        ROI.ROITYPE_KWD: tool_type,
+        **fields,
+    }
+
+
+def imported(x1, key, fingerprint, **fields):
+    return measurement(x1, **{ROI.ROWKEY_KWD: key, ROI.FINGERPRINT_KWD: fingerprint}, **fields)
+
+
+def session_info(*rois):
+    by_type = {}
+    for roi in rois:
+        by_type.setdefault(roi[ROI.ROITYPE_KWD], []).append(roi)
+    return {ROI.NAMESPACE_KWD: {ROI.MEASUREMENTS_KWD: by_type}}
+
+
+def rois_of(info, tool_type="RectangleRoi"):
+    return info[ROI.NAMESPACE_KWD][ROI.MEASUREMENTS_KWD][tool_type]
+
+
+def test_duplicate_index_matches_coordinates_to_4_decimals():
+    duplicates = ROI.DuplicateIndex(session_info(measurement(1.23456)))
+
+    assert measurement(1.23459) in duplicates
+    assert measurement(1.2346) not in duplicates
+    assert measurement(1.23456, tool_type="EllipticalRoi") not in duplicates
+    assert measurement(1.23456, sop="other") not in duplicates
+
+
+def test_duplicate_index_add_and_remove():
+    duplicates = ROI.DuplicateIndex()
+    roi = measurement(5)
+
+    duplicates.add(roi)
+    assert roi in duplicates
+    duplicates.remove(roi)
+    assert roi not in duplicates
+
+
+def test_duplicate_index_skips_lists_that_are_not_lists():
+    info = session_info(measurement(1))
+    info[ROI.NAMESPACE_KWD][ROI.MEASUREMENTS_KWD]["Broken"] = {"not": "a list"}
+
+    assert measurement(1) in ROI.DuplicateIndex(info)
+
+
+def test_add_measurement_to_info_rejects_duplicates():
+    info = session_info(measurement(1))
+
+    assert ROI.add_measurement_to_info(info, measurement(2))
+    assert not ROI.add_measurement_to_info(info, measurement(2))
+    assert [roi[ROI.HANDLE_KWD][ROI.START_KWD][ROI.X_KWD] for roi in rois_of(info)] == [1, 2]
+
+
+def test_add_measurement_to_info_creates_the_namespace():
+    info = {}
+
+    assert ROI.add_measurement_to_info(info, measurement(1, tool_type="EllipticalRoi"))
+    assert len(rois_of(info, "EllipticalRoi")) == 1
+
+
+def test_stale_measurements_are_those_whose_rows_are_gone():
+    a, b = imported(1, "key", "a"), imported(2, "key", "b")
+    info = session_info(a, b, measurement(3))
+
+    assert ROI.get_stale_measurements(info, {"a", "b"}) == {}
+    assert ROI.get_stale_measurements(info, {"b"}) == {"key": [a]}
+    assert ROI.get_stale_measurements(info, set()) == {"key": [a, b]}
+
+
+def test_replace_mode_replaces_a_stale_roi():
+    a, b = imported(1, "key", "a"), imported(2, "key", "b")
+    info = session_info(a, b)
+    stale = ROI.get_stale_measurements(info, {"b", "a2"})
+    duplicates = ROI.DuplicateIndex(info)
+
+    # The edited row has the same coordinates as the ROI it replaces
+    a2 = imported(1, "key", "a2", description="edited")
+    assert ROI.add_measurement_to_info(info, a2, duplicates, stale)
+
+    assert rois_of(info) == [b, a2]
+    assert stale == {"key": []}
+    assert measurement(1) in duplicates
+
+
+def test_replace_mode_keeps_rois_whose_rows_are_still_there():
+    a, b = imported(1, "key", "a"), imported(2, "key", "b")
+    info = session_info(a, b)
+    stale = ROI.get_stale_measurements(info, {"x", "a", "b"})
+
+    assert ROI.add_measurement_to_info(info, imported(3, "key", "x"), stale=stale)
+
+    assert len(rois_of(info)) == 3
+
+
+def test_replace_mode_leaves_the_roi_when_the_new_one_is_a_duplicate():
+    a, b = imported(1, "key", "a"), imported(2, "key", "b")
+    info = session_info(a, b)
+    stale = ROI.get_stale_measurements(info, {"b", "a2"})
+    duplicates = ROI.DuplicateIndex(info)
+
+    # The edited row now has the coordinates of another ROI
+    assert not ROI.add_measurement_to_info(info, imported(2, "key", "a2"), duplicates, stale)
+
+    assert rois_of(info) == [a, b]
+    assert stale == {"key": [a]}
+    assert measurement(1) in duplicates
+
+
+def test_copy_measurements_leaves_the_info_unchanged():
+    a = imported(1, "key", "a")
+    info = session_info(a)
+    copy = ROI.copy_measurements(info)
+
+    assert ROI.add_measurement_to_info(copy, measurement(2))
+    assert ROI.add_measurement_to_info(
+        copy, imported(1, "key", "a2"), stale=ROI.get_stale_measurements(copy, set())
+    )
+
+    assert rois_of(info) == [a]
+    assert len(rois_of(copy)) == 2
@@ -0,0 +1,76 @@
+import pytest
+
+from utils import scheduler_utils as su
+
+
+class Refused(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"status {status}")
+        self.status = status
+        self.headers = {"Retry-After": retry_after} if retry_after else {}
+
+
+def test_token_bucket_without_a_rate_never_waits():
+    bucket = su.TokenBucket(0)
+
+    assert [bucket.reserve() for _ in range(100)] == [0.0] * 100
+
+
+def test_token_bucket_allows_a_burst_then_paces_requests():
+    bucket = su.TokenBucket(rate=10, burst=2)
+
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_token_bucket_pause_holds_back_every_request():
+    bucket = su.TokenBucket(0)
+    bucket.pause(5)
+
+    assert bucket.reserve() == pytest.approx(5, abs=0.1)
+
+
+def test_retry_delay_only_retries_transient_failures():
+    scheduler = su.RequestScheduler(max_retries=2, backoff=0.01)
+
+    assert scheduler.retry_delay(0, status=404) is None
+    assert scheduler.retry_delay(0, status=503) is not None
+    assert scheduler.retry_delay(1, status=502) is not None
+    assert scheduler.retry_delay(2, status=503) is None
+    assert scheduler.retries == {"503": 1, "502": 1}
+    assert scheduler.exhausted == 1
+
+
+def test_retry_delay_waits_for_retry_after_and_pauses_the_bucket():
+    scheduler = su.RequestScheduler(backoff=0.01)
+
+    assert scheduler.retry_delay(0, status=429, retry_after="3") == 3
+    assert scheduler.bucket.reserve() == pytest.approx(3, abs=0.1)
+
+
+def test_call_retries_until_the_request_succeeds(monkeypatch):
+    monkeypatch.setattr(su.time, "sleep", lambda seconds: None)
+    scheduler = su.RequestScheduler(max_retries=3, backoff=0.01)
+    outcomes = [Refused(503), Refused(502), "done"]
+
+    def request():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert scheduler.call(request) == "done"
+    assert sum(scheduler.retries.values()) == 2
+
+
+def test_call_raises_errors_that_are_not_transient():
+    scheduler = su.RequestScheduler()
+
+    def request():
+        raise Refused(404)
+
+    with pytest.raises(Refused):
+        scheduler.call(request)
+    assert not scheduler.retries
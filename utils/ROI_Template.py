@@ -3,11 +3,13 @@ import logging
 import math
 import pprint
 
+import numpy as np
 
-from utils import fwobject_utils as fu
+from utils import progress_utils as pu
 
 logging.basicConfig(level="INFO")
 log = logging.getLogger("ROI")
+row_log = logging.getLogger(pu.ROW_LOGGER)
 
 
 # optional = ['visible',
@@ -169,6 +171,48 @@ SERIESINSTANCEUID_HDR = "SeriesInstanceUID"
 SOPINSTANCEUID_HDR = "SOPInstanceUID"
 STUDYINSTANCEUID_HDR = "StudyInstanceUID"
 
+# Every column of the input file the gear reads
+INPUT_HDRS = [
+    ACTIVE_HDR,
+    GROUP_HDR,
+    PROJECT_HDR,
+    SUBJECT_HDR,
+    SESSION_HDR,
+    FILE_HDR,
+    DICOMMEMBER_HDR,
+    FILETYPE_HDR,
+    LOCATION_HDR,
+    DESCRIPTION_HDR,
+    XMIN_HDR,
+    XMAX_HDR,
+    YMIN_HDR,
+    YMAX_HDR,
+    USERORIGIN_HDR,
+    VISIBLE_HDR,
+    ROITYPE_HDR,
+    HIGHLIGHT_HDR,
+    HEIGHT_HDR,
+    LEFT_HDR,
+    RIGHT_HDR,
+    TOP_HDR,
+    WIDTH_HDR,
+    ALLOWEDOUTSIDE_HDR,
+    DRAWNINDEPENDENTLY_HDR,
+    HASBOUNDINGBOX_HDR,
+    HASMOVED_HDR,
+    MOVESINDEPENDENTLY_HDR,
+    INITIALROTATION_HDR,
+    AREA_HDR,
+    COUNT_HDR,
+    MAX_HDR,
+    MEAN_HDR,
+    MIN_HDR,
+    STDDEV_HDR,
+    VARIANCE_HDR,
+    SERIESINSTANCEUID_HDR,
+    SOPINSTANCEUID_HDR,
+    STUDYINSTANCEUID_HDR,
+]
 
 # suffix _KWD means These are KEYWORDS for the metadata.
 RECTANGLE_KWD = "RectangleRoi"
@@ -226,6 +270,8 @@ LESIONNAMINGNUMBER_KWD = "lesionNamingNumber"
 MEASUREMENTNUMBER_KWD = "measurementNumber"
 
 IMPORTMETHOD_KWD = "ImportMethod"
+FINGERPRINT_KWD = "ImportFingerprint"
+ROWKEY_KWD = "ImportRowKey"
 
 
 MEASUREMENTS_KWD = "measurements"
@@ -251,6 +297,8 @@ MANDATORY_KWD = [
 
 
 class BoundingBox:
+    __slots__ = ("height", "left", "top", "width")
+
     def __init__(self, **kwargs):
         # Initialize to a kind of "catch all" value (good for many use cases)
         # Determined empirically
@@ -270,342 +318,331 @@ class BoundingBox:
         return output_dict
 
 
-class Coords:
-    def __init__(self, x=0.0, y=0.0, active=False, highlight=None):
-        self.x = x
-        self.y = y
-        self.active = active
-        self.highlight = highlight
+class ROIBatch:
+    """The ROI's built from many CSV rows, stored column by column
 
-    def to_dict(self):
-        output_dict = {
-            X_KWD: self.x,
-            Y_KWD: self.y,
-            ACTIVE_KWD: self.active,
-            HIGHLIGHT_KWD: self.highlight,
-        }
+    Holding every ROI of a large CSV as nested dicts takes kilobytes per row, so the
+    batch keeps one array (or list) per ROI property, or a single value for a property
+    that is the same for every row, and only serializes a row into its measurement dict
+    when it is asked for.  It is used like a read-only dict of row index -> measurement,
+    and each lookup returns a new dict.  List columns must hold python values, with None for
+    missing values (see `cu.to_python_list`); numpy arrays are converted as they are read.
 
-        if self.highlight is None:
-            trash = output_dict.pop(HIGHLIGHT_KWD)
+    Args:
+        index (list): The row index of each ROI
+        columns (dict): property -> an array or list with a value per ROI, or a single
+            value shared by every ROI.  See `measurement` for the properties.
+    """
 
-        return output_dict
+    __slots__ = ("positions", "columns", "getters")
 
+    def __init__(self, index, columns):
+        self.positions = {row: position for position, row in enumerate(index)}
+        self.columns = columns
+        self.getters = {key: column_getter(values) for key, values in columns.items()}
 
-class TextBox:
-    def __init__(self, **kwargs):
-        self.coords = Coords(
-            kwargs.get(X_KWD), kwargs.get(Y_KWD), kwargs.get(ACTIVE_KWD)
-        )
-        self.allowedOutsideImage = kwargs.get(ALLOWEDOUTSIDE_KWD, True)
-        self.drawnIndependently = kwargs.get(DRAWNINDEPENDENTLY_KWD, True)
-        self.hasBoundingBox = kwargs.get(HASBOUNDINGBOX_KWD, True)
-        self.hasMoved = kwargs.get(HASMOVED_KWD, False)
-        self.movesIndependently = kwargs.get(MOVESINDEPENDENTLY_KWD, False)
-        self.boundingBox = BoundingBox(**kwargs.get(BOUNDINGBOX_KWD, {}))
-        self.active = kwargs.get(ACTIVE_KWD, False)
+    def __len__(self):
+        return len(self.positions)
 
-    def to_dict(self):
-        output_dict = {
-            ALLOWEDOUTSIDE_KWD: self.allowedOutsideImage,
-            DRAWNINDEPENDENTLY_KWD: self.drawnIndependently,
-            HASBOUNDINGBOX_KWD: self.hasBoundingBox,
-            HASMOVED_KWD: self.hasMoved,
-            MOVESINDEPENDENTLY_KWD: self.movesIndependently,
-            BOUNDINGBOX_KWD: self.boundingBox.to_dict(),
-            ACTIVE_KWD: self.active,
-        }
-        output_dict.update(self.coords.to_dict())
+    def __iter__(self):
+        return iter(self.positions)
 
-        return output_dict
+    def __contains__(self, index):
+        return index in self.positions
 
+    def __getitem__(self, index):
+        return self.measurement(self.positions[index])
 
-class Handle:
-    def __init__(self, **kwargs):
-        self.handle_args = [START_KWD, END_KWD, TEXTBOX_KWD, INITIALROTATION_KWD]
-
-        if START_KWD not in kwargs or END_KWD not in kwargs:
-            log.error(f"ROI requires both '{START_KWD}' and '{END_KWD}'")
-            pass
-
-        start = kwargs.get(START_KWD, {})
-        log.debug("start:")
-        log.debug(start)
-        self.start = Coords(
-            start.get(X_KWD), start.get(Y_KWD), start.get(ACTIVE_KWD, False)
-        )
-        self.start.highlight = start.get(HIGHLIGHT_KWD, True)
-
-        end = kwargs.get(END_KWD, {})
-        log.debug("end:")
-        log.debug(end)
-        self.end = Coords(end.get(X_KWD), end.get(Y_KWD), end.get(ACTIVE_KWD, False))
-        self.end.highlight = end.get(HIGHLIGHT_KWD, True)
-
-        text = kwargs.get(TEXTBOX_KWD, {})
-        if X_KWD not in text:
-            text[X_KWD] = start.get(X_KWD)
-        if Y_KWD not in text:
-            text[Y_KWD] = start.get(Y_KWD) - (start.get(Y_KWD) - end.get(Y_KWD)) / 2.0
-        self.textBox = TextBox(**text)
-
-        self.initialRotation = kwargs.get(INITIALROTATION_KWD, 0)
+    def measurement(self, position):
+        """Serialize one ROI, leaving out the file-specific values and ROI numbers
 
-    def to_dict(self):
+        The start/end coordinates are the "x1", "y1", "x2" and "y2" columns and the text
+        box sits at ("x1", "text_y").  The other columns are keyed by the keyword of
+        the property they hold; the active/highlight columns only set the start handle.
+        """
+        get = self.getters
+        x1 = get["x1"](position)
 
-        output_dict = {
-            START_KWD: self.start.to_dict(),
-            END_KWD: self.end.to_dict(),
-            TEXTBOX_KWD: self.textBox.to_dict(),
-            INITIALROTATION_KWD: self.initialRotation,
+        start = {X_KWD: x1, Y_KWD: get["y1"](position), ACTIVE_KWD: get[ACTIVE_KWD](position)}
+        highlight = get[HIGHLIGHT_KWD](position)
+        if highlight is not None:
+            start[HIGHLIGHT_KWD] = highlight
+        end = {
+            X_KWD: get["x2"](position),
+            Y_KWD: get["y2"](position),
+            ACTIVE_KWD: False,
+            HIGHLIGHT_KWD: False,
+        }
+        text_box = {
+            ALLOWEDOUTSIDE_KWD: get[ALLOWEDOUTSIDE_KWD](position),
+            DRAWNINDEPENDENTLY_KWD: get[DRAWNINDEPENDENTLY_KWD](position),
+            HASBOUNDINGBOX_KWD: get[HASBOUNDINGBOX_KWD](position),
+            HASMOVED_KWD: get[HASMOVED_KWD](position),
+            MOVESINDEPENDENTLY_KWD: get[MOVESINDEPENDENTLY_KWD](position),
+            BOUNDINGBOX_KWD: BoundingBox().to_dict(),
+            ACTIVE_KWD: False,
+            X_KWD: x1,
+            Y_KWD: get["text_y"](position),
         }
-        return output_dict
 
+        if USERORIGIN_KWD in self.columns:
+            origin = {"type": "user", "id": get[USERORIGIN_KWD](position)}
+        else:
+            origin = {"type": "gear", "id": "CSV to ROI Gear"}
+
+        return {
+            HANDLE_KWD: {
+                START_KWD: start,
+                END_KWD: end,
+                TEXTBOX_KWD: text_box,
+                INITIALROTATION_KWD: get[INITIALROTATION_KWD](position),
+            },
+            CACHEDSTATS_KWD: {
+                AREA_KWD: get[AREA_KWD](position),
+                COUNT_KWD: get[COUNT_KWD](position),
+                MAX_KWD: get[MAX_KWD](position),
+                MEAN_KWD: get[MEAN_KWD](position),
+                MIN_KWD: get[MIN_KWD](position),
+                STDDEV_KWD: get[STDDEV_KWD](position),
+                VARIANCE_KWD: get[VARIANCE_KWD](position),
+            },
+            FLYWHEELORIGIN_KWD: origin,
+            SERIESINSTANCEUID_KWD: None,
+            SOPINSTANCEUID_KWD: None,
+            STUDYINSTANCEUID_KWD: None,
+            IMAGEPATH_KWD: None,
+            VISIBLE_KWD: get[VISIBLE_KWD](position),
+            DESCRIPTION_KWD: get[DESCRIPTION_KWD](position),
+            LOCATION_KWD: get[LOCATION_KWD](position),
+            ROITYPE_KWD: get[ROITYPE_KWD](position),
+            LESIONNAMINGNUMBER_KWD: None,
+            MEASUREMENTNUMBER_KWD: None,
+            TIMEPOINTID_KWD: "TimepointId",
+            PATIENTID_KWD: None,
+            ACTIVE_KWD: False,
+            USERID_KWD: "",
+            UUID_KWD: "",
+            ID_KWD: "",
+            IMPORTMETHOD_KWD: "import-rois",
+            FINGERPRINT_KWD: get[FINGERPRINT_KWD](position),
+            ROWKEY_KWD: get[ROWKEY_KWD](position),
+        }
 
-class Cached_stats:
-    def __init__(self, handle, kwargs):
 
-        x_limits = (handle.start.x, handle.end.x)
-        y_limits = (handle.start.y, handle.end.y)
+def column_getter(values):
+    """A function returning the value of a `ROIBatch` column at a position"""
+    if isinstance(values, np.ndarray):
+        return lambda position: values[position].item()
+    if isinstance(values, list):
+        return values.__getitem__
+    return lambda position: values
 
-        xmax = max(x_limits)
-        ymax = max(y_limits)
 
-        xmin = min(x_limits)
-        ymin = min(y_limits)
+def is_valid_tool_type(tool_type):
+    return isinstance(tool_type, str) and tool_type.lower() in [
+        roi.lower() for roi in VALIDROI_KWD
+    ]
 
-        if AREA_KWD in kwargs:
-            self.area = kwargs[AREA_KWD]
-        else:
-            self.area = (xmax - xmin) * (ymax - ymin)
 
-        if COUNT_KWD in kwargs:
-            self.count = kwargs[COUNT_KWD]
-        else:
-            self.count = (round(xmax) - round(xmin)) * (round(ymax) - round(ymin))
+def generate_image_path(study_instance_uid, series_instance_uid, sop_instance_uid):
 
-        self.max = kwargs.get(MAX_KWD, 0)
-        self.min = kwargs.get(MIN_KWD, 0)
-        self.mean = kwargs.get(MEAN_KWD, 0)
-        self.stdDev = kwargs.get(STDDEV_KWD, 0)
-        self.variance = kwargs.get(VARIANCE_KWD, 0)
+    # I don't understand either.
+    path_delimiter = "$$$"
+    path_suffix = "0"
 
-    def to_dict(self):
-        output_dict = {
-            AREA_KWD: self.area,
-            COUNT_KWD: self.count,
-            MAX_KWD: self.max,
-            MEAN_KWD: self.mean,
-            MIN_KWD: self.min,
-            STDDEV_KWD: self.stdDev,
-            VARIANCE_KWD: self.variance,
-        }
-        return output_dict
+    imagePath = (
+        f"{study_instance_uid}"
+        f"{path_delimiter}"
+        f"{series_instance_uid}"
+        f"{path_delimiter}"
+        f"{sop_instance_uid}"
+        f"{path_delimiter}"
+        f"{path_suffix}"
+    )
 
+    return imagePath
 
-class ROI:
-    """
-    ROI class that essentially stores all the information you need to make and ROI and
-    has the ability to spit it back out as a dict.  Since it takes a dictionary as an input,
-    this is a little redundant, but I honestly thought this would be a more complicated process.
+
+def add_measurement_to_info(info, measurement, duplicates=None, stale=None):
+    """Add a measurement (an ROI in its final dict form) to a container's info in memory
+
+    Args:
+        info (dict): the info of the container (session) to add the measurement to
+        measurement (dict): the measurement, with JSON-safe values
+        duplicates (DuplicateIndex): an index of the ROI's already in `info`.  It is
+            updated when the measurement is added.  If not given, one is built from `info`.
+        stale (dict): If given, the measurements whose rows are no longer in the file,
+            from `get_stale_measurements`.  The first of them with the same row key is
+            replaced by the measurement (and taken out of `stale`), so that an edited
+            row replaces its ROI rather than adding another one.
+
+    Returns:
+        added (bool): True if the measurement was added, False if it is a duplicate
     """
+    tool_type = measurement[ROITYPE_KWD]
+
+    if duplicates is None:
+        duplicates = DuplicateIndex(info)
+
+    previous = None
+    if stale and stale.get(measurement.get(ROWKEY_KWD)):
+        previous = stale[measurement[ROWKEY_KWD]][0]
+        # The ROI being replaced is not a duplicate of its replacement, any other is
+        duplicates.remove(previous)
+
+    if measurement in duplicates:
+        log.warning('Found duplicate ROI (coordinates match out to 4 decimal places)')
+        log.warning('Will not add duplicate')
+        if previous is not None:
+            duplicates.add(previous)
+        return False
 
-    def __init__(self):
-
-        log.info("Initializing ROI")
-
-        self.mandatory_keys = MANDATORY_KWD
-
-        self.forbidden_keys = FORBIDDEN_KWD
-        self.namespace = NAMESPACE_KWD
-
-        self.handle = None
-        self.seriesInstanceUid = None
-        self.sopInstanceUid = None
-        self.studyInstanceUid = None
-        self.imagePath = None
-
-        self.patientId = None
-        self.toolType = None
-
-        # Some important values we'll call out specifically for consistency
-        self.visible = False
-        self.active = False
-        self.description = None
-        self.location = None
-        self.flywheelOrigin = None
-        self.lesionNamingNumber = None
-        self.measurementNumber = None
-        self.timepointId = None
-        self.cachedStats = None
-        self.userId = None
-        self.uuid = ""
-        self.id = ""
-        self.kwargs = None
-        self.valid = True
-
-    def generate_imagePath(self):
-
-        # I don't understand either.
-        path_delimiter = "$$$"
-        path_suffix = "0"
-
-        imagePath = (
-            f"{self.studyInstanceUid}"
-            f"{path_delimiter}"
-            f"{self.seriesInstanceUid}"
-            f"{path_delimiter}"
-            f"{self.sopInstanceUid}"
-            f"{path_delimiter}"
-            f"{path_suffix}"
-        )
-
-        return imagePath
-
-    def roi_from_dict(self, **kwargs):
-
-        for fk in self.forbidden_keys:
-            if fk in kwargs:
-                log.error(f"Forbidden key {fk} found in {kwargs.keys()}")
-                raise Exception("Forbidden Keys")
-
-        for mk in self.mandatory_keys:
-            if mk not in kwargs:
-                log.error(f"Mandatory key {mk} not present in kwargs {kwargs.keys()}")
-                raise Exception("Missing Mandatory Key")
-
-        self.handle = Handle(**kwargs.pop(HANDLE_KWD, {}))
-        self.seriesInstanceUid = kwargs.pop(SERIESINSTANCEUID_KWD)
-        self.sopInstanceUid = kwargs.pop(SOPINSTANCEUID_KWD)
-        self.studyInstanceUid = kwargs.pop(STUDYINSTANCEUID_KWD)
-        self.patientId = kwargs.pop(PATIENTID_KWD)
-
-        self.toolType = kwargs.pop(ROITYPE_KWD)
-        if self.toolType.lower() not in [roi.lower() for roi in VALIDROI_KWD]:
-            log.warning(f'INVALID ROI TYPE {self.toolType}')
-            self.valid = False
-
-        self.imagePath = self.generate_imagePath()
-
-        # Some important values we'll call out specifically for consistency
-        self.visible = kwargs.pop(VISIBLE_KWD, True)
-        self.active = kwargs.pop(ACTIVE_KWD, False)
-        self.description = kwargs.pop(DESCRIPTION_KWD, None)
-        self.location = kwargs.pop(LOCATION_KWD, None)
-
-        fw_origin = dict()
-        if USERORIGIN_KWD in kwargs:
-            fw_origin["type"] = "user"
-            fw_origin["id"] = kwargs.pop(USERORIGIN_KWD)
-        else:
-            fw_origin["type"] = "gear"
-            fw_origin["id"] = "CSV to ROI Gear"
+    if previous is not None:
+        row_log.info("Replacing the ROI imported from this row before")
+        stale[measurement[ROWKEY_KWD]].pop(0)
+        rois = info[NAMESPACE_KWD][MEASUREMENTS_KWD][previous[ROITYPE_KWD]]
+        rois[:] = [roi for roi in rois if roi is not previous]
 
-        self.flywheelOrigin = fw_origin
-        self.lesionNamingNumber = kwargs.pop(LESIONNAMINGNUMBER_KWD)
-        self.measurementNumber = kwargs.pop(MEASUREMENTNUMBER_KWD)
-        self.timepointId = kwargs.pop(TIMEPOINTID_KWD)
-        self.cachedStats = Cached_stats(self.handle, kwargs.pop(CACHEDSTATS_KWD, {}))
-        self.userId = kwargs.pop(USERID_KWD, "")
-        self.uuid = kwargs.pop(UUID_KWD, "")
-        # self.id = ?
+    if NAMESPACE_KWD not in info:
+        info[NAMESPACE_KWD] = {}
+    if MEASUREMENTS_KWD not in info[NAMESPACE_KWD]:
+        info[NAMESPACE_KWD][MEASUREMENTS_KWD] = {}
+    if tool_type not in info[NAMESPACE_KWD][MEASUREMENTS_KWD]:
+        info[NAMESPACE_KWD][MEASUREMENTS_KWD][tool_type] = []
 
-        self.kwargs = kwargs
+    if not isinstance(info[NAMESPACE_KWD][MEASUREMENTS_KWD][tool_type], list):
+        row_log.info("namespace %s is not list.  Resetting", tool_type)
+        info[NAMESPACE_KWD][MEASUREMENTS_KWD][tool_type] = [measurement]
+    else:
+        row_log.info("Appending to namespace %s", tool_type)
+        info[NAMESPACE_KWD][MEASUREMENTS_KWD][tool_type].append(measurement)
 
-    def to_dict(self):
+    duplicates.add(measurement)
 
-        output_dict = {
-            HANDLE_KWD: self.handle.to_dict(),
-            CACHEDSTATS_KWD: self.cachedStats.to_dict(),
-            FLYWHEELORIGIN_KWD: self.flywheelOrigin,
-            SERIESINSTANCEUID_KWD: self.seriesInstanceUid,
-            SOPINSTANCEUID_KWD: self.sopInstanceUid,
-            STUDYINSTANCEUID_KWD: self.studyInstanceUid,
-            IMAGEPATH_KWD: self.imagePath,
-            VISIBLE_KWD: self.visible,
-            DESCRIPTION_KWD: self.description,
-            LOCATION_KWD: self.location,
-            ROITYPE_KWD: self.toolType,
-            LESIONNAMINGNUMBER_KWD: self.lesionNamingNumber,
-            MEASUREMENTNUMBER_KWD: self.measurementNumber,
-            TIMEPOINTID_KWD: self.timepointId,
-            PATIENTID_KWD: self.patientId,
-            ACTIVE_KWD: self.active,
-            USERID_KWD: self.userId,
-            UUID_KWD: self.uuid,
-            ID_KWD: self.id,
-            IMPORTMETHOD_KWD: "import-rois"
-        }
+    return True
 
-        return output_dict
 
-    def append_to_container(self, container):
+def get_info_update(info):
+    """The part of a container's info that adding ROI's changes, to pass to `update_info`
 
-        if not self.valid:
-            log.warning("Not updating invalid ROI")
-            return False
+    `update_info` sets the given top level keys and leaves every other key as it is, so
+    only the viewer namespace is sent, rather than the whole info with its DICOM and
+    other metadata.  The namespace can't be narrowed to the measurement lists that
+    changed: the API sanitizes "." in keys to "_", so "ohifViewer.measurements.<type>"
+    would be set as a new top level key instead of the nested list.
+    """
+    return {NAMESPACE_KWD: info.get(NAMESPACE_KWD, {})}
 
-        info = container.info
 
-        roi_dict = self.to_dict()
-        clean_dict = fu.cleanse_the_filthy_numpy(roi_dict)
+def copy_measurements(info):
+    """A copy of a container's info that `add_measurement_to_info` can add to, for a dry run
 
-        if self.namespace not in info:
-            info[self.namespace] = {}
-        if MEASUREMENTS_KWD not in info[self.namespace]:
-            info[self.namespace][MEASUREMENTS_KWD] = {}
-        if self.toolType not in info[self.namespace][MEASUREMENTS_KWD]:
-            info[self.namespace][MEASUREMENTS_KWD][self.toolType] = []
+    Only the viewer namespace is copied, down to the lists of measurements, the
+    measurements themselves are shared with `info`.
+    """
+    measurements = info.get(NAMESPACE_KWD, {}).get(MEASUREMENTS_KWD, {})
+    return {
+        NAMESPACE_KWD: {
+            MEASUREMENTS_KWD: {
+                tool_type: list(rois) if isinstance(rois, list) else rois
+                for tool_type, rois in measurements.items()
+            }
+        }
+    }
 
-        if not isinstance(info[self.namespace][MEASUREMENTS_KWD][self.toolType], list):
-            log.info(f"namespace {self.toolType} is not list.  Resetting")
-            info[self.namespace][MEASUREMENTS_KWD][self.toolType] = [clean_dict]
-        else:
 
-            if self.found_duplicate_roi(info[self.namespace][MEASUREMENTS_KWD][self.toolType]):
-                log.warning('Will not add duplicate')
-                return False
-            else:
-                log.info(f"Appending to namespace {self.toolType}")
-                info[self.namespace][MEASUREMENTS_KWD][self.toolType].append(clean_dict)
+def get_stale_measurements(info, fingerprints):
+    """The measurements imported from rows that are no longer in the file, by row key
 
-        log.info("updating container...")
+    These are the ones an edited row may replace: a measurement whose row is still in
+    the file (with the same fingerprint) is never replaced, wherever the row moved to.
 
-        container.update_info(info)
+    Args:
+        info (dict): the info of the container (session)
+        fingerprints (set): the fingerprints of every row being imported
 
-        return True
+    Returns:
+        stale (dict): row key -> list of measurements, in the order they are in `info`
+    """
+    stale = {}
+    measurements = info.get(NAMESPACE_KWD, {}).get(MEASUREMENTS_KWD, {})
+    for rois in measurements.values():
+        if not isinstance(rois, list):
+            continue
+        for roi in rois:
+            if not roi or not roi.get(ROWKEY_KWD) or not roi.get(FINGERPRINT_KWD):
+                continue
+            if roi[FINGERPRINT_KWD] not in fingerprints:
+                stale.setdefault(roi[ROWKEY_KWD], []).append(roi)
+    return stale
+
+
+def get_fingerprints(info):
+    """The import fingerprints of every measurement already in a container's info"""
+    measurements = info.get(NAMESPACE_KWD, {}).get(MEASUREMENTS_KWD, {})
+    return {
+        roi.get(FINGERPRINT_KWD)
+        for rois in measurements.values()
+        if isinstance(rois, list)
+        for roi in rois
+        if roi and roi.get(FINGERPRINT_KWD)
+    }
+
+
+class DuplicateIndex:
+    """A set of the ROI's on a session, for constant time duplicate checks
+
+    ROI's are keyed on the image they are on (SOPInstanceUID), their toolType and their
+    truncated start/end coordinates (see `duplicate_key`).  Build it once from the
+    session's info, and `add` each measurement as it is added to the session, so that
+    duplicate rows within the same CSV are caught too.
+    """
 
+    def __init__(self, info=None):
+        self.keys = set()
+        if info:
+            self.add_info(info)
 
-    def found_duplicate_roi(self, existing_rois):
+    def add_info(self, info):
+        measurements = info.get(NAMESPACE_KWD, {}).get(MEASUREMENTS_KWD, {})
+        for tool_type, rois in measurements.items():
+            if not isinstance(rois, list):
+                continue
+            for roi in rois:
+                if roi:
+                    self.add(roi, tool_type)
 
-        # We truncate to a length of 4, because sometimes an ROI will have a very long floating point coordinate
-        # Value, but when the user loads this into excel, it truncates it to like 6 or 8 decimal places, so we assume
-        # that 4 decimal places is small enough to be unique and still catch duplicates even with excell truncating.
-        n = 4
-        my_x1 = self.handle.start.x
-        my_y1 = self.handle.start.y
-        my_x2 = self.handle.end.x
-        my_y2 = self.handle.end.y
+    def add(self, measurement, tool_type=None):
+        self.keys.add(measurement_key(measurement, tool_type))
 
-        my_coords = [my_x1, my_y1, my_x2, my_y2]
-        my_coords = [truncate(c, n) for c in my_coords]
+    def remove(self, measurement, tool_type=None):
+        self.keys.discard(measurement_key(measurement, tool_type))
 
-        for roi in existing_rois:
-            roi_x1 = roi.get('handles', {}).get('start', {}).get('x', 0.0)
-            roi_y1 = roi.get('handles', {}).get('start', {}).get('y', 0.0)
-            roi_x2 = roi.get('handles', {}).get('end', {}).get('x', 0.0)
-            roi_y2 = roi.get('handles', {}).get('end', {}).get('y', 0.0)
+    def __contains__(self, measurement):
+        return measurement_key(measurement) in self.keys
 
-            roi_coords = [roi_x1, roi_x2, roi_y1, roi_y2]
-            roi_coords = [truncate(c, n) for c in roi_coords]
 
-            duplicated = [mc in roi_coords for mc in my_coords]
+def measurement_key(measurement, tool_type=None):
+    start = measurement.get(HANDLE_KWD, {}).get(START_KWD, {})
+    end = measurement.get(HANDLE_KWD, {}).get(END_KWD, {})
+    return duplicate_key(
+        measurement.get(SOPINSTANCEUID_KWD),
+        measurement.get(ROITYPE_KWD, tool_type),
+        start.get(X_KWD, 0.0),
+        start.get(Y_KWD, 0.0),
+        end.get(X_KWD, 0.0),
+        end.get(Y_KWD, 0.0),
+    )
 
-            if all(duplicated):
-                log.warning('Found duplicate ROI (coordinates match out to 4 decimal places)')
-                return True
 
-        return False
+def duplicate_key(sop_instance_uid, tool_type, x1, y1, x2, y2):
+    # We truncate to a length of 4, because sometimes an ROI will have a very long floating point coordinate
+    # Value, but when the user loads this into excel, it truncates it to like 6 or 8 decimal places, so we assume
+    # that 4 decimal places is small enough to be unique and still catch duplicates even with excell truncating.
+    n = 4
+    coords = tuple(truncate(c, n) for c in (x1, y1, x2, y2))
+    return (sop_instance_uid, tool_type) + coords
 
 
 def truncate(f, n):
-    return math.floor(f * 10 ** n) / 10 ** n
\ No newline at end of file
+    return math.floor(f * 10 ** n) / 10 ** n
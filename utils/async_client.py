@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import time
+
+import httpx
+
+import utils.metrics_utils as mu
+
+log = logging.getLogger(__name__)
+
+
+def url_from_api_key(api_key):
+    """Get the base API url and Authorization header from a flywheel API key
+
+    This follows the same "<host>:<port>:<key>" / "<host>:<key>" format that
+    `flywheel.Client` accepts.
+
+    Args:
+        api_key (string): The flywheel API key
+
+    Returns:
+        base_url (string): the url of the flywheel API
+        authorization (string): the value of the Authorization header
+
+    """
+    parts = api_key.split(":")
+    if len(parts) < 2:
+        raise Exception("Invalid API key")
+
+    host = parts[0]
+    if len(parts) == 2:
+        port = "443"
+    else:
+        port = parts[1]
+    key = parts[-1]
+
+    scheme = "http" if "__force_insecure" in parts else "https"
+    base_url = f"{scheme}://{host}:{port}/api"
+
+    prefix = "Bearer" if len(key) == 57 else "scitran-user"
+    return base_url, f"{prefix} {key}"
+
+
+class AsyncClient:
+    """An asyncio facade over the flywheel API calls this gear makes
+
+    All requests share one keep-alive connection pool, and at most `max_in_flight`
+    requests are outstanding at a time.  Containers are returned as the plain
+    dictionaries the API responds with.
+
+    If `metrics` (a `mu.Metrics`) is given, every request is recorded in it.  If
+    `scheduler` (a `sched.RequestScheduler`) is given, requests are paced and retried
+    by it.
+
+    Use it as an async context manager, so that the connection pool is closed:
+
+        async with AsyncClient(api_key) as afw:
+            info = await afw.get_session_info(session_id)
+    """
+
+    def __init__(
+        self, api_key, max_in_flight=100, base_url=None, timeout=60, metrics=None, scheduler=None
+    ):
+        url, authorization = url_from_api_key(api_key)
+        self.base_url = base_url or url
+        self.max_in_flight = max_in_flight
+        self.request_count = 0
+        self.metrics = metrics
+        self.scheduler = scheduler
+
+        self._headers = {"Authorization": authorization}
+        self._timeout = timeout
+        self._client = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        limits = httpx.Limits(
+            max_connections=self.max_in_flight,
+            max_keepalive_connections=self.max_in_flight,
+        )
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self._headers,
+            limits=limits,
+            timeout=self._timeout,
+        )
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+        self._client = None
+
+    async def request(self, method, path, **kwargs):
+        if self.scheduler is None:
+            return await self._request(method, path, **kwargs)
+
+        attempt = 0
+        while True:
+            await self.scheduler.wait_async()
+            try:
+                return await self._request(method, path, **kwargs)
+            except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                status = retry_after = None
+                if isinstance(e, httpx.HTTPStatusError):
+                    status = e.response.status_code
+                    retry_after = e.response.headers.get("Retry-After")
+                delay = self.scheduler.retry_delay(attempt, status, e, retry_after)
+                if delay is None:
+                    raise
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _request(self, method, path, **kwargs):
+        async with self._semaphore:
+            self.request_count += 1
+            start = time.perf_counter()
+            response = await self._client.request(method, path, **kwargs)
+            if self.metrics is not None:
+                request_bytes = len(json.dumps(kwargs["json"])) if "json" in kwargs else 0
+                self.metrics.record(
+                    mu.endpoint_from_path(method, path),
+                    time.perf_counter() - start,
+                    request_bytes,
+                    len(response.content),
+                    response.is_error,
+                )
+        response.raise_for_status()
+        if not response.content:
+            return None
+        return response.json()
+
+    async def get_session(self, session_id):
+        return await self.request("GET", f"/sessions/{session_id}")
+
+    async def get_session_info(self, session_id):
+        session = await self.get_session(session_id)
+        return session.get("info", {})
+
+    async def update_session_info(self, session_id, info):
+        """Set the given info fields on a session, like `flywheel.Session.update_info`"""
+        return await self.request(
+            "PATCH", f"/sessions/{session_id}/info", json={"set": info}
+        )
@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class ContainerCache:
+    """A thread safe, size bounded LRU cache with optional expiry and single-flight loading
+
+    If several threads miss on the same key at once, only the first one calls the
+    loader; the others wait for its result.
+
+    Args:
+        max_size (integer): The maximum number of entries to keep.  The least recently
+            used entry is evicted when it is exceeded.
+        ttl (float): Seconds after which an entry expires.  0 or None to never expire.
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl or None
+
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """Get the value for `key`, calling `loader()` to load it on a miss"""
+        leader = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, loaded = entry
+                if self.ttl is None or time.monotonic() - loaded < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                self.shared += 1
+            else:
+                flight = Future()
+                self._in_flight[key] = flight
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            return flight.result()
+
+        try:
+            value = loader()
+        except Exception as e:
+            with self._lock:
+                del self._in_flight[key]
+            flight.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._in_flight[key]
+            self._entries[key] = (value, time.monotonic())
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        flight.set_result(value)
+
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def summary(self):
+        return (
+            f"Container cache: {self.hits} hits, {self.misses} misses, "
+            f"{self.shared} shared in-flight loads, {self.evictions} evictions"
+        )
+
+
+class CachedClient:
+    """Wraps a flywheel.Client, caching containers fetched by id
+
+    `get`, `get_session` and `get_acquisition` are served from a shared
+    `ContainerCache`.  Every other attribute is passed through to the wrapped client.
+    Call `invalidate` after modifying a container, so the next get fetches it again.
+    """
+
+    def __init__(self, fw, max_size=1024, ttl=None):
+        self.fw = fw
+        self.cache = ContainerCache(max_size, ttl)
+
+    def __getattr__(self, name):
+        return getattr(self.fw, name)
+
+    def get(self, container_id, **kwargs):
+        return self.cache.get(container_id, lambda: self.fw.get(container_id, **kwargs))
+
+    def get_session(self, session_id, **kwargs):
+        return self.cache.get(
+            session_id, lambda: self.fw.get_session(session_id, **kwargs)
+        )
+
+    def get_acquisition(self, acquisition_id, **kwargs):
+        return self.cache.get(
+            acquisition_id, lambda: self.fw.get_acquisition(acquisition_id, **kwargs)
+        )
+
+    def invalidate(self, container_id):
+        self.cache.invalidate(container_id)
+
+
+def invalidate(fw, container_id):
+    """Drop a modified container from the client's cache, if it has one"""
+    if isinstance(fw, CachedClient):
+        fw.invalidate(container_id)
+
+
+def get_cache_summary(fw):
+    if isinstance(fw, CachedClient):
+        return fw.cache.summary()
+    return None
@@ -1,182 +1,542 @@
+import gzip
+import hashlib
 import logging
 
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
 import utils.ROI_Template as ROI
 import utils.fwobject_utils as fu
 
 log = logging.getLogger("__main__")
 MAPPING_COLUMN = ROI.MAPPING_COLUMN
 
+# The columns the gear adds to the dataframe for the status report
+REPORT_COLUMNS = ["Gear_Status", "Gear_FW_Location", "Gear_Error"]
+
+# The columns every row needs a value in
+COORDINATE_COLUMNS = [ROI.XMIN_HDR, ROI.YMIN_HDR, ROI.XMAX_HDR, ROI.YMAX_HDR]
+LABEL_COLUMNS = [ROI.SUBJECT_HDR, ROI.SESSION_HDR, ROI.MAPPING_COLUMN]
+UID_COLUMNS = [ROI.SOPINSTANCEUID_HDR]
+
+# The columns that place a row's ROI on a file, keying the row across edits
+ROW_KEY_COLUMNS = [
+    ROI.GROUP_HDR,
+    ROI.PROJECT_HDR,
+    ROI.SUBJECT_HDR,
+    ROI.SESSION_HDR,
+    ROI.MAPPING_COLUMN,
+    ROI.FILETYPE_HDR,
+    ROI.STUDYINSTANCEUID_HDR,
+    ROI.SERIESINSTANCEUID_HDR,
+    ROI.SOPINSTANCEUID_HDR,
+    ROI.ROITYPE_HDR,
+]
+
+# The status report's file name, and the formats it can be written in
+REPORT_NAME = "Data_Import_Status_report"
+REPORT_FORMATS = ("csv", "csv.gz", "parquet")
+
+# gzip's fastest level: higher levels take several times longer for a few % less space
+REPORT_GZIP_LEVEL = 1
+
+
+def get_measurements_from_df(df, fingerprints=None, row_keys=None):
+    """Build the measurement dict of every row in the dataframe at once
+
+    This works on whole columns rather than row by row: the handles, text box
+    positions and cachedStats area/count are computed with numpy column operations,
+    and the columns are kept in a `ROI.ROIBatch`, which serializes
+    each row into a measurement dict, ready to be written, only when it is looked up.
+    The file-specific values (UID's, imagePath, PatientID) and the ROI numbers are
+    filled in by `complete_measurement` once each row has been matched to a file.
+
+    Each measurement carries the fingerprint and the key of the row it was made from,
+    so that a later delta import can tell which rows are already on a session, and
+    which ROI an edited row replaces.
 
-def get_stats_from_row(series):
+    Args:
+        df (pandas.DataFrame): The dataframe of ROI's, with the columns described in
+            "Sample.csv"
+        fingerprints (pandas.Series): The fingerprint of each row.  If not given, the
+            rows of `df` are hashed with `get_row_hashes`.
+        row_keys (pandas.Series): The key of each row.  If not given, the rows of `df`
+            are keyed with `get_row_keys`.
 
-    stats_dict = {
-        ROI.AREA_KWD: panda_pop(series, ROI.AREA_HDR, 0),
-        ROI.COUNT_KWD: panda_pop(series, ROI.COUNT_HDR, 0),
-        ROI.MAX_KWD: panda_pop(series, ROI.MAX_HDR, 0),
-        ROI.MEAN_KWD: panda_pop(series, ROI.MEAN_HDR, 0),
-        ROI.MIN_KWD: panda_pop(series, ROI.MIN_HDR, 0),
-        ROI.STDDEV_KWD: panda_pop(series, ROI.STDDEV_HDR, 0),
-        ROI.VARIANCE_KWD: panda_pop(series, ROI.VARIANCE_HDR, 0),
+    Returns:
+        measurements (ROI.ROIBatch): row index -> measurement dict.  Rows that can't be
+            made into an ROI (e.g. missing coordinates) are left out.
+
+    """
+    for fk in ROI.FORBIDDEN_KWD:
+        if fk in df:
+            log.error(f"Forbidden key {fk} found in {list(df.columns)}")
+            return ROI.ROIBatch([], {})
+
+    for mk in [ROI.XMIN_HDR, ROI.YMIN_HDR, ROI.XMAX_HDR, ROI.YMAX_HDR, ROI.ROITYPE_HDR]:
+        if mk not in df:
+            log.error(f"Mandatory column {mk} not present in {list(df.columns)}")
+            return ROI.ROIBatch([], {})
+
+    if ROI.HANDLE_KWD in df:
+        log.warning(
+            f"Column name{ROI.HANDLE_KWD} is reserved.  Data will not be uploaded."
+        )
+
+    def coordinate(key):
+        return pd.to_numeric(df[key], errors="coerce").to_numpy(dtype=float)
+
+    x_start = coordinate(ROI.XMIN_HDR)
+    y_start = coordinate(ROI.YMIN_HDR)
+    x_end = coordinate(ROI.XMAX_HDR)
+    y_end = coordinate(ROI.YMAX_HDR)
+
+    finite = (
+        np.isfinite(x_start)
+        & np.isfinite(y_start)
+        & np.isfinite(x_end)
+        & np.isfinite(y_end)
+    )
+    for index in df.index[~finite]:
+        log.warning(f"row {index} does not have numeric x/y min/max coordinates")
+
+    df = df[finite]
+    x_start, y_start, x_end, y_end = (c[finite] for c in (x_start, y_start, x_end, y_end))
+
+    def column(key, default=None):
+        # Properties without a column are stored once, not once per row
+        if key in df:
+            return to_python_list(df[key])
+        return default
+
+    area = np.abs(x_end - x_start) * np.abs(y_end - y_start)
+    count = np.abs(np.rint(x_end) - np.rint(x_start)) * np.abs(
+        np.rint(y_end) - np.rint(y_start)
+    )
+    count = count.astype(np.int64)
+
+    if ROI.AREA_HDR in df:
+        area = to_python_list(df[ROI.AREA_HDR].where(df[ROI.AREA_HDR].notnull(), area))
+    if ROI.COUNT_HDR in df:
+        count = to_python_list(df[ROI.COUNT_HDR].where(df[ROI.COUNT_HDR].notnull(), count))
+
+    if fingerprints is None:
+        fingerprints = get_row_hashes(df)
+    if row_keys is None:
+        row_keys = get_row_keys(df)
+
+    columns = {
+        "x1": x_start,
+        "y1": y_start,
+        "x2": x_end,
+        "y2": y_end,
+        # The text box sits at the left edge of the ROI, half way down
+        "text_y": y_start - (y_start - y_end) / 2.0,
+        ROI.ACTIVE_KWD: column(ROI.ACTIVE_HDR, False),
+        ROI.HIGHLIGHT_KWD: column(ROI.HIGHLIGHT_HDR, False),
+        ROI.ALLOWEDOUTSIDE_KWD: column(ROI.ALLOWEDOUTSIDE_HDR, True),
+        ROI.DRAWNINDEPENDENTLY_KWD: column(ROI.DRAWNINDEPENDENTLY_HDR, True),
+        ROI.HASBOUNDINGBOX_KWD: column(ROI.HASBOUNDINGBOX_HDR, True),
+        ROI.HASMOVED_KWD: column(ROI.HASMOVED_HDR, False),
+        ROI.MOVESINDEPENDENTLY_KWD: column(ROI.MOVESINDEPENDENTLY_HDR, False),
+        ROI.INITIALROTATION_KWD: column(ROI.INITIALROTATION_HDR, 0),
+        ROI.AREA_KWD: area,
+        ROI.COUNT_KWD: count,
+        ROI.MAX_KWD: column(ROI.MAX_HDR, 0),
+        ROI.MEAN_KWD: column(ROI.MEAN_HDR, 0),
+        ROI.MIN_KWD: column(ROI.MIN_HDR, 0),
+        ROI.STDDEV_KWD: column(ROI.STDDEV_HDR, 0),
+        ROI.VARIANCE_KWD: column(ROI.VARIANCE_HDR, 0),
+        ROI.VISIBLE_KWD: column(ROI.VISIBLE_HDR, True),
+        ROI.DESCRIPTION_KWD: column(ROI.DESCRIPTION_HDR),
+        ROI.LOCATION_KWD: column(ROI.LOCATION_HDR),
+        ROI.ROITYPE_KWD: column(ROI.ROITYPE_HDR),
+        ROI.FINGERPRINT_KWD: fingerprints.loc[df.index].tolist(),
+        ROI.ROWKEY_KWD: row_keys.loc[df.index].tolist(),
     }
+    if ROI.USERORIGIN_HDR in df:
+        columns[ROI.USERORIGIN_KWD] = to_python_list(df[ROI.USERORIGIN_HDR])
 
-    return stats_dict
+    return ROI.ROIBatch(df.index.tolist(), columns)
 
 
-def get_handle_from_row(series):
-    """Generate the flywheel handle from the series.
+def to_python_list(values):
+    """The values of a column as python values, with None for missing values (NaN, NA)"""
+    if values.hasnans:
+        values = values.astype(object).where(values.notnull(), None)
+    return values.tolist()
 
-    The only truly "required" columns needed to create a handle from the series are:
-    X min
-    Y min
-    X max
-    Y max
+
+def complete_measurement(measurement, file, roi_number_dict):
+    """Fill in the file-specific values and ROI numbers of a measurement
 
     Args:
-        series (pandas.Series): a row from a dataframe describing an ROI
+        measurement (dict): a measurement from `get_measurements_from_df`
+        file (flywheel.FileEntry): a flywheel file to attach the ROI to
+        roi_number_dict (dict): the ROI numbers to give this ROI, as returned by
+            `fu.get_roi_number_from_info` for the parent session of the file
 
     Returns:
-        handle_dict (dict): a nested dictionary object mirroring the "handle" object
-            used for the flywheel ROI metadata
+        measurement (dict): the measurement, filled in and ready to be written
 
     """
-    start_dict = {
-        ROI.X_KWD: panda_pop(series, ROI.XMIN_HDR),
-        ROI.Y_KWD: panda_pop(series, ROI.YMIN_HDR),
-        ROI.ACTIVE_HDR: panda_pop(series, ROI.ACTIVE_HDR, False),
-        ROI.HIGHLIGHT_KWD: panda_pop(series, ROI.HIGHLIGHT_HDR, False),
-    }
+    measurement.update(fu.get_uids_from_filename(file))
+    measurement[ROI.IMAGEPATH_KWD] = ROI.generate_image_path(
+        measurement[ROI.STUDYINSTANCEUID_KWD],
+        measurement[ROI.SERIESINSTANCEUID_KWD],
+        measurement[ROI.SOPINSTANCEUID_KWD],
+    )
+    measurement[ROI.PATIENTID_KWD] = file.info.get("PatientID")
+    measurement.update(roi_number_dict)
 
-    end_dict = {
-        ROI.X_KWD: panda_pop(series, ROI.XMAX_HDR),
-        ROI.Y_KWD: panda_pop(series, ROI.YMAX_HDR),
-        ROI.ACTIVE_KWD: panda_pop(series, ROI.ACTIVE_HDR, False),
-        ROI.HIGHLIGHT_KWD: panda_pop(series, ROI.HIGHLIGHT_HDR, False),
-    }
+    return measurement
 
-    bounding_dict = {
-        ROI.HEIGHT_KWD: panda_pop(series, ROI.HEIGHT_HDR, 45),
-        ROI.LEFT_KWD: panda_pop(series, ROI.LEFT_HDR, 400),
-        ROI.TOP_KWD: panda_pop(series, ROI.TOP_HDR, 150),
-        ROI.WIDTH_KWD: panda_pop(series, ROI.WIDTH_HDR, 250),
-    }
 
-    textbox_dict = {
-        ROI.ALLOWEDOUTSIDE_KWD: panda_pop(series, ROI.ALLOWEDOUTSIDE_HDR, True),
-        ROI.DRAWNINDEPENDENTLY_KWD: panda_pop(series, ROI.DRAWNINDEPENDENTLY_HDR, True),
-        ROI.HASBOUNDINGBOX_KWD: panda_pop(series, ROI.HASBOUNDINGBOX_HDR, True),
-        ROI.HASMOVED_KWD: panda_pop(series, ROI.HASMOVED_HDR, False),
-        ROI.MOVESINDEPENDENTLY_KWD: panda_pop(
-            series, ROI.MOVESINDEPENDENTLY_HDR, False
-        ),
-        ROI.ACTIVE_KWD: panda_pop(series, ROI.ACTIVE_HDR, False),
-        # ROI.BOUNDINGBOX_KWD: bounding_dict,
-    }
+def save_df_to_csv(df, output_dir, append=False):
+    """saves a dataframe to the specified output directory with the name "Data_Import_Status_Report.csv"
 
-    # This summarizes the final form of the dictionary.
-    handle_dict = {
-        ROI.START_KWD: start_dict,
-        ROI.END_KWD: end_dict,
-        ROI.INITIALROTATION_KWD: panda_pop(series, ROI.INITIALROTATION_HDR, 0),
-        ROI.TEXTBOX_KWD: textbox_dict,
-    }
+    Args:
+        df (pandas.DataFrame): the dataframe to save
+        output_dir (Pathlike): the directory to save to
+        append (boolean): append the rows (without a header) to an existing report
+
+    Returns:
+
+    """
+    output_path = output_dir / f"{REPORT_NAME}.csv"
+    if append:
+        df.to_csv(output_path, index=False, mode="a", header=False)
+    else:
+        df.to_csv(output_path, index=False)
+
+
+class ReportWriter:
+    """Writes the status report, in one go or a chunk at a time
+
+    "csv" reports are written with `save_df_to_csv`.  "csv.gz" and "parquet" reports are
+    written through Arrow, as a stream: each chunk is converted to a table and written
+    out (gzip-compressed, or as a parquet row group) as soon as it is given, so the
+    report is never held in memory as a whole.
+
+    Chunks are written by column name, not position: the report has the `columns`
+    given, followed by the other columns of the first chunk (e.g. the gear's status
+    columns).  A chunk missing some of them has them written empty, and the columns of
+    a chunk that are not in the report are left out of it, with a warning.
+
+    The columns of an Arrow report keep the type of their first chunk.  Values of later
+    chunks that don't fit that type are converted (to text, for text columns) or left
+    out, with a warning (see `to_arrow_array`).
 
-    log.debug("handle:")
-    log.debug(handle_dict)
-    if ROI.HANDLE_KWD in series:
+    Args:
+        output_dir (Pathlike): The directory to save the report to
+        report_format (string): One of `REPORT_FORMATS`
+        columns (list): The columns the report starts with, e.g. the union of the
+            headers of every sheet of a workbook, when the chunks differ.
+    """
+
+    def __init__(self, output_dir, report_format="csv", columns=None):
+        if report_format not in REPORT_FORMATS:
+            raise ValueError(f"Unknown report format {report_format}")
+
+        self.output_dir = output_dir
+        self.report_format = report_format
+        self.path = output_dir / f"{REPORT_NAME}.{report_format}"
+        self.header = list(columns or [])
+        self.columns = None
+        self.left_out = set()
+        self.schema = None
+        self.nrows = 0
+        self._writer = None
+        self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, df):
+        if self.columns is None:
+            self.columns = self.header + [c for c in df.columns if c not in self.header]
+
+        extra = [c for c in df.columns if c not in self.columns and c not in self.left_out]
+        if extra:
+            log.warning(f"Columns {extra} are not in the report's header, and are left out")
+            self.left_out.update(extra)
+
+        if self.report_format == "csv":
+            df = df.reindex(columns=self.columns)
+            save_df_to_csv(df, self.output_dir, append=self.nrows > 0)
+            self.nrows += len(df)
+            return
+
+        if self.schema is None:
+            # Columns the first chunk doesn't have are typed as text
+            fields = {field.name: field for field in get_arrow_schema(df)}
+            self.schema = pa.schema(
+                [fields.get(str(c), pa.field(str(c), pa.string())) for c in self.columns]
+            )
+        table = to_arrow_table(df, self.schema)
+
+        if self._writer is None:
+            if self.report_format == "parquet":
+                self._writer = pq.ParquetWriter(self.path, self.schema)
+            else:
+                self._stream = gzip.open(self.path, "wb", compresslevel=REPORT_GZIP_LEVEL)
+                self._writer = pa_csv.CSVWriter(self._stream, self.schema)
+
+        self._writer.write_table(table)
+        self.nrows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        log.info(f"Saved {self.nrows} rows to {self.path}")
+
+
+def get_arrow_schema(df):
+    """The Arrow schema of a report, inferred from the (python) values of its first chunk
+
+    Columns with mixed types, or with no values at all, are typed as text.
+    """
+    fields = []
+    for name in df.columns:
+        values = df[name]
+        try:
+            arrow_type = pa.array(values.to_list(), from_pandas=True).type
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrow_type = pa.string()
+        # An empty column is read as floats (NaN) by pandas
+        if pa.types.is_null(arrow_type) or values.isnull().all():
+            arrow_type = pa.string()
+        fields.append(pa.field(str(name), arrow_type))
+
+    return pa.schema(fields)
+
+
+def to_arrow_table(df, schema):
+    columns = [
+        to_arrow_array(df[field.name].to_list(), field) if field.name in df else None
+        for field in schema
+    ]
+    columns = [
+        pa.nulls(len(df), field.type) if column is None else column
+        for field, column in zip(schema, columns)
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def to_arrow_array(values, field):
+    """Convert a column's values to the type of its field in the report
+
+    Args:
+        values (list): The values of the column
+        field (pyarrow.Field): The column's field in the report's schema
+
+    Returns:
+        array (pyarrow.Array): The values as an array of the field's type.  Values that
+            can't be converted are written as text in a text column, and as missing
+            values otherwise.
+
+    """
+    # Arrow truncates floats to fit an integer column, so those are checked one by one
+    truncates = pa.types.is_integer(field.type) and any(isinstance(v, float) for v in values)
+    if not truncates:
+        try:
+            return pa.array(values, type=field.type, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+
+    if pa.types.is_string(field.type):
+        return pa.array([None if pd.isnull(v) else str(v) for v in values], type=field.type)
+
+    def fits(value):
+        try:
+            return pa.scalar(value, type=field.type).as_py() == value
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return False
+
+    fitting = [None if pd.isnull(v) or not fits(v) else v for v in values]
+    dropped = sum(1 for v, f in zip(values, fitting) if not pd.isnull(v) and f is None)
+    if dropped:
         log.warning(
-            f"Column name{ROI.HANDLE_KWD} is reserved.  Data will not be uploaded."
+            f'{dropped} values of column "{field.name}" are not {field.type}, and are '
+            f"left out of the report"
         )
-        series.pop(ROI.HANDLE_KWD)
+    return pa.array(fitting, type=field.type)
 
-    return handle_dict
 
+def get_canonical_text(values):
+    """The text of each value of a column, whatever type it was read as
 
-def panda_pop(series, key, default=None):
-    """recreate the behavior of a dictionary "pop" for a pandas series
-
-    behavior:
-    if element exists, return the value and remove the element
-    if the element doesn't exist, return the default
-    the default default is "None"
+    The same cell can be read as a different type depending on the rest of its column
+    (e.g. 10 is read as 10.0 once another row of the column is 10.5, or only in the
+    chunks of the file that have such a row), so whole numbers are written without a
+    decimal point.  Missing values are empty.
 
     Args:
-        series (pandas.Series): The series to pop from
-        key (string): the key to look for and pop
-        default (anything): the default value to return if the key isn't present
+        values (pandas.Series): A column of the dataframe
 
     Returns:
+        text (pandas.Series): The canonical text of each value
 
     """
-    if key in series:
-        return series.pop(key)
+    missing = values.isnull()
+    if pd.api.types.infer_dtype(values, skipna=True) == "string":
+        text = values
     else:
-        return default
+        text = pd.Series(
+            list(map(canonical_value, values.to_numpy(dtype=object))), index=values.index
+        )
+    return text.mask(missing, "")
+
+
+def canonical_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
 
+def hash_columns(df, columns):
+    """Hashes the canonical text of the given columns of each row
 
-def get_roi_from_row(series, file, session):
-    """Generate the dictionaries from a pandas series to create the ROI in flywheel
+    Each non-empty cell is hashed with a key made from its column name, and the cell
+    hashes of a row are added up, so neither the order of the columns nor an empty
+    column changes the hash.
 
     Args:
-        series (pandas.Series): a row from a dataframe describing an ROI
-        file (flywheel.FileEntry): a flywheel file to attach the ROI to
-        session (flywheel.Session): the parent session of the file
+        df (pandas.DataFrame): The dataframe of ROI's
+        columns (list): The columns to hash, those missing from `df` are skipped
 
     Returns:
-        roi (ROI_Template.ROI): a custom ROI object
+        hashes (numpy.ndarray): a uint64 hash for each row of `df`
 
     """
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    for column in columns:
+        if column not in df:
+            continue
+        text = get_canonical_text(df[column]).to_numpy(dtype=object)
+        key = hashlib.md5(str(column).encode()).hexdigest()[:16]
+        cells = pd.util.hash_array(text, hash_key=key)
+        hashes += np.where(text != "", cells, np.uint64(0))
+    return hashes
 
-    # Get the handle from the row.  The handle contains the x/y bounds of the ROI
-    handle = get_handle_from_row(series)
-    stats = get_stats_from_row(series)
 
-    # This currently does not support putting ROI's on a specific slice number (intended for 2D images)
-    # That would require either the SOPInstanceUID from the original image or the slice number
-    # The problem with the SOPInstanceUID is that sometimes those UID's are hashed when a file is exported to another
-    # project using deid-export, so it wouldn't work trying to match them.
-    # The problem with slice number is that we'd have to load each and every dicom slice, read the metadata, and try
-    # To match the slice number.
-    id_dict = fu.get_uids_from_filename(file)
+def get_row_hashes(df):
+    """Hashes the content of each row, to recognize the same row across runs
 
-    for k in id_dict.keys():
-        panda_pop(series, k)
+    The canonical text of each cell is hashed (see `get_canonical_text`), so a row
+    hashes the same however its columns were read, and however the file was split
+    into chunks.  The gear's report columns are left out, so the status report of a
+    previous run hashes the same as the CSV file it was made from.
 
-    roi_dict = {ROI.HANDLE_KWD: handle}
-    roi_dict.update(id_dict)
+    Args:
+        df (pandas.DataFrame): The pandas dataframe generated from the input CSV file
 
-    if ROI.ROITYPE_HDR in series or "ROI type" in series:
-        roi_dict[ROI.ROITYPE_KWD] = panda_pop(series, ROI.ROITYPE_HDR)
-    else:
-        log.warning('Must Specify ROI type with the key "roi type"')
+    Returns:
+        hashes (pandas.Series): a 16 character hex digest for each row of `df`
 
-    # This adds all remaining keys to the roi dict.
-    roi_dict.update(series)
+    """
+    columns = [c for c in df.columns if c not in REPORT_COLUMNS]
+    return to_hex(hash_columns(df, columns), df.index)
 
-    roi_dict[ROI.PATIENTID_KWD] = file.info.get("PatientID")
-    roi_dict[ROI.CACHEDSTATS_KWD] = stats
 
-    roi_number_dict = fu.get_roi_number(session)
-    roi_dict.update(roi_number_dict)
-    roi_dict[ROI.TIMEPOINTID_KWD] = "TimepointId"
+def get_row_keys(df):
+    """Identifies each row by the place of the ROI it makes, rather than by its content
 
-    roi = ROI.ROI()
-    roi.roi_from_dict(**roi_dict)
+    A row is keyed by the file it is on (its labels, or its DICOM UID's) and its roi
+    type, so when a row is edited its key stays the same while its hash (see
+    `get_row_hashes`) changes.  Rows are not told apart by their position, so rows
+    inserted, deleted or moved around don't change the key of the others.  A delta
+    import replaces an ROI with the same key whose row is no longer in the file (see
+    `ROI.get_stale_measurements`).
 
-    return roi
+    Args:
+        df (pandas.DataFrame): The dataframe of ROI's
 
+    Returns:
+        keys (pandas.Series): a 16 character hex digest for each row of `df`
+
+    """
+    return to_hex(hash_columns(df, ROW_KEY_COLUMNS), df.index)
+
+
+def to_hex(hashes, index):
+    """The 16 character hex digest of each uint64 hash, as a series on `index`"""
+    digits = np.frombuffer(hashes.astype(">u8").tobytes().hex().encode(), dtype="S16")
+    return pd.Series(digits.astype(str).astype(object), index=index)
 
-def save_df_to_csv(df, output_dir):
-    """saves a dataframe to the specified output directory with the name "Data_Import_Status_Report.csv"
+
+def validate_rows(df, match_columns=LABEL_COLUMNS, row_hashes=None):
+    """Finds the rows that can't be imported, before any API call is made for them
+
+    Every check works on whole columns at once.  A frame with a forbidden column, or
+    without one of the required columns, can't be imported at all, so every row is
+    invalid.  Otherwise a row is invalid if:
+        - one of `match_columns` is empty
+        - one of its x/y min/max coordinates is not a finite number
+        - its roi type is not one of `ROI.VALIDROI_KWD`
+        - it is a duplicate of an earlier row
 
     Args:
-        df (pandas.DataFrame): the dataframe to save
-        output_dir (Pathlike): the directory to save to
+        df (pandas.DataFrame): The dataframe of ROI's, with the columns described in
+            "Sample.csv"
+        match_columns (list): The columns used to match a row to its file,
+            `LABEL_COLUMNS` or `UID_COLUMNS`
+        row_hashes (pandas.Series): The hash of each row, from `get_row_hashes`.  If not
+            given, the rows are hashed.
 
     Returns:
+        errors (pandas.Series): The first problem found with each row, or None for the
+            rows that are valid
 
     """
-    output_path = output_dir / "Data_Import_Status_report.csv"
-    df.to_csv(output_path, index=False)
+    errors = pd.Series(None, index=df.index, dtype=object)
+
+    for fk in ROI.FORBIDDEN_KWD:
+        if fk in df:
+            log.error(f"Forbidden column {fk} found in {list(df.columns)}")
+            return errors.fillna(f"forbidden column {fk}")
+
+    for mk in match_columns + COORDINATE_COLUMNS + [ROI.ROITYPE_HDR]:
+        if mk not in df:
+            log.error(f"Mandatory column {mk} not present in {list(df.columns)}")
+            return errors.fillna(f"missing column {mk}")
+
+    def flag(invalid, error):
+        # Only the first problem found with a row is reported
+        nonlocal errors
+        errors = errors.mask(invalid & errors.isnull(), error)
+
+    for mk in match_columns:
+        flag(df[mk].isnull(), f"no {mk}")
+
+    for key in COORDINATE_COLUMNS:
+        coordinate = pd.to_numeric(df[key], errors="coerce").to_numpy(dtype=float)
+        flag(~np.isfinite(coordinate), f"{key} is not a finite number")
+
+    # The same (case insensitive) check as `ROI.is_valid_tool_type`
+    valid_types = [roi.lower() for roi in ROI.VALIDROI_KWD]
+    tool_types = df[ROI.ROITYPE_HDR].astype(str)
+    flag(~tool_types.str.lower().isin(valid_types), "invalid roi type " + tool_types)
+
+    if row_hashes is None:
+        row_hashes = get_row_hashes(df)
+    duplicates = row_hashes.duplicated()
+    if duplicates.any():
+        first_rows = pd.Series(row_hashes.index, index=row_hashes.to_numpy())
+        first_rows = first_rows[~first_rows.index.duplicated()]
+        flag(duplicates, "duplicate of row " + row_hashes.map(first_rows).astype(str))
+
+    return errors
 
 
 def get_fw_path(series):
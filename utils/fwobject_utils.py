@@ -1,11 +1,12 @@
 import collections.abc
-import numpy as np
 
 import logging
 
 from utils import ROI_Template as ROI
+from utils import progress_utils as pu
 
 log = logging.getLogger(__name__)
+row_log = logging.getLogger(pu.ROW_LOGGER)
 
 
 def get_uids_from_filename(file):
@@ -27,7 +28,7 @@ def get_uids_from_filename(file):
     }
 
     for id, value in id_dict.items():
-        log.info(f"Found {value} for {id}")
+        row_log.info("Found %s for %s", value, id)
 
     return id_dict
 
@@ -45,7 +46,18 @@ def get_roi_number(session):
     """
 
     session = session.reload()
-    sinfo = session.info
+    return get_roi_number_from_info(session.info)
+
+
+def get_roi_number_from_info(sinfo):
+    """Gets the next ROI number from a session's info, without reloading the session
+
+    Args:
+        sinfo (dict): the info of the session that we are adding an ROI to
+
+    Returns:
+        number_dict (dict): a dictionary with the values needed to properly number the new ROI
+    """
 
     # If the session has the metadata object "ohifViewer.measurements.<roi_type>":
     # Updated to count ALL roi's to determine ROI number -
@@ -88,29 +100,11 @@ def get_roi_number(session):
     return number_dict
 
 
-def get_session_files(fw, session):
-    log.debug('getting session acquisition files')
-    for acq in session.acquisitions.iter():
-        acq = acq.reload()
-        for file_ in acq.files:
-            yield file_
-
-def filter_matches(objects, name, file_type):
-    name_w_file_type = name + f".{file_type}"
-    for obj in objects:
-        if obj.get("name") == name or obj.get("name") == name_w_file_type:
-            yield obj
-
-
 def update(d, u, overwrite):
     for k, v in u.items():
         if isinstance(v, collections.abc.Mapping):
             d[k] = update(d.get(k, {}), v, overwrite)
         else:
-            # Flywheel doesn't like numpy data types:
-            if type(v).__module__ == np.__name__:
-                v = v.item()
-
             log.debug(f'checking if "{k}" in {d.keys()}')
             if k in d:
                 if overwrite:
@@ -123,27 +117,3 @@ def update(d, u, overwrite):
                 d[k] = v
 
     return d
-
-
-def cleanse_the_filthy_numpy(dict):
-    """change inputs that are numpy classes to python classes
-
-    when you read a csv with Pandas, it makes "int" "numpy_int", and flywheel doesn't like that.
-    Does the same for floats and bools, I think.  This fixes it
-
-    Args:
-        dict (dict): a dict
-
-    Returns:
-        dict (dict): a dict made of only python-base classes.
-
-    """
-    for k, v in dict.items():
-        if isinstance(v, collections.abc.Mapping):
-            dict[k] = cleanse_the_filthy_numpy(dict.get(k, {}))
-        else:
-            # Flywheel doesn't like numpy data types:
-            if type(v).__module__ == np.__name__:
-                v = v.item()
-                dict[k] = v
-    return dict
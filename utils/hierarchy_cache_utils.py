@@ -0,0 +1,317 @@
+import contextlib
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import tempfile
+import threading
+
+import flywheel
+
+from utils import ROI_Template as ROI
+from utils import hierarchy_utils as hu
+
+log = logging.getLogger(__name__)
+
+# The name of the cache when it is kept as an attachment of the gear's project
+HIERARCHY_CACHE_FILE = "ROI_import_hierarchy_cache.sqlite"
+PROJECT_ATTACHMENT = "project"
+
+# Containers modified this long before a snapshot was taken are listed again in the
+# next refresh, in case the clocks of the gear and the flywheel site disagree
+SYNC_MARGIN = timedelta(minutes=5)
+SYNC_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# The only file info the import reads, and so the only info kept in the cache
+CACHED_INFO_KEYS = [
+    ROI.SOPINSTANCEUID_HDR,
+    ROI.SERIESINSTANCEUID_HDR,
+    ROI.STUDYINSTANCEUID_HDR,
+    "PatientID",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY, synced TEXT NOT NULL, index_uids INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS subjects (id TEXT PRIMARY KEY, project_id TEXT, label TEXT);
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY, project_id TEXT, subject_id TEXT, label TEXT
+);
+CREATE TABLE IF NOT EXISTS acquisitions (
+    id TEXT PRIMARY KEY, project_id TEXT, session_id TEXT, label TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    project_id TEXT, acquisition_id TEXT, name TEXT, file_id TEXT, info TEXT
+);
+CREATE INDEX IF NOT EXISTS files_by_acquisition ON files (acquisition_id);
+"""
+
+
+class HierarchyCache:
+    """A single-file (SQLite) cache of project snapshots, reused across gear runs
+
+    The cache keeps the subjects, sessions and acquisitions of each project it has
+    seen, and the name, ID and DICOM UID's of every file.  When a project is loaded
+    again, only the containers modified since its snapshot was saved are listed (with
+    a `modified>` filter), and the rest of the snapshot is read from the cache, so a
+    repeat run against a mostly static project makes almost no discovery calls.
+
+    Containers that are deleted from flywheel are not noticed until the cache is
+    deleted.  Rows matched to them fail when their session is written.
+
+    Args:
+        path (Pathlike): The SQLite file.  It is created if it doesn't exist.
+        attach_to (flywheel.Project): If given, `save` uploads the cache to this
+            project, as `HIERARCHY_CACHE_FILE`.
+    """
+
+    def __init__(self, path, attach_to=None):
+        self.path = Path(path)
+        self.attach_to = attach_to
+        self.loaded = {}
+        self._lock = threading.Lock()
+
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """A connection to the cache, committed (or rolled back) and closed when done
+
+        A `sqlite3.Connection` used as a context manager only ends the transaction, it
+        doesn't close the connection.
+        """
+        db = sqlite3.connect(self.path, timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def load(self, fw, project, index_uids=False):
+        """Load a snapshot of a project, refreshing its cached snapshot if there is one
+
+        Args:
+            fw (flywheel.Client): the flywheel Client
+            project (flywheel.Project): The project to load
+            index_uids (boolean): Index the files by SOPInstanceUID
+
+        Returns:
+            hierarchy (hu.ProjectHierarchy): the loaded snapshot
+
+        """
+        started = datetime.now(timezone.utc) - SYNC_MARGIN
+        with self._connect() as db:
+            cached = db.execute(
+                "SELECT synced, index_uids FROM projects WHERE id = ?", (project.id,)
+            ).fetchone()
+
+        # A snapshot cached without the file info can't be indexed by UID
+        if cached is None or (index_uids and not cached[1]):
+            log.info(f"No cached snapshot of project {project.label}, loading it in full")
+            hierarchy = hu.load_project_hierarchy(fw, project, index_uids=index_uids)
+        else:
+            synced, cached_uids = cached
+            index_uids = index_uids or bool(cached_uids)
+            hierarchy = self.refresh(fw, project, synced, index_uids)
+
+        with self._lock:
+            self.loaded[project.id] = (hierarchy, started, index_uids)
+        return hierarchy
+
+    def refresh(self, fw, project, synced, index_uids):
+        """Read a project's cached snapshot, and list what was modified since `synced`"""
+        hierarchy = hu.ProjectHierarchy(project)
+        project_filter = f"parents.project={project.id}"
+        modified_filter = f"modified>{synced}"
+        list_options = {"include_all_info": True} if index_uids else {}
+
+        with self._connect() as db:
+            subjects, sessions, acquisitions = self.read(db, project.id)
+
+        changed = {"subjects": 0, "sessions": 0, "acquisitions": 0}
+        for subject in fw.subjects.iter_find(project_filter, modified_filter):
+            subjects[subject.id] = subject
+            changed["subjects"] += 1
+        for session in fw.sessions.iter_find(project_filter, modified_filter):
+            sessions[session.id] = session
+            changed["sessions"] += 1
+
+        changed_acquisitions = set()
+        for acquisition in fw.acquisitions.iter_find(
+            project_filter, modified_filter, **list_options
+        ):
+            acquisitions[acquisition.id] = acquisition
+            changed_acquisitions.add(acquisition.id)
+        changed["acquisitions"] = len(changed_acquisitions)
+
+        hierarchy.subjects = subjects
+        hierarchy.sessions = {
+            session_id: session
+            for session_id, session in sessions.items()
+            if session.parents.subject in subjects
+        }
+        records = {}
+        for acquisition in acquisitions.values():
+            records[acquisition.id] = hierarchy.add_acquisition(acquisition)
+
+        if index_uids:
+            for acquisition_id, acquisition_records in records.items():
+                for record in acquisition_records:
+                    if acquisition_id in changed_acquisitions:
+                        hierarchy.load_file(fw, record)
+                    hierarchy.index_uids(record)
+
+        changes = ", ".join(f"{n} {kind}" for kind, n in changed.items())
+        log.info(
+            f"Loaded {len(hierarchy.subjects)} subjects, {len(hierarchy.sessions)} "
+            f"sessions and {len(hierarchy.acquisitions)} acquisitions of project "
+            f"{project.label} from the cache ({changes} modified since {synced})"
+        )
+        return hierarchy
+
+    def read(self, db, project_id):
+        """The cached subjects, sessions and acquisitions (with files) of a project
+
+        They are rebuilt as the SDK models the listings return, with only the fields
+        the import uses.
+        """
+        subjects = {
+            subject_id: flywheel.Subject(id=subject_id, label=label)
+            for subject_id, label in db.execute(
+                "SELECT id, label FROM subjects WHERE project_id = ?", (project_id,)
+            )
+        }
+        sessions = {
+            session_id: flywheel.Session(
+                id=session_id, label=label, parents=flywheel.SessionParents(subject=subject_id)
+            )
+            for session_id, subject_id, label in db.execute(
+                "SELECT id, subject_id, label FROM sessions WHERE project_id = ?",
+                (project_id,),
+            )
+        }
+        acquisitions = {
+            acquisition_id: flywheel.Acquisition(
+                id=acquisition_id,
+                label=label,
+                parents=flywheel.AcquisitionParents(session=session_id),
+                files=[],
+            )
+            for acquisition_id, session_id, label in db.execute(
+                "SELECT id, session_id, label FROM acquisitions WHERE project_id = ?",
+                (project_id,),
+            )
+        }
+        for acquisition_id, name, file_id, info in db.execute(
+            "SELECT acquisition_id, name, file_id, info FROM files WHERE project_id = ?",
+            (project_id,),
+        ):
+            acquisition = acquisitions.get(acquisition_id)
+            if acquisition is None:
+                continue
+            acquisition.files.append(
+                flywheel.FileEntry(
+                    name=name,
+                    file_id=file_id,
+                    info=json.loads(info) if info else {},
+                    parents=flywheel.FileParents(acquisition=acquisition_id),
+                )
+            )
+
+        return subjects, sessions, acquisitions
+
+    def save(self, upload=True):
+        """Write the snapshots loaded in this run, and upload the cache if it's attached
+
+        The files are written as they are in the snapshot at the end of the run, so the
+        info of files that were loaded while importing is kept too.
+
+        Args:
+            upload (boolean): Upload the cache to its project (e.g. False in a dry run)
+        """
+        with self._connect() as db:
+            for project_id, (hierarchy, started, index_uids) in self.loaded.items():
+                self.write(db, project_id, hierarchy, started, index_uids)
+        log.info(f"Saved {len(self.loaded)} project snapshots to {self.path}")
+
+        if self.attach_to is not None and upload:
+            self.attach_to.upload_file(str(self.path))
+            log.info(f"Uploaded {HIERARCHY_CACHE_FILE} to project {self.attach_to.label}")
+
+    def write(self, db, project_id, hierarchy, started, index_uids):
+        for table in ("projects", "subjects", "sessions", "acquisitions", "files"):
+            column = "id" if table == "projects" else "project_id"
+            db.execute(f"DELETE FROM {table} WHERE {column} = ?", (project_id,))
+
+        db.execute(
+            "INSERT INTO projects VALUES (?, ?, ?)",
+            (project_id, started.strftime(SYNC_FORMAT), int(index_uids)),
+        )
+        db.executemany(
+            "INSERT INTO subjects VALUES (?, ?, ?)",
+            [(s.id, project_id, s.label) for s in hierarchy.subjects.values()],
+        )
+        db.executemany(
+            "INSERT INTO sessions VALUES (?, ?, ?, ?)",
+            [
+                (s.id, project_id, s.parents.subject, s.label)
+                for s in hierarchy.sessions.values()
+            ],
+        )
+        db.executemany(
+            "INSERT INTO acquisitions VALUES (?, ?, ?, ?)",
+            [
+                (a.id, project_id, a.parents.session, a.label)
+                for a in hierarchy.acquisitions.values()
+            ],
+        )
+        db.executemany(
+            "INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    project_id,
+                    record.acquisition_id,
+                    record.file.get("name"),
+                    record.file.get("file_id"),
+                    get_cached_info(record.file),
+                )
+                for records in hierarchy.file_index.values()
+                for record in records
+            ],
+        )
+
+
+def get_cached_info(file_):
+    """The part of a file's info kept in the cache, as json, or None if it has no info"""
+    info = file_.get("info")
+    if not info:
+        return None
+    return json.dumps({key: info[key] for key in CACHED_INFO_KEYS if key in info})
+
+
+def open_hierarchy_cache(project, location):
+    """Open the hierarchy cache at a path, or attached to the project
+
+    Args:
+        project (flywheel.Project): The project the gear runs in
+        location (string): `PROJECT_ATTACHMENT` to keep the cache as an attachment of
+            `project`, or the path of the cache file
+
+    Returns:
+        hierarchy_cache (HierarchyCache): the opened cache
+
+    """
+    if location != PROJECT_ATTACHMENT:
+        log.info(f"Using the hierarchy cache {location}")
+        return HierarchyCache(location)
+
+    path = Path(tempfile.mkdtemp()) / HIERARCHY_CACHE_FILE
+    if any(file_.name == HIERARCHY_CACHE_FILE for file_ in project.files or []):
+        log.info(f"Downloading {HIERARCHY_CACHE_FILE} from project {project.label}")
+        project.download_file(HIERARCHY_CACHE_FILE, str(path))
+    else:
+        log.info(f"Project {project.label} has no {HIERARCHY_CACHE_FILE} yet")
+    return HierarchyCache(path, attach_to=project)
@@ -0,0 +1,257 @@
+from dataclasses import dataclass
+import logging
+
+import flywheel
+
+from utils import ROI_Template as ROI
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class FileRecord:
+    file: flywheel.FileEntry = None
+    acquisition_id: str = None
+    session_id: str = None
+
+
+class ProjectHierarchy:
+    """An in-memory snapshot of a project's subjects, sessions, acquisitions and files
+
+    The snapshot is loaded with a handful of paged bulk queries (see
+    `load_project_hierarchy`), after which every lookup the import needs is a
+    dictionary access.  Files are indexed by (subject label, session label, file name),
+    and, if the snapshot was loaded with `index_uids`, by their SOPInstanceUID.
+    """
+
+    def __init__(self, project):
+        self.project = project
+        self.subjects = {}
+        self.sessions = {}
+        self.acquisitions = {}
+        self.file_index = {}
+        self.uid_index = {}
+        self._reloaded = set()
+
+    def add_file(self, subject_label, session_label, file_, acquisition):
+        key = (subject_label, session_label, file_.get("name"))
+        record = FileRecord(file_, acquisition.id, acquisition.parents.session)
+        self.file_index.setdefault(key, []).append(record)
+        return record
+
+    def add_acquisition(self, acquisition):
+        """Add an acquisition and its files, if its session is in the snapshot
+
+        Returns:
+            records (list): the FileRecords of the acquisition's files
+        """
+        session = self.sessions.get(acquisition.parents.session)
+        if session is None:
+            return []
+
+        self.acquisitions[acquisition.id] = acquisition
+        subject = self.subjects[session.parents.subject]
+        return [
+            self.add_file(subject.label, session.label, file_, acquisition)
+            for file_ in acquisition.files
+        ]
+
+    def index_uids(self, record):
+        """Add a file to the UID index, under the SOPInstanceUID in its info"""
+        sop_instance_uid = (record.file.get("info") or {}).get(ROI.SOPINSTANCEUID_HDR)
+        if sop_instance_uid:
+            self.uid_index.setdefault(str(sop_instance_uid), []).append(record)
+
+    def find_files(self, subject_label, session_label, name, file_type):
+        """Find files in the snapshot by their name, with or without the file type
+
+        Args:
+            subject_label (string): The subject label from the CSV
+            session_label (string): The session label from the CSV
+            name (string): the file name from the CSV
+            file_type (string): the file type from the CSV, tried as an extension
+
+        Returns:
+            matches (list): the FileRecords matching the location
+
+        """
+        # Flywheel labels are strings, but labels read from the CSV may be numbers
+        subject_label, session_label = str(subject_label), str(session_label)
+        name = str(name)
+        name_w_file_type = name + f".{file_type}"
+        matches = list(self.file_index.get((subject_label, session_label, name), []))
+        matches.extend(
+            self.file_index.get((subject_label, session_label, name_w_file_type), [])
+        )
+        return matches
+
+    def find_files_by_uid(
+        self, sop_instance_uid, series_instance_uid=None, study_instance_uid=None
+    ):
+        """Find files in the snapshot by the DICOM UID's in their info
+
+        These are the same fields `fu.get_uids_from_filename` reads to link an ROI to
+        its file.  The series and study UID's are optional, and only narrow the matches.
+
+        Args:
+            sop_instance_uid (string): The SOPInstanceUID from the CSV
+            series_instance_uid (string): The SeriesInstanceUID from the CSV, if any
+            study_instance_uid (string): The StudyInstanceUID from the CSV, if any
+
+        Returns:
+            matches (list): the FileRecords of the files with these UID's
+
+        """
+        matches = []
+        for record in self.uid_index.get(str(sop_instance_uid), []):
+            info = record.file.get("info") or {}
+            if series_instance_uid and str(info.get(ROI.SERIESINSTANCEUID_HDR)) != str(
+                series_instance_uid
+            ):
+                continue
+            if study_instance_uid and str(info.get(ROI.STUDYINSTANCEUID_HDR)) != str(
+                study_instance_uid
+            ):
+                continue
+            matches.append(record)
+        return matches
+
+    def get_labels(self, record):
+        """The subject and session labels of a file in the snapshot"""
+        session = self.sessions[record.session_id]
+        subject = self.subjects[session.parents.subject]
+        return subject.label, session.label
+
+    def load_file(self, fw, record):
+        """Return the record's file with its info, reloading its acquisition at most once
+
+        Bulk listings may omit file info, which is where the DICOM UID's live.
+
+        Args:
+            fw (flywheel.Client): the flywheel Client
+            record (FileRecord): the matched file
+
+        Returns:
+            file (flywheel.FileEntry): the file, with info
+
+        """
+        if record.file.get("info"):
+            return record.file
+
+        if record.acquisition_id not in self._reloaded:
+            acquisition = fw.get_acquisition(record.acquisition_id)
+            self.acquisitions[record.acquisition_id] = acquisition
+            self._reloaded.add(record.acquisition_id)
+
+        for file_ in self.acquisitions[record.acquisition_id].files:
+            if file_.get("name") == record.file.get("name"):
+                record.file = file_
+                break
+
+        return record.file
+
+    def get_acquisition(self, fw, acquisition_id):
+        if acquisition_id not in self.acquisitions:
+            self.acquisitions[acquisition_id] = fw.get_acquisition(acquisition_id)
+        return self.acquisitions[acquisition_id]
+
+
+def find_projects(fw, paths):
+    """Find projects by their group ID and label
+
+    The projects of each group are listed once, with a paged query, rather than looking
+    up every project on its own.
+
+    Args:
+        fw (flywheel.Client): the flywheel Client
+        paths (iterable): (group ID, project label) tuples
+
+    Returns:
+        projects (dict): (group ID, project label) -> flywheel.Project, for the
+            projects that were found
+
+    """
+    paths = set(paths)
+    projects = {}
+    for group_id in {group_id for group_id, _ in paths}:
+        log.debug(f"loading projects for group {group_id}")
+        for project in fw.projects.iter_find(f"parents.group={group_id}"):
+            path = (group_id, project.label)
+            if path not in paths:
+                continue
+            if path in projects:
+                log.warning(f"Several projects are labeled {group_id}/{project.label}")
+                continue
+            projects[path] = project
+
+    return projects
+
+
+def load_project_hierarchy(
+    fw, project, subject_labels=None, index_uids=False, hierarchy_cache=None
+):
+    """Load a snapshot of the project's hierarchy with paged bulk queries
+
+    Subjects, sessions and acquisitions (with their files) are each listed once for
+    the whole project, rather than searching for every subject and session label
+    individually.  If `subject_labels` is given, only those subjects (and their
+    sessions, acquisitions and files) are kept in memory.
+
+    If `index_uids` is set, the acquisitions are listed with all their info, so that
+    every file can be indexed by the DICOM UID's in its info.  Only the acquisitions
+    whose files still come back without info are loaded one by one.
+
+    If a `hierarchy_cache` is given, the snapshot is taken from it instead, and only
+    the containers modified since it was saved are listed (see
+    `hc.HierarchyCache.load`).  The cache always holds the whole project.
+
+    Args:
+        fw (flywheel.Client): the flywheel Client
+        project (flywheel.Project): The project to load
+        subject_labels (list): Optional subject labels to restrict the snapshot to
+        index_uids (boolean): Index the files by SOPInstanceUID, for
+            `ProjectHierarchy.find_files_by_uid`
+        hierarchy_cache (hc.HierarchyCache): The on-disk cache of earlier snapshots,
+            if any
+
+    Returns:
+        hierarchy (ProjectHierarchy): the loaded snapshot
+
+    """
+    if hierarchy_cache is not None:
+        return hierarchy_cache.load(fw, project, index_uids)
+
+    hierarchy = ProjectHierarchy(project)
+    project_filter = f"parents.project={project.id}"
+    if subject_labels is not None:
+        # Labels read from the CSV may have been parsed as numbers
+        subject_labels = {str(label) for label in subject_labels}
+
+    log.debug(f"loading subjects for project {project.label}")
+    for subject in fw.subjects.iter_find(project_filter):
+        if subject_labels is None or subject.label in subject_labels:
+            hierarchy.subjects[subject.id] = subject
+
+    log.debug(f"loading sessions for project {project.label}")
+    for session in fw.sessions.iter_find(project_filter):
+        if session.parents.subject in hierarchy.subjects:
+            hierarchy.sessions[session.id] = session
+
+    log.debug(f"loading acquisitions for project {project.label}")
+    list_options = {"include_all_info": True} if index_uids else {}
+    records = []
+    for acquisition in fw.acquisitions.iter_find(project_filter, **list_options):
+        records.extend(hierarchy.add_acquisition(acquisition))
+
+    if index_uids:
+        for record in records:
+            hierarchy.load_file(fw, record)
+            hierarchy.index_uids(record)
+        log.info(f"Indexed {len(hierarchy.uid_index)} SOPInstanceUID's")
+
+    log.info(
+        f"Loaded {len(hierarchy.subjects)} subjects, {len(hierarchy.sessions)} sessions "
+        f"and {len(hierarchy.acquisitions)} acquisitions from project {project.label}"
+    )
+
+    return hierarchy
@@ -1,6 +1,8 @@
+import asyncio
 import collections.abc
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
-import pprint
+import pandas as pd
 from flywheel.rest import ApiException
 import flywheel
 from dataclasses import dataclass
@@ -9,6 +11,10 @@ import logging
 
 import utils.fwobject_utils as fu
 import utils.csv_utils as cu
+import utils.hierarchy_utils as hu
+import utils.cache_utils as cache
+import utils.metrics_utils as mu
+import utils.progress_utils as pu
 import utils.ROI_Template as ROI
 
 # df_path = '/Users/davidparker/Documents/Flywheel/SSE/MyWork/Gears/Metadata_import_Errorprone/Data_Entry_2017_test.csv'
@@ -18,6 +24,37 @@ import utils.ROI_Template as ROI
 
 
 log = logging.getLogger("__main__")
+row_log = logging.getLogger(pu.ROW_LOGGER)
+
+SUCCESS_STATUSES = ["Success", "Dry-Run Success", "Unchanged"]
+
+# How rows are matched to files: by their subject/session labels and file name, or by
+# the DICOM UID's of the file
+MATCH_BY_LABELS = "labels"
+MATCH_BY_UIDS = "dicom_uids"
+
+# The columns that locate the session of a row, for each way of matching rows
+SESSION_COLUMNS = {
+    MATCH_BY_LABELS: [ROI.SUBJECT_HDR, ROI.SESSION_HDR],
+    MATCH_BY_UIDS: [ROI.STUDYINSTANCEUID_HDR],
+}
+
+# The status banners logged for each row (by the "rows" logger, see `pu.set_row_logging`)
+FAILED_BANNER = (
+    "\n--------------------------------------------------\n"
+    "STATUS: Failed\n"
+    "==================================================\n"
+)
+SUCCESS_BANNER = (
+    "\n--------------------------------------------------\n"
+    "STATUS: Success (%s)\n"
+    "==================================================\n"
+)
+DRY_RUN_BANNER = (
+    "\n--------------------------------------------------\n"
+    "DRYRUN STATUS: Success\n"
+    "==================================================\n"
+)
 
 @dataclass
 class Match:
@@ -27,11 +64,17 @@ class Match:
     subject_label: str = ""
     session_label: str = ""
     acquisition_label: str = ""
+    session_id: str = None
+    record: hu.FileRecord = None
+    row_hash: str = None
 
 
-    def get_acquisition(self, fw):
-        if self.acquisition_label is "" and self.file.parents.acquisition is not None:
-            acquisition = fw.get_acquisition(self.file.parents.acquisition)
+    def get_acquisition(self, fw, hierarchy=None):
+        if self.acquisition_label == "" and self.file.parents.acquisition is not None:
+            if hierarchy is not None:
+                acquisition = hierarchy.get_acquisition(fw, self.file.parents.acquisition)
+            else:
+                acquisition = fw.get_acquisition(self.file.parents.acquisition)
             append = f"/{acquisition.label}"
         else:
             append = ""
@@ -46,7 +89,24 @@ class Match:
 
 
 
-def import_data(fw, df, group, project, dry_run=False):
+def import_data(
+    fw,
+    df,
+    group,
+    project,
+    dry_run=False,
+    max_workers=1,
+    async_client=None,
+    hierarchy=None,
+    final_report=True,
+    user_id=None,
+    journal=None,
+    delta=False,
+    progress=None,
+    match_by=MATCH_BY_LABELS,
+    hierarchy_cache=None,
+    plan=None,
+):
     """Imports a pandas DataFrame into flywheel as ROI's
 
     Args:
@@ -57,11 +117,35 @@ def import_data(fw, df, group, project, dry_run=False):
         project (Flyhweel.Project): The project to import the data to.
         dry_run (boolean): Indicates if the data is actually imported (False) or a log
             is made of what would be changed, but no changes are actually made (True)
+        max_workers (integer): The number of sessions to import concurrently.
+        async_client (ac.AsyncClient): If given, sessions are read and written with
+            this asyncio client instead of `max_workers` threads.
+        hierarchy (hu.ProjectHierarchy): A snapshot of the project that is already
+            loaded.  If not given, one is loaded for the subjects in `df`.
+        final_report (boolean): Log the final report for this dataframe.
+        user_id (string): The user to credit with ROI's that have no "user origin".  If
+            not given, the user logged into the flywheel client is used.
+        journal (jr.Journal): If given, rows committed by a previous run are skipped,
+            and the rows committed by this one are recorded.
+        delta (boolean): Only import the rows whose fingerprint is not already on their
+            session.  The others are reported as "Unchanged".  An edited row replaces
+            an ROI on the same file, of the same roi type, whose row is no longer in
+            `df`.
+        progress (pu.ProgressReporter): If given, each row is counted in it as it
+            finishes.
+        match_by (string): `MATCH_BY_LABELS` to match rows to files by subject/session
+            label and file name, or `MATCH_BY_UIDS` to match them by the
+            SOPInstanceUID column (and the SeriesInstanceUID/StudyInstanceUID columns,
+            if present).
+        hierarchy_cache (hc.HierarchyCache): If given, and `hierarchy` isn't, the
+            project's snapshot is loaded through this on-disk cache.
+        plan (pl.Plan): If given (in a dry run), the ROI's built for each session are
+            recorded in it, to be written later by `apply_plan`.
 
     Returns:
-        df (pandas.DataFrame): The input dataframe, but with two additional columns
-            indicating the success or failure of the upload, and the flywheel object
-            that the ROI was uploaded to.
+        df (pandas.DataFrame): The input dataframe, but with three additional columns
+            indicating the success or failure of the upload, the flywheel object
+            that the ROI was uploaded to, and why the row was invalid, if it was.
 
     """
 
@@ -69,178 +153,1166 @@ def import_data(fw, df, group, project, dry_run=False):
     # Successfully uploaded or not, and where
     nrows, ncols = df.shape
     log.info("Starting Mapping")
+    # Rows are identified (and their ROI's fingerprinted) by their content as it is in
+    # the CSV file, and keyed by the file and roi type they place an ROI on
+    row_hashes = cu.get_row_hashes(df)
+    row_keys = cu.get_row_keys(df)
+    # A delta import keeps every ROI whose row is still in the dataframe
+    fingerprints = set(row_hashes) if delta else None
     df["Gear_Status"] = "Failed"
     df["Gear_FW_Location"] = None
+    df["Gear_Error"] = None
 
     # If the "User Origin" column is not present in the Dataframe, generate it using
     # the user ID of the person running this gear (or logged into the flywheel client)
     if ROI.USERORIGIN_HDR not in df:
-        user = fw.get_current_user()
-        user_id = user.id
+        if user_id is None:
+            user = fw.get_current_user()
+            user_id = user.id
         df[ROI.USERORIGIN_HDR] = user_id
 
     success_counter = 0
 
+    def record_results(results):
+        nonlocal success_counter
+        for index, status, address in results:
+            df.at[index, "Gear_Status"] = status
+            df.at[index, "Gear_FW_Location"] = address
+            if status in SUCCESS_STATUSES:
+                success_counter += 1
+        if progress is not None:
+            progress.update(status for index, status, address in results)
+
+    # Fail the rows that can't be imported up front, so no API time is spent on them
+    with mu.phase(fw, "validate"):
+        match_columns = cu.UID_COLUMNS if match_by == MATCH_BY_UIDS else cu.LABEL_COLUMNS
+        errors = cu.validate_rows(df, match_columns, row_hashes)
+    invalid = errors.notnull()
+    pending = df
+    if invalid.any():
+        df.loc[invalid, "Gear_Status"] = "Invalid"
+        df.loc[invalid, "Gear_Error"] = errors[invalid]
+        for error, count in errors[invalid].value_counts().items():
+            log.warning(f"{count} rows are invalid: {error}")
+        pending = df[~invalid]
+        if progress is not None:
+            progress.update(["Invalid"] * int(invalid.sum()))
+
+    # Skip the rows that a previous run already committed, without any API calls
+    if journal is not None:
+        committed = skip_committed_rows(df, row_hashes[pending.index], journal)
+        success_counter += len(committed)
+        pending = pending.drop(index=committed)
+        if progress is not None:
+            progress.update(["Success"] * len(committed))
+
+    if pending.empty:
+        log.info("No valid rows left to import")
+        if final_report:
+            log_final_report(success_counter, nrows, fw)
+        return df
+
     group_name = group.id
     project_name = project.label
 
     ############################################################################
     # STEP 1: Loop through subject/session combos and aggregate file matches  #
     ############################################################################
-    # We will first loop through and find any and all matches for each subject/session combination.
-    # Group by subject/session combos, to minimize loading.
-    unique_subjects = df[ROI.SUBJECT_HDR].unique()
-    log.debug(f"{len(unique_subjects)} unique subjects found")
+    # We will first load a snapshot of the project's hierarchy (only keeping the
+    # subjects named in the CSV), then find any and all matches for each row with
+    # dictionary lookups.
     # We are assuming that the group/project we're running in is the one we want to upload to.
+    if hierarchy is None:
+        with mu.phase(fw, "load"):
+            if match_by == MATCH_BY_UIDS or hierarchy_cache is not None:
+                # Any file of the project may hold the UID's, so all of it is indexed.
+                # A cached snapshot always holds the whole project.
+                hierarchy = hu.load_project_hierarchy(
+                    fw,
+                    project,
+                    index_uids=match_by == MATCH_BY_UIDS,
+                    hierarchy_cache=hierarchy_cache,
+                )
+            else:
+                unique_subjects = pending[ROI.SUBJECT_HDR].unique()
+                log.debug(f"{len(unique_subjects)} unique subjects found")
+                hierarchy = hu.load_project_hierarchy(
+                    fw, project, subject_labels=unique_subjects
+                )
+
+    with mu.phase(fw, "match"):
+        if match_by == MATCH_BY_UIDS:
+            session_rows = match_rows_by_uid(pending, hierarchy, group_name, project_name)
+        else:
+            session_rows = match_rows(pending, hierarchy, group_name, project_name)
+
+    n_matched = 0
+    for rows in session_rows.values():
+        for index, match in rows:
+            match.row_hash = row_hashes[index]
+        n_matched += len(rows)
+    if progress is not None:
+        progress.update(["Failed"] * (len(pending) - n_matched))
+
+    # Build the measurement for every row at once.  Only the file-specific values and
+    # ROI numbers are left to fill in for each row.
+    with mu.phase(fw, "build"):
+        measurements = cu.get_measurements_from_df(pending, row_hashes, row_keys)
+
+    ############################################################################
+    # STEP 3: Build the ROI's for each session and write them all with a       #
+    # single update per session                                                #
+    ############################################################################
+    # Sessions are independent of each other, so they can be imported on a pool of
+    # workers.  All the rows for one session are handled by the same worker, so writes
+    # to any one session stay serialized.
+    if async_client is not None:
+        log.info(
+            f"Importing {len(session_rows)} sessions with up to "
+            f"{async_client.max_in_flight} requests in flight"
+        )
+        import_sessions_async(
+            async_client,
+            fw,
+            measurements,
+            session_rows,
+            hierarchy,
+            dry_run,
+            journal,
+            fingerprints,
+            plan,
+            callback=record_results,
+        )
+    elif max_workers > 1:
+        log.info(f"Importing {len(session_rows)} sessions with {max_workers} workers")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    import_session_rois,
+                    fw,
+                    measurements,
+                    session_id,
+                    rows,
+                    hierarchy,
+                    dry_run,
+                    journal,
+                    fingerprints,
+                    plan,
+                )
+                for session_id, rows in session_rows.items()
+            ]
+            for future in as_completed(futures):
+                record_results(future.result())
+    else:
+        for session_id, rows in session_rows.items():
+            record_results(
+                import_session_rois(
+                    fw,
+                    measurements,
+                    session_id,
+                    rows,
+                    hierarchy,
+                    dry_run,
+                    journal,
+                    fingerprints,
+                    plan,
+                )
+            )
+
+    if final_report:
+        with mu.phase(fw, "report"):
+            log_final_report(success_counter, nrows, fw)
+
+    return df
+
+
+def match_rows(df, hierarchy, group_name, project_name):
+    """Matches each row of the dataframe to exactly one file in the project snapshot
+
+    Args:
+        df (pandas.DataFrame): The pandas dataframe generated from the input CSV file
+        hierarchy (hu.ProjectHierarchy): The snapshot of the project to match against
+        group_name (string): The ID of the group, for the flywheel path of each match
+        project_name (string): The label of the project, for the flywheel path of each
+            match
+
+    Returns:
+        session_rows (dict): session ID -> list of (index, Match) tuples for the rows
+            with exactly one match, grouped by the session their ROI is written to
+
+    """
     initial_matching = {}
-    # First we will descend into the first unique subject label
-    for subject_label in unique_subjects:
-        log.debug(f'looking for subject {subject_label}')
-        # There may be multiple subjects, but they will all have the same label
-        subjects = project.subjects.iter_find(f'label="{subject_label}"')
+    # Group by subject/session combos, to minimize loading.
+    session_groups = df.groupby([ROI.SUBJECT_HDR, ROI.SESSION_HDR])
+    for (subject_label, session_label), indexs in session_groups.groups.items():
+        row_log.debug(
+            "looking for session %s/%s - found %d entries",
+            subject_label,
+            session_label,
+            len(indexs),
+        )
+
+        # With each session, we must now search for each specific file.  There may be
+        # multiple matches - it is possible for 2 subjects to have the same label, each
+        # with a session with the same label.
+        for index in indexs:
+            series = df.loc[index]
+            object_name = series.get(ROI.MAPPING_COLUMN)
+            row_log.debug("looking for object %s", object_name)
 
-        # Now we will generate a dataframe group for the unique sessions present in this subject(s)
-        session_df = df[df[ROI.SUBJECT_HDR] == subject_label]
-        log.debug(f'{len(session_df)} entries for this subject.  Grouping by sessions')
-        session_groups = session_df.groupby([ROI.SESSION_HDR])
+            matching_files = hierarchy.find_files(
+                subject_label, session_label, object_name, series.get(ROI.FILETYPE_HDR)
+            )
+            matching_files = [
+                Match(
+                    record.file,
+                    group_name,
+                    project_name,
+                    subject_label,
+                    session_label,
+                    session_id=record.session_id,
+                    record=record,
+                )
+                for record in matching_files
+            ]
 
+            row_log.debug("found %d matching files", len(matching_files))
 
-        # Now we will loop through any subjects we found originally
-        for subject in subjects:
-            log.debug(f'working on subject {subject.label}')
+            if matching_files:
+                initial_matching[index] = matching_files
+                row_log.debug("adding match %s", index)
 
-            # We will loop through our unique session groups
-            for session_label, indexs in session_groups.groups.items():
-                log.debug(f'looking for session {session_label} - found {len(indexs)} entries')
-                # And search for sessions with that label on that subject.
-                sessions = subject.sessions.iter_find(f'label="{session_label}"')
+    return group_matches(df, initial_matching)
 
-                # We may find multiple - it is possible for 2 subjects to have the same label, each with a session with
-                #  the same label.
-                # Loop through the sessions we find (hopefully only one)
-                for session in sessions:
-                    log.debug(f'looking for session {session.label}')
 
+def match_rows_by_uid(df, hierarchy, group_name, project_name):
+    """Matches each row of the dataframe to exactly one file by its DICOM UID's
 
+    Each row's SOPInstanceUID is looked up in the project's UID index, so the subject,
+    session and file names in the CSV (if any) are not used, and may differ from the
+    ones in flywheel (e.g. after a de-identified export).  The SeriesInstanceUID and
+    StudyInstanceUID columns are optional, and only narrow the matches.
 
-                    # With each session, we must now search for each specific file
-                    for index in indexs:
-                        # Get a list of all files attached to the acquisitions in the session identified
-                        # by the object location found above
-                        objects_for_processing = fu.get_session_files(fw, session)
+    Args:
+        df (pandas.DataFrame): The pandas dataframe generated from the input CSV file,
+            with a SOPInstanceUID column
+        hierarchy (hu.ProjectHierarchy): The snapshot of the project, loaded with
+            `index_uids`
+        group_name (string): The ID of the group, for the flywheel path of each match
+        project_name (string): The label of the project, for the flywheel path of each
+            match
 
-                        series = session_df.loc[index]
-                        object_name = series.get(ROI.MAPPING_COLUMN)
-                        log.debug(f'looking for object {object_name}')
+    Returns:
+        session_rows (dict): session ID -> list of (index, Match) tuples for the rows
+            with exactly one match, grouped by the session their ROI is written to
 
-                        lookup_string = f"{group_name}/{project_name}/{subject_label}/{session_label}/{object_name}"
+    """
+    if ROI.SOPINSTANCEUID_HDR not in df:
+        log.error(f"Column {ROI.SOPINSTANCEUID_HDR} is required to match rows by UID")
+        return {}
 
-                        matching_files = fu.filter_matches(objects_for_processing, object_name, series.get('file type'))
-                        matching_files = [Match(file, group_name, project_name, subject_label, session_label) for file in matching_files]
+    def column(key):
+        if key in df:
+            return cu.to_python_list(df[key])
+        return [None] * len(df)
 
-                        log.debug(f'found {len(matching_files)} matching files')
+    initial_matching = {}
+    uids = zip(
+        df.index,
+        column(ROI.SOPINSTANCEUID_HDR),
+        column(ROI.SERIESINSTANCEUID_HDR),
+        column(ROI.STUDYINSTANCEUID_HDR),
+    )
+    for index, sop_instance_uid, series_instance_uid, study_instance_uid in uids:
+        if sop_instance_uid is None:
+            continue
 
-                        if index in initial_matching:
-                            initial_matching[index].extend(matching_files)
-                        else:
-                            initial_matching[index] = matching_files
-                            log.debug(f'adding match {index}, {type(index)}')
+        row_log.debug("looking for SOPInstanceUID %s", sop_instance_uid)
+        matching_files = []
+        for record in hierarchy.find_files_by_uid(
+            sop_instance_uid, series_instance_uid, study_instance_uid
+        ):
+            subject_label, session_label = hierarchy.get_labels(record)
+            matching_files.append(
+                Match(
+                    record.file,
+                    group_name,
+                    project_name,
+                    subject_label,
+                    session_label,
+                    session_id=record.session_id,
+                    record=record,
+                )
+            )
+
+        if matching_files:
+            initial_matching[index] = matching_files
+
+    return group_matches(df, initial_matching)
+
+
+def group_matches(df, initial_matching):
+    """Keeps the rows with exactly one match, grouped by the session of the match
+
+    Args:
+        df (pandas.DataFrame): The dataframe whose rows were matched
+        initial_matching (dict): row index -> list of every Match found for the row
+
+    Returns:
+        session_rows (dict): session ID -> list of (index, Match) tuples
 
+    """
     ############################################################################
     # STEP 2: Loop through aggregated matches and ensure there is only one     #
     # Match per row                                                            #
     ############################################################################
 
     # Now that we have assembled all the possible matches for every index in the dataframe, go through and make sure
-    # There aren't duplicates.
+    # There aren't duplicates.  Rows with exactly one match are grouped by the session
+    # that their ROI will be written to.
+    session_rows = {}
     for index in df.index:
-        series = df.loc[index]
-        log.debug(f'looking for {index} in matches:')
+        row_log.debug("looking for %s in matches:", index)
 
         try:
             if index not in initial_matching:
                 log.warning(f'0 matches found for row {index}')
-                log.info("\n--------------------------------------------------\n"
-                "STATUS: Failed\n"
-                "==================================================\n"
-                )
+                row_log.info(FAILED_BANNER)
                 continue
 
             matches = initial_matching[index]
             if len(matches) != 1:
 
                 log.warning(f'{len(matches)} matches found for index {index}, exactly 1 required')
-                log.info("\n--------------------------------------------------\n"
-                    "STATUS: Failed\n"
-                    "==================================================\n"
-                )
+                row_log.info(FAILED_BANNER)
                 continue
 
             match = matches[0]
-            # Generate a flywheel path to this file.  A little redundant since we
-            # already have group/project/subject/session, but this will also find
-            # acquisition and file.
-            match.get_acquisition(fw)
-            # Make this a data property
-            address = match.path()
+            session_rows.setdefault(match.session_id, []).append((index, match))
+
+        except Exception as e:
+            log.warning(
+                f"\n--------------------------------------------------\n"
+                f"STATUS: Failed\n"
+                f"row {index} unable to process for reason: {e}"
+                f"==================================================\n"
+            )
+
+            log.exception(e)
+            continue
 
-            # We write ROI info to the parent Session metadata, so get the containing session
-            # of the matching file.
-            parent = match.file.parent
-            if parent.container_type == "session":
-                ses = parent.reload()
+    return session_rows
+
+
+def import_data_by_project(
+    fw,
+    df,
+    group,
+    project,
+    dry_run=False,
+    max_workers=1,
+    async_client=None,
+    hierarchies=None,
+    final_report=True,
+    user_id=None,
+    journal=None,
+    delta=False,
+    progress=None,
+    match_by=MATCH_BY_LABELS,
+    hierarchy_cache=None,
+    plan=None,
+):
+    """Imports a pandas DataFrame into the projects named in its group/project columns
+
+    The rows are split by their group ID and project label, and each project's rows are
+    imported with `import_data`, against a hierarchy snapshot of that project only.
+    Rows without a group or project go to `group`/`project`.  Rows whose project can't
+    be found (or read) are reported as "Failed".
+
+    Projects are imported in parallel, up to `max_workers` at a time, each with up to
+    `max_workers` sessions in flight, unless sessions are written with the asyncio
+    client, in which case projects are imported one after the other.
+
+    Args:
+        fw (flywheel.Client): the flywheel Client
+        df (pandas.DataFrame): The pandas dataframe generated from the input CSV file,
+            with the columns described in "Sample.csv"
+        group (Flywheel.Group): The group of rows without a group.
+        project (Flyhweel.Project): The project of rows without a project.
+        dry_run (boolean): Indicates if the data is actually imported (False) or a log
+            is made of what would be changed, but no changes are actually made (True)
+        max_workers (integer): The number of projects, and of sessions in each project,
+            to import concurrently.
+        async_client (ac.AsyncClient): If given, sessions are read and written with
+            this asyncio client instead of `max_workers` threads.
+        hierarchies (dict): project ID -> hu.ProjectHierarchy.  If given, the
+            snapshots of the projects are taken from (and kept in) it, and loaded in
+            full, so that they can be reused for the next chunk of a stream.
+        final_report (boolean): Log the final report for this dataframe.
+        user_id (string): The user to credit with ROI's that have no "user origin".
+        journal (jr.Journal): If given, rows committed by a previous run are skipped,
+            and the rows committed by this one are recorded.
+        delta (boolean): Only import the rows whose fingerprint is not already on their
+            session.
+        progress (pu.ProgressReporter): If given, each row is counted in it as it
+            finishes.
+        match_by (string): How rows are matched to files, `MATCH_BY_LABELS` or
+            `MATCH_BY_UIDS`.
+        hierarchy_cache (hc.HierarchyCache): If given, the projects' snapshots are
+            loaded through this on-disk cache.
+        plan (pl.Plan): If given (in a dry run), the ROI's built for each session are
+            recorded in it.
+
+    Returns:
+        df (pandas.DataFrame): The input dataframe, with the status columns of
+            `import_data`
+
+    """
+    if df.empty:
+        # Nothing to route, but the report still gets its status columns
+        return import_data(
+            fw, df, group, project, dry_run, final_report=final_report, user_id=user_id
+        )
+
+    def column(key, default):
+        if key not in df:
+            return [default] * len(df)
+        values = cu.to_python_list(df[key])
+        return [default if value is None else str(value) for value in values]
+
+    paths = pd.Series(
+        list(zip(column(ROI.GROUP_HDR, group.id), column(ROI.PROJECT_HDR, project.label))),
+        index=df.index,
+    )
+    path_rows = paths.groupby(paths).groups
+
+    # Projects with a snapshot already (from an earlier chunk) aren't looked up again
+    projects = {
+        (hierarchy.project.parents.group, hierarchy.project.label): hierarchy.project
+        for hierarchy in (hierarchies or {}).values()
+    }
+    projects[(group.id, project.label)] = project
+    other_paths = [path for path in path_rows if path not in projects]
+    if other_paths:
+        with mu.phase(fw, "load"):
+            projects.update(hu.find_projects(fw, other_paths))
+    log.info(f"Importing rows into {len(path_rows)} projects")
+
+    # Look the current user up once, for every project, like `import_data_stream` does
+    fill_user_origin = ROI.USERORIGIN_HDR not in df
+    if user_id is None and fill_user_origin:
+        user_id = fw.get_current_user().id
+
+    def import_project(path, indexes):
+        project_df = df.loc[indexes]
+        project_ = projects.get(path)
+        if project_ is None:
+            log.warning(f"Project {'/'.join(path)} not found for {len(indexes)} rows")
+            if progress is not None:
+                progress.update(["Failed"] * len(indexes))
+            return project_df.assign(
+                Gear_Status="Failed",
+                Gear_FW_Location=None,
+                Gear_Error=f"project {'/'.join(path)} not found",
+            )
+
+        group_ = group if project_ is project else fw.get_group(project_.parents.group)
+        hierarchy = None
+        if hierarchies is not None:
+            if project_.id not in hierarchies:
+                with mu.phase(fw, "load"):
+                    hierarchies[project_.id] = hu.load_project_hierarchy(
+                        fw,
+                        project_,
+                        index_uids=match_by == MATCH_BY_UIDS,
+                        hierarchy_cache=hierarchy_cache,
+                    )
+            hierarchy = hierarchies[project_.id]
+
+        log.info(f"Importing {len(indexes)} rows into project {'/'.join(path)}")
+        return import_data(
+            fw,
+            project_df,
+            group_,
+            project_,
+            dry_run,
+            max_workers,
+            async_client,
+            hierarchy=hierarchy,
+            final_report=False,
+            user_id=user_id,
+            journal=journal,
+            delta=delta,
+            progress=progress,
+            match_by=match_by,
+            hierarchy_cache=hierarchy_cache,
+            plan=plan,
+        )
+
+    if async_client is None and max_workers > 1 and len(path_rows) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(path_rows))) as executor:
+            futures = [
+                executor.submit(import_project, path, indexes)
+                for path, indexes in path_rows.items()
+            ]
+            results = [future.result() for future in futures]
+    else:
+        results = [import_project(path, indexes) for path, indexes in path_rows.items()]
+
+    df = pd.concat(results).loc[df.index]
+    if fill_user_origin:
+        # The rows of projects that were not found never got a user origin
+        df[ROI.USERORIGIN_HDR] = df[ROI.USERORIGIN_HDR].fillna(user_id)
+
+    if final_report:
+        with mu.phase(fw, "report"):
+            success_counter = df["Gear_Status"].isin(SUCCESS_STATUSES).sum()
+            log_final_report(success_counter, len(df), fw)
+
+    return df
+
+
+def import_data_stream(
+    fw,
+    chunks,
+    group,
+    project,
+    output_dir,
+    dry_run=False,
+    max_workers=1,
+    async_client=None,
+    journal=None,
+    delta=False,
+    progress=None,
+    match_by=MATCH_BY_LABELS,
+    report_format="csv",
+    route_by_project=False,
+    hierarchy_cache=None,
+    plan=None,
+    plan_entries=None,
+    report_columns=None,
+):
+    """Imports a stream of dataframe chunks into flywheel as ROI's
+
+    The project hierarchy is loaded once, and each chunk is imported with
+    `import_data` (or, given a plan, written with `apply_plan`) and appended to the
+    status report as soon as it is done, so memory is bounded by the chunk size rather
+    than the file size.  The next chunk is parsed
+    in the background while the current one is being uploaded.
+
+    Sessions whose rows span several chunks are written once per chunk, unless the
+    chunks are grouped by session first (see `ld.group_chunks_by_session`).
+
+    Args:
+        fw (flywheel.Client): the flywheel Client
+        chunks (iterator): pandas DataFrames, e.g. from `ld.iter_text_dataframe`
+        group (Flywheel.Group): The group to import the data to.
+        project (Flyhweel.Project): The project to import the data to.
+        output_dir (Pathlike): The directory to save the status report to
+        dry_run (boolean): Indicates if the data is actually imported (False) or a log
+            is made of what would be changed, but no changes are actually made (True)
+        max_workers (integer): The number of sessions to import concurrently.
+        async_client (ac.AsyncClient): If given, sessions are read and written with
+            this asyncio client instead of `max_workers` threads.
+        journal (jr.Journal): If given, rows committed by a previous run are skipped,
+            and the rows committed by this one are recorded.
+        delta (boolean): Only import the rows whose fingerprint is not already on their
+            session.
+        progress (pu.ProgressReporter): If given, each row is counted in it as it
+            finishes.
+        match_by (string): How rows are matched to files, `MATCH_BY_LABELS` or
+            `MATCH_BY_UIDS`.
+        report_format (string): The format of the status report, one of
+            `cu.REPORT_FORMATS`.
+        route_by_project (boolean): Import each row into the project named in its
+            group/project columns (see `import_data_by_project`), keeping a snapshot of
+            every project for the whole stream.
+        hierarchy_cache (hc.HierarchyCache): If given, the projects' snapshots are
+            loaded through this on-disk cache.
+        plan (pl.Plan): If given (in a dry run), the ROI's built for each session, and
+            the outcome of the other rows, are recorded in it chunk by chunk.
+        plan_entries (pl.PlanEntries): If given (from `pl.read_plan`), the chunks are
+            not matched or built, the ROI's planned for them are written instead, and
+            no hierarchy is loaded.
+        report_columns (list): The columns the status report starts with, when the
+            chunks don't all have the same columns (see `cu.ReportWriter`).
+
+    Returns:
+        nrows (integer): The number of rows imported
+        success_counter (integer): The number of rows imported successfully
+
+    """
+    hierarchy = None
+    hierarchies = {}
+    if plan_entries is None:
+        with mu.phase(fw, "load"):
+            hierarchy = hu.load_project_hierarchy(
+                fw,
+                project,
+                index_uids=match_by == MATCH_BY_UIDS,
+                hierarchy_cache=hierarchy_cache,
+            )
+        hierarchies[project.id] = hierarchy
+
+    nrows = 0
+    success_counter = 0
+    user_id = None
+
+    report = cu.ReportWriter(output_dir, report_format, report_columns)
+    with report, ThreadPoolExecutor(max_workers=1) as reader:
+        next_chunk = reader.submit(next, chunks, None)
+        while True:
+            with mu.phase(fw, "load"):
+                df = next_chunk.result()
+            if df is None:
+                break
+            next_chunk = reader.submit(next, chunks, None)
+
+            # Only look up the current user once, rather than in every chunk
+            if user_id is None and ROI.USERORIGIN_HDR not in df:
+                user_id = fw.get_current_user().id
+
+            log.info(f"Importing rows {nrows} to {nrows + len(df) - 1}")
+            if plan_entries is not None:
+                df = apply_plan(
+                    fw,
+                    df,
+                    plan_entries,
+                    dry_run,
+                    max_workers,
+                    final_report=False,
+                    user_id=user_id,
+                    journal=journal,
+                    delta=delta,
+                    progress=progress,
+                )
+            elif route_by_project:
+                df = import_data_by_project(
+                    fw,
+                    df,
+                    group,
+                    project,
+                    dry_run,
+                    max_workers,
+                    async_client,
+                    hierarchies=hierarchies,
+                    final_report=False,
+                    user_id=user_id,
+                    journal=journal,
+                    delta=delta,
+                    progress=progress,
+                    match_by=match_by,
+                    hierarchy_cache=hierarchy_cache,
+                    plan=plan,
+                )
             else:
-                ses = fw.get_session(parent.parents.session)
+                df = import_data(
+                    fw,
+                    df,
+                    group,
+                    project,
+                    dry_run,
+                    max_workers,
+                    async_client,
+                    hierarchy=hierarchy,
+                    final_report=False,
+                    user_id=user_id,
+                    journal=journal,
+                    delta=delta,
+                    progress=progress,
+                    match_by=match_by,
+                    plan=plan,
+                )
+            with mu.phase(fw, "report"):
+                report.write(df)
+                if plan is not None:
+                    plan.record_results(df)
 
-            # Get an ROI object from the row using required and optional columns.
-            roi = cu.get_roi_from_row(series, match.file, ses)
+            nrows += len(df)
+            success_counter += df["Gear_Status"].isin(SUCCESS_STATUSES).sum()
 
-            # If this gear is a dry run, we'll only log, not actually upload
-            if dry_run:
-                log.info(f"Would modify info on {address}")
-                df.at[index, "Gear_Status"] = "Dry-Run Success"
-                df.at[index, "Gear_FW_Location"] = address
-                log.info(
-                    "\n--------------------------------------------------\n"
-                    "DRYRUN STATUS: Success\n"
-                    "==================================================\n"
+    with mu.phase(fw, "report"):
+        log_final_report(success_counter, nrows, fw)
+
+    return nrows, success_counter
+
+
+def apply_plan(
+    fw,
+    df,
+    plan_entries,
+    dry_run=False,
+    max_workers=1,
+    final_report=True,
+    user_id=None,
+    journal=None,
+    delta=False,
+    progress=None,
+):
+    """Writes the ROI's that a dry run planned, without matching or building them again
+
+    No project snapshot is loaded and no file is looked up: each session in the plan is
+    read once, for the ROI's on it now (so the planned ROI's are numbered after them,
+    and duplicates are still caught), and written with a single update.  Rows the dry
+    run did not plan to write are reported with their dry run status.
+
+    Args:
+        fw (flywheel.Client): the flywheel Client
+        df (pandas.DataFrame): The dataframe (or chunk) the plan was made from, loaded
+            the same way as in the dry run.  Rows whose content has changed since are
+            not written.
+        plan_entries (pl.PlanEntries): row index -> entry, from `pl.read_plan`
+        dry_run (boolean): Only read the sessions and check the planned ROI's are not
+            duplicates, do not write them.
+        max_workers (integer): The number of sessions to write concurrently.
+        final_report (boolean): Log the final report for this dataframe.
+        user_id (string): The user to credit with ROI's that have no "user origin".
+        journal (jr.Journal): If given, rows committed by a previous run are skipped,
+            and the rows committed by this one are recorded.
+        delta (boolean): Let edited rows replace the ROI's of rows that are no longer
+            in `df` (see `import_data`).
+        progress (pu.ProgressReporter): If given, each row is counted in it as it
+            finishes.
+
+    Returns:
+        df (pandas.DataFrame): The input dataframe, with the status columns of
+            `import_data`
+
+    """
+    nrows = len(df)
+    row_hashes = cu.get_row_hashes(df)
+    if ROI.USERORIGIN_HDR not in df:
+        if user_id is None:
+            user_id = fw.get_current_user().id
+        df[ROI.USERORIGIN_HDR] = user_id
+
+    # Every row starts with its dry run outcome, and the planned rows are written below
+    statuses, addresses, errors = [], [], []
+    session_entries = collections.defaultdict(list)
+    pending = []
+    for index, row_hash in row_hashes.items():
+        entry = plan_entries.get(index)
+        status, address, error = "Failed", None, None
+        if entry is None:
+            error = "not in the plan"
+        elif "session_id" not in entry:
+            status, address, error = entry["status"], entry["address"], entry["error"]
+        elif entry["row"] != row_hash:
+            error = "row changed since the plan was made"
+        else:
+            committed = journal.take(row_hash) if journal is not None else None
+            if committed is not None:
+                status, address = "Success", committed["address"]
+            else:
+                session_entries[entry["session_id"]].append(entry)
+                pending.append(index)
+        statuses.append(status)
+        addresses.append(address)
+        errors.append(error)
+
+    df["Gear_Status"] = statuses
+    df["Gear_FW_Location"] = addresses
+    df["Gear_Error"] = errors
+    if progress is not None:
+        progress.update(df.loc[~df.index.isin(pending), "Gear_Status"])
+
+    def record_results(results):
+        for index, status, address in results:
+            df.at[index, "Gear_Status"] = status
+            df.at[index, "Gear_FW_Location"] = address
+        if progress is not None:
+            progress.update(status for index, status, address in results)
+
+    fingerprints = set(row_hashes) if delta else None
+    log.info(f"Writing {len(session_entries)} sessions from the plan")
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    apply_session_plan,
+                    fw,
+                    session_id,
+                    entries,
+                    dry_run,
+                    journal,
+                    fingerprints,
                 )
-                success_counter += 1
+                for session_id, entries in session_entries.items()
+            ]
+            for future in as_completed(futures):
+                record_results(future.result())
+    else:
+        for session_id, entries in session_entries.items():
+            record_results(
+                apply_session_plan(
+                    fw, session_id, entries, dry_run, journal, fingerprints
+                )
+            )
+
+    if final_report:
+        with mu.phase(fw, "report"):
+            success_counter = df["Gear_Status"].isin(SUCCESS_STATUSES).sum()
+            log_final_report(success_counter, nrows, fw)
+
+    return df
+
+
+def apply_session_plan(
+    fw, session_id, entries, dry_run=False, journal=None, fingerprints=None
+):
+    """Adds the planned ROI's of a session to its info, and writes them with one update
+
+    Args:
+        fw (flywheel.Client): the flywheel Client
+        session_id (string): The ID of the session to write the ROI's to
+        entries (list): The rows planned on this session, from `pl.read_plan`
+        dry_run (boolean): Only check the ROI's can be added, do not write them
+        journal (jr.Journal): If given, the rows written are recorded in it
+        fingerprints (set): If given, the fingerprints of every row being applied, and
+            a planned ROI replaces one of its file and roi type whose row is not
+            among them
 
-            # Otherwise make the ROI
+    Returns:
+        results (list): (index, status, address) tuples with the outcome of each row
+
+    """
+    try:
+        with mu.phase(fw, "write"):
+            ses = fw.get_session(session_id)
+    except Exception as e:
+        log.warning(f"Unable to load session {session_id}")
+        log.exception(e)
+        return [(entry["index"], "Failed", None) for entry in entries]
+
+    # A dry run adds the ROI's to a copy, so the session's info is left as it is
+    info = ROI.copy_measurements(ses.info) if dry_run else ses.info
+    roi_numbers = fu.get_roi_number_from_info(info)
+    duplicates = ROI.DuplicateIndex(info)
+    stale = ROI.get_stale_measurements(info, fingerprints) if fingerprints else None
+    results = []
+    added = []
+    with mu.phase(fw, "build"):
+        for entry in entries:
+            index, address = entry["index"], entry["address"]
+            measurement = entry["measurement"]
+            # The session may have gained ROI's since the plan was made
+            measurement.update(roi_numbers)
+
+            if not ROI.add_measurement_to_info(info, measurement, duplicates, stale):
+                if dry_run:
+                    log.warning(f"Would not add duplicate ROI to {address}")
+                results.append((index, "Failed", address))
+                row_log.info(FAILED_BANNER)
+                continue
+
+            for key in roi_numbers:
+                roi_numbers[key] += 1
+            if dry_run:
+                row_log.info("Would modify info on %s", address)
+                results.append((index, "Dry-Run Success", address))
             else:
+                added.append((index, address))
+
+    if not added:
+        return results
+
+    try:
+        row_log.info("updating session %s with %d ROI's...", ses.label, len(added))
+        with mu.phase(fw, "write"):
+            ses.update_info(ROI.get_info_update(info))
+    except Exception as e:
+        return results + get_write_results(added, e)
+    finally:
+        cache.invalidate(fw, session_id)
+
+    if journal is not None:
+        by_index = {entry["index"]: entry for entry in entries}
+        journal.record(
+            session_id,
+            [
+                (by_index[index]["row"], by_index[index]["file_id"], address)
+                for index, address in added
+            ],
+        )
+    return results + get_write_results(added)
+
+
+def log_final_report(success_counter, nrows, fw=None):
+    cache_summary = cache.get_cache_summary(fw)
+    cache_summary = f"{cache_summary}\n" if cache_summary else ""
+    metrics_summary = mu.get_metrics_summary(fw)
+    metrics_summary = f"{metrics_summary}\n" if metrics_summary else ""
+
+    log.info(
+        f"\n\n"
+        f"===============================================================================\n"
+        f"Final Report: {success_counter}/{nrows} objects updated successfully\n"
+        f"{success_counter/nrows*100 if nrows else 0}%\n"
+        f"{cache_summary}"
+        f"{metrics_summary}"
+        f"See output report file for more details\n"
+        f"===============================================================================\n"
+    )
+
+
+def import_session_rois(
+    fw,
+    measurements,
+    session_id,
+    rows,
+    hierarchy,
+    dry_run=False,
+    journal=None,
+    fingerprints=None,
+    plan=None,
+):
+    """Builds every ROI that targets a session and writes them with one update
+
+    The session is read once, each new ROI is added to its info in memory (numbering
+    them as they are added), and the changed namespace of the info is written back
+    with a single `update_info` call.
+
+    Args:
+        fw (flywheel.Client): the flywheel Client
+        measurements (dict): row index -> measurement, from `cu.get_measurements_from_df`
+        session_id (string): The ID of the session to write the ROI's to
+        rows (list): (index, Match) tuples for the rows that target this session
+        hierarchy (hu.ProjectHierarchy): The snapshot of the project the rows matched
+        dry_run (boolean): Indicates if the data is actually imported (False) or a log
+            is made of what would be changed, but no changes are actually made (True)
+        journal (jr.Journal): If given, the rows written are recorded in it
+        fingerprints (set): If given (a delta import), the fingerprints of every row
+            being imported.  The rows whose fingerprint is already on the session are
+            skipped, and the others may replace an ROI whose row is not among them.
+        plan (pl.Plan): If given (in a dry run), the ROI's built are recorded in it
+
+    Returns:
+        results (list): (index, status, address) tuples with the outcome of each row
+
+    """
+    try:
+        with mu.phase(fw, "write"):
+            ses = fw.get_session(session_id)
+    except Exception as e:
+        log.warning(f"Unable to load session {session_id}")
+        log.exception(e)
+        return [(index, "Failed", None) for index, match in rows]
+
+    info = ses.info
+    unchanged = []
+    stale = None
+    if fingerprints is not None:
+        rows, unchanged = skip_unchanged_rows(fw, info, rows, hierarchy)
+        stale = ROI.get_stale_measurements(info, fingerprints)
+
+    planned = [] if plan is not None else None
+    with mu.phase(fw, "build"):
+        results, added = add_session_rois(
+            fw, measurements, info, rows, hierarchy, dry_run, planned, stale
+        )
+    plan_rows(plan, session_id, rows, planned)
+    results = unchanged + results
+    if not added:
+        return results
+
+    try:
+        row_log.info("updating session %s with %d ROI's...", ses.label, len(added))
+        with mu.phase(fw, "write"):
+            ses.update_info(ROI.get_info_update(info))
+    except Exception as e:
+        return results + get_write_results(added, e)
+    finally:
+        cache.invalidate(fw, session_id)
+
+    journal_rows(journal, session_id, rows, added)
+    return results + get_write_results(added)
+
+
+async def import_session_rois_async(
+    afw,
+    fw,
+    measurements,
+    session_id,
+    rows,
+    hierarchy,
+    dry_run=False,
+    journal=None,
+    fingerprints=None,
+    plan=None,
+):
+    """The same as `import_session_rois`, but reads and writes the session with an `ac.AsyncClient`
+
+    Args:
+        afw (ac.AsyncClient): the async flywheel client, already opened
+        fw (flywheel.Client): the flywheel Client, used if a file's info must be reloaded
+        measurements (dict): row index -> measurement, from `cu.get_measurements_from_df`
+        session_id (string): The ID of the session to write the ROI's to
+        rows (list): (index, Match) tuples for the rows that target this session
+        hierarchy (hu.ProjectHierarchy): The snapshot of the project the rows matched
+        dry_run (boolean): Indicates if the data is actually imported (False) or a log
+            is made of what would be changed, but no changes are actually made (True)
+        journal (jr.Journal): If given, the rows written are recorded in it
+        fingerprints (set): If given (a delta import), the fingerprints of every row
+            being imported.  The rows whose fingerprint is already on the session are
+            skipped, and the others may replace an ROI whose row is not among them.
+        plan (pl.Plan): If given (in a dry run), the ROI's built are recorded in it
+
+    Returns:
+        results (list): (index, status, address) tuples with the outcome of each row
+
+    """
+    try:
+        with mu.phase(fw, "write"):
+            info = await afw.get_session_info(session_id)
+    except Exception as e:
+        log.warning(f"Unable to load session {session_id}")
+        log.exception(e)
+        return [(index, "Failed", None) for index, match in rows]
+
+    unchanged = []
+    stale = None
+    if fingerprints is not None:
+        rows, unchanged = skip_unchanged_rows(fw, info, rows, hierarchy)
+        stale = ROI.get_stale_measurements(info, fingerprints)
+
+    # Building the ROI's may need to reload an acquisition, so keep it off the event loop
+    loop = asyncio.get_running_loop()
+    planned = [] if plan is not None else None
+    with mu.phase(fw, "build"):
+        results, added = await loop.run_in_executor(
+            None,
+            add_session_rois,
+            fw,
+            measurements,
+            info,
+            rows,
+            hierarchy,
+            dry_run,
+            planned,
+            stale,
+        )
+    plan_rows(plan, session_id, rows, planned)
+    results = unchanged + results
+    if not added:
+        return results
+
+    try:
+        row_log.info("updating session %s with %d ROI's...", session_id, len(added))
+        with mu.phase(fw, "write"):
+            await afw.update_session_info(session_id, ROI.get_info_update(info))
+    except Exception as e:
+        return results + get_write_results(added, e)
+
+    journal_rows(journal, session_id, rows, added)
+    return results + get_write_results(added)
+
+
+def import_sessions_async(
+    afw,
+    fw,
+    measurements,
+    session_rows,
+    hierarchy,
+    dry_run=False,
+    journal=None,
+    fingerprints=None,
+    plan=None,
+    callback=None,
+):
+    """Imports every session concurrently on an asyncio event loop
+
+    Args:
+        afw (ac.AsyncClient): the async flywheel client
+        fw (flywheel.Client): the flywheel Client
+        measurements (dict): row index -> measurement, from `cu.get_measurements_from_df`
+        session_rows (dict): session ID -> list of (index, Match) tuples
+        hierarchy (hu.ProjectHierarchy): The snapshot of the project the rows matched
+        dry_run (boolean): Indicates if the data is actually imported
+        journal (jr.Journal): If given, the rows written are recorded in it
+        fingerprints (set): If given (a delta import), the fingerprints of every row
+            being imported (see `import_session_rois`)
+        plan (pl.Plan): If given (in a dry run), the ROI's built are recorded in it
+        callback (callable): If given, called with the results of each session as soon
+            as it is done, on the event loop's thread
+
+    Returns:
+        session_results (list): the results of `import_session_rois_async` for each
+            session, in the same order as `session_rows`
+
+    """
+
+    async def import_session(session_id, rows):
+        results = await import_session_rois_async(
+            afw,
+            fw,
+            measurements,
+            session_id,
+            rows,
+            hierarchy,
+            dry_run,
+            journal,
+            fingerprints,
+            plan,
+        )
+        if callback is not None:
+            callback(results)
+        return results
+
+    async def run():
+        async with afw:
+            return await asyncio.gather(
+                *[import_session(session_id, rows) for session_id, rows in session_rows.items()]
+            )
+
+    return asyncio.run(run())
 
-                log.info(f"Creating ROI")
-                log.debug(f"{pprint.pprint(roi.to_dict(),indent=2)}")
-                try:
-                    # add the ROI to the container.
-                    success = roi.append_to_container(ses)
-                    if success:
-                        success_counter += 1
-                        df.at[index, "Gear_Status"] = "Success"
-                        df.at[index, "Gear_FW_Location"] = address
-
-                        log.info(
-                            "\n--------------------------------------------------\n"
-                            "STATUS: Success\n"
-                            "==================================================\n"
-                        )
-                    else:
-                        df.at[index, "Gear_Status"] = "Failed"
-                        df.at[index, "Gear_FW_Location"] = address
-
-                        log.info(
-                            "\n--------------------------------------------------\n"
-                            "STATUS: Failed\n"
-                            "==================================================\n"
-                        )
-                        continue
-
-                except Exception as e:
-                    log.warning("Error uploading metadata")
-                    log.exception(e)
-                    continue
 
+def add_session_rois(
+    fw, measurements, info, rows, hierarchy, dry_run=False, planned=None, stale=None
+):
+    """Builds the ROI's for a session's rows and adds them to the session info in memory
+
+    Args:
+        fw (flywheel.Client): the flywheel Client
+        measurements (dict): row index -> measurement, from `cu.get_measurements_from_df`
+        info (dict): The info of the session, which the new ROI's are added to
+        rows (list): (index, Match) tuples for the rows that target this session
+        hierarchy (hu.ProjectHierarchy): The snapshot of the project the rows matched
+        dry_run (boolean): If True, the ROI's are only built, and added to a copy of
+            `info`
+        planned (list): If given, (index, address, measurement) tuples for the valid
+            ROI's built in a dry run are appended to it
+        stale (dict): If given, the ROI's of rows no longer in the file, which new rows
+            replace (see `ROI.get_stale_measurements`)
+
+    Returns:
+        results (list): (index, status, address) tuples for rows that are finished
+        added (list): (index, address) tuples for rows whose ROI was added to `info`
+            and still needs to be written
+
+    """
+    results = []
+    roi_numbers = fu.get_roi_number_from_info(info)
+    if dry_run:
+        info = ROI.copy_measurements(info)
+    duplicates = ROI.DuplicateIndex(info)
+    added = []
+
+    for index, match in rows:
+        try:
+            # Generate a flywheel path to this file.  A little redundant since we
+            # already have group/project/subject/session, but this will also find
+            # acquisition and file.
+            match.get_acquisition(fw, hierarchy)
+            address = match.path()
+
+            # Make sure we have the file's info, which holds the DICOM UID's
+            match.file = hierarchy.load_file(fw, match.record)
+
+            if index not in measurements:
+                raise Exception("unable to build an ROI from this row")
+
+            measurement = cu.complete_measurement(measurements[index], match.file, roi_numbers)
         except Exception as e:
             log.warning(
                 f"\n--------------------------------------------------\n"
@@ -248,20 +1320,166 @@ def import_data(fw, df, group, project, dry_run=False):
                 f"row {index} unable to process for reason: {e}"
                 f"==================================================\n"
             )
-
             log.exception(e)
+            results.append((index, "Failed", None))
             continue
 
-    log.info(
-        f"\n\n"
-        f"===============================================================================\n"
-        f"Final Report: {success_counter}/{nrows} objects updated successfully\n"
-        f"{success_counter/nrows*100}%\n"
-        f"See output report file for more details\n"
-        f"===============================================================================\n"
+        # If this gear is a dry run, we'll only log, not actually upload
+        valid = ROI.is_valid_tool_type(measurement[ROI.ROITYPE_KWD])
+        if not valid:
+            log.warning(f'INVALID ROI TYPE {measurement[ROI.ROITYPE_KWD]}')
+
+        if dry_run:
+            if valid and not ROI.add_measurement_to_info(
+                info, measurement, duplicates, stale
+            ):
+                log.warning(f"Would not add duplicate ROI to {address}")
+                results.append((index, "Failed", address))
+                continue
+
+            if planned is not None and valid:
+                planned.append((index, address, measurement))
+            row_log.info("Would modify info on %s", address)
+            results.append((index, "Dry-Run Success", address))
+            row_log.info(DRY_RUN_BANNER)
+            continue
+
+        row_log.debug("Creating ROI %s", measurement)
+
+        # add the ROI to the session info in memory, it is written by the caller.
+        if not valid:
+            log.warning("Not updating invalid ROI")
+            added_roi = False
+        else:
+            added_roi = ROI.add_measurement_to_info(info, measurement, duplicates, stale)
+
+        if added_roi:
+            added.append((index, address))
+            for key in roi_numbers:
+                roi_numbers[key] += 1
+        else:
+            results.append((index, "Failed", address))
+            row_log.info(FAILED_BANNER)
+
+    return results, added
+
+
+def skip_committed_rows(df, row_hashes, journal):
+    """Marks the rows that the journal of a previous run committed as successful
+
+    Args:
+        df (pandas.DataFrame): The dataframe being imported, with the status columns
+        row_hashes (pandas.Series): The hash of each row, from `cu.get_row_hashes`
+        journal (jr.Journal): The journal, holding the previous run's entries
+
+    Returns:
+        committed (list): the indexes of the rows that were already committed
+
+    """
+    committed = []
+    for index, row_hash in row_hashes.items():
+        entry = journal.take(row_hash)
+        if entry is None:
+            continue
+        df.at[index, "Gear_Status"] = "Success"
+        df.at[index, "Gear_FW_Location"] = entry["address"]
+        committed.append(index)
+
+    if committed:
+        log.info(f"Skipping {len(committed)} rows committed by a previous run")
+    return committed
+
+
+def skip_unchanged_rows(fw, info, rows, hierarchy):
+    """Splits off the rows whose fingerprint is already on the session, for a delta import
+
+    Unchanged rows are not built or written, only their flywheel path is resolved (from
+    the project snapshot) for the report.
+
+    Args:
+        fw (flywheel.Client): the flywheel Client
+        info (dict): The info of the session the rows target
+        rows (list): (index, Match) tuples for the rows that target this session
+        hierarchy (hu.ProjectHierarchy): The snapshot of the project the rows matched
+
+    Returns:
+        rows (list): the (index, Match) tuples of the new or changed rows
+        results (list): (index, "Unchanged", address) tuples for the other rows
+
+    """
+    fingerprints = ROI.get_fingerprints(info)
+    if not fingerprints:
+        return rows, []
+
+    new_rows = []
+    results = []
+    for index, match in rows:
+        if match.row_hash not in fingerprints:
+            new_rows.append((index, match))
+            continue
+
+        match.get_acquisition(fw, hierarchy)
+        results.append((index, "Unchanged", match.path()))
+
+    if results:
+        row_log.info("Skipping %d unchanged rows", len(results))
+    return new_rows, results
+
+
+def journal_rows(journal, session_id, rows, added):
+    """Records the rows written to a session in the journal, if there is one"""
+    if journal is None:
+        return
+    matches = dict(rows)
+    journal.record(
+        session_id,
+        [
+            (matches[index].row_hash, matches[index].file.get("file_id"), address)
+            for index, address in added
+        ],
     )
 
-    return df
+
+def plan_rows(plan, session_id, rows, planned):
+    """Records the ROI's a dry run built for a session in the plan, if there is one"""
+    if plan is None or not planned:
+        return
+    matches = dict(rows)
+    plan.record(
+        session_id,
+        [
+            (
+                index,
+                matches[index].row_hash,
+                matches[index].file.get("file_id"),
+                address,
+                measurement,
+            )
+            for index, address, measurement in planned
+        ],
+    )
+
+
+def get_write_results(added, error=None):
+    """Logs and returns the status of the rows written with a session update
+
+    Args:
+        added (list): (index, address) tuples for the rows that were written
+        error (Exception): The error raised by the session update, if any
+
+    Returns:
+        results (list): (index, status, address) tuples for the rows
+
+    """
+    if error is not None:
+        log.warning("Error uploading metadata")
+        log.exception(error)
+        return [(index, "Failed", None) for index, address in added]
+
+    for index, address in added:
+        row_log.info(SUCCESS_BANNER, address)
+
+    return [(index, "Success", address) for index, address in added]
 
 
 # https://gist.github.com/angstwad/bf22d1822c38a92ec0a9
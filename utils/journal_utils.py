@@ -0,0 +1,90 @@
+from collections import defaultdict, deque
+import json
+import logging
+from pathlib import Path
+import threading
+
+log = logging.getLogger(__name__)
+
+JOURNAL_FILE = "Data_Import_Journal.jsonl"
+
+
+class Journal:
+    """An append-only record of the rows that have been written to flywheel
+
+    Each line is a json object with the row's content hash (see `cu.get_row_hashes`),
+    the ID of the file its ROI was attached to, the ID of the session it was written
+    to and its flywheel path.  Lines are written as soon as the session update that
+    committed the rows succeeds, so the journal survives the gear being interrupted.
+
+    Given the journal of a previous run, its entries are copied into the new journal
+    and `take` recognizes the rows it committed, so they can be skipped.
+
+    Args:
+        path (Pathlike): The journal file to write
+        previous (Pathlike): The journal of a previous run, if resuming one
+    """
+
+    def __init__(self, path, previous=None):
+        self.path = Path(path)
+        self.committed = defaultdict(deque)
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+        entries = []
+        if previous is not None:
+            entries = read_journal(previous)
+            log.info(f"Resuming from a journal of {len(entries)} committed rows")
+        for entry in entries:
+            self.committed[entry["row"]].append(entry)
+
+        same_file = previous is not None and Path(previous).resolve() == self.path.resolve()
+        self._file = open(self.path, "a")
+        if not same_file:
+            self._write(entries)
+
+    def take(self, row_hash):
+        """Return the committed entry for a row, if there is one
+
+        Each entry only matches one row, so if a CSV holds the same row twice and
+        only one of them was committed, the other is still imported.
+        """
+        entries = self.committed.get(row_hash)
+        if not entries:
+            return None
+        self.skipped += 1
+        return entries.popleft()
+
+    def record(self, session_id, rows):
+        """Append the rows committed by one session update
+
+        Args:
+            session_id (string): The ID of the session the rows were written to
+            rows (list): (row hash, file ID, address) tuples
+        """
+        entries = [
+            {"row": row_hash, "file_id": file_id, "session_id": session_id, "address": address}
+            for row_hash, file_id, address in rows
+        ]
+        with self._lock:
+            self._write(entries)
+
+    def _write(self, entries):
+        for entry in entries:
+            self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_journal(path):
+    """Read the entries of a journal, ignoring a partly written last line"""
+    entries = []
+    with open(path) as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                log.warning(f"Ignoring incomplete journal entry: {line.strip()}")
+    return entries
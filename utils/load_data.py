@@ -1,16 +1,254 @@
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+from pathlib import Path
+import pickle
+import tempfile
+
+import numpy as np
+import openpyxl
 import pandas as pd
+import pyarrow.dataset as ds
 import logging
 
+from utils import ROI_Template as ROI
+from utils import csv_utils as cu
+
 log = logging.getLogger(__name__)
 
+EXCEL_SUFFIXES = (".xlsx", ".xlsm")
+ARROW_SUFFIXES = (".parquet", ".feather", ".arrow")
+
+# The columns that locate a file in flywheel are labels, even if they look like numbers
+# (e.g. a subject "1001"), so delimited files read them as text
+LABEL_DTYPES = {
+    ROI.GROUP_HDR: str,
+    ROI.PROJECT_HDR: str,
+    ROI.SUBJECT_HDR: str,
+    ROI.SESSION_HDR: str,
+    ROI.MAPPING_COLUMN: str,
+}
+
+
+def is_excel_file(df_path):
+    return Path(df_path).suffix.lower() in EXCEL_SUFFIXES
+
+
+def is_arrow_file(df_path):
+    return Path(df_path).suffix.lower() in ARROW_SUFFIXES
+
+
+def open_arrow_dataset(df_path, columns=None):
+    """Open a parquet or feather (Arrow IPC) file, without reading it yet
+
+    The forbidden and reserved columns (e.g. "imagePath" or "handles") are read even if
+    they are not in `columns`, so that the file is rejected (see `cu.validate_rows`) as
+    a CSV file with them would be, rather than the columns being left out silently.
+
+    Args:
+        df_path (Pathlike): The path of the file
+        columns (list): The columns to read, if the file has them.  None for all of
+            them.
+
+    Returns:
+        dataset (pyarrow.dataset.Dataset): The file, as a dataset
+        columns (list): The columns of the file to read, in the file's order
+
+    """
+    file_format = "parquet" if Path(df_path).suffix.lower() == ".parquet" else "feather"
+    dataset = ds.dataset(df_path, format=file_format)
+    if columns is not None:
+        columns = set(columns) | set(ROI.FORBIDDEN_KWD) | {ROI.HANDLE_KWD}
+        skipped = [name for name in dataset.schema.names if name not in columns]
+        if skipped:
+            log.warning(
+                f"Not loading {len(skipped)} columns the gear doesn't read, they are left "
+                f"out of the report: {skipped}"
+            )
+        columns = [name for name in dataset.schema.names if name in columns]
+    return dataset, columns
+
+
+def load_arrow_dataframe(df_path, columns=None):
+    """Loads a parquet or feather file into a dataframe, through Arrow
+
+    Args:
+        df_path (Pathlike): The path of the file
+        columns (list): The columns to load (e.g. `ROI.INPUT_HDRS`), if the file has
+            them.  None to load every column.
+
+    Returns:
+        df (pandas.DataFrame): The file, imported to dataframe format.
+
+    """
+    dataset, columns = open_arrow_dataset(df_path, columns)
+    return to_native(dataset.to_table(columns=columns).to_pandas())
+
+
+def iter_arrow_dataframe(df_path, chunk_size, columns=None):
+    """Lazily loads a parquet or feather file as a series of dataframe chunks
+
+    Args:
+        df_path (Pathlike): The path of the file
+        chunk_size (integer): The most rows in each chunk
+        columns (list): The columns to load, if the file has them.  None to load every
+            column.
+
+    Returns:
+        chunks (iterator): pandas.DataFrame chunks of the file, in order, with a
+            continuous index.
+
+    """
+    dataset, columns = open_arrow_dataset(df_path, columns)
+    nrows = 0
+    for batch in dataset.to_batches(columns=columns, batch_size=chunk_size):
+        if batch.num_rows == 0:
+            continue
+        df = to_native(batch.to_pandas())
+        df.index = pd.RangeIndex(nrows, nrows + len(df))
+        nrows += len(df)
+        yield df
+
+
+def get_excel_sheet_names(excel_path):
+    workbook = openpyxl.load_workbook(excel_path, read_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+
+def get_excel_headers(excel_path, firstrow_spec):
+    """The headers of every sheet of an excel workbook, in order and without repeats
+
+    Args:
+        excel_path (Pathlike): The path of the workbook
+        firstrow_spec (integer): The row of each sheet that contains the column headers
+
+    Returns:
+        headers (list): The union of the sheets' column headers
+
+    """
+    workbook = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        headers = {}
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(
+                min_row=firstrow_spec, max_row=firstrow_spec, values_only=True
+            )
+            for name in next(rows, ()):
+                if name is not None:
+                    headers[str(name)] = None
+        return list(headers)
+    finally:
+        workbook.close()
+
 
 def load_excel_dataframe(excel_path, firstrow_spec, sheets_spec=0):
-    # This function is not used in this version of the gear, but will be used in the future.
-    # First iteration only supports single sheet import, but sheet can be specified.
-    df = pd.read_excel(excel_path, header=firstrow_spec - 1, sheet_name=sheets_spec)
-    df.columns = df.columns.str.lower()
-    df = df.where(pd.notnull(df), None)
-    return df
+    """Loads one sheet of an excel workbook into a dataframe
+
+    Args:
+        excel_path (Pathlike): The path of the workbook
+        firstrow_spec (integer): The row of the sheet that contains the headers of the
+            columns.  Data is assumed to be below this row.
+        sheets_spec (integer or string): The index or the name of the sheet
+
+    Returns:
+        df (pandas.DataFrame): The sheet, imported to dataframe format.
+
+    """
+    if isinstance(sheets_spec, int):
+        sheets_spec = get_excel_sheet_names(excel_path)[sheets_spec]
+    return read_excel_sheet(excel_path, sheets_spec, firstrow_spec)
+
+
+def read_excel_sheet(excel_path, sheet_name, firstrow_spec):
+    """Reads a sheet with openpyxl's read-only (streaming) reader
+
+    Cells are read row by row as plain values, without loading the styles or the rest
+    of the workbook.  Rows that are entirely empty and columns without a header are
+    dropped, since sheets often report a larger size than the cells they hold.
+
+    Args:
+        excel_path (Pathlike): The path of the workbook
+        sheet_name (string): The name of the sheet to read
+        firstrow_spec (integer): The row of the sheet that contains the column headers
+
+    Returns:
+        df (pandas.DataFrame): The sheet, with None for missing text (see `to_native`)
+
+    """
+    workbook = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(min_row=firstrow_spec, values_only=True)
+        header = next(rows, ())
+        columns = [i for i, name in enumerate(header) if name is not None]
+        records = [
+            [row[i] if i < len(row) else None for i in columns]
+            for row in rows
+            if any(value is not None for value in row)
+        ]
+    finally:
+        workbook.close()
+
+    df = pd.DataFrame(records, columns=[str(header[i]) for i in columns])
+    return to_native(df)
+
+
+def iter_excel_dataframe(excel_path, firstrow_spec, chunk_size=0, max_workers=None):
+    """Lazily loads every sheet of an excel workbook as a series of dataframe chunks
+
+    Sheets are parsed in parallel, in a pool of processes, while the chunks of the
+    sheets before them are being imported.  At most `max_workers` sheets are parsed
+    (or waiting to be imported) at once, so the whole workbook is never held in memory.
+
+    Args:
+        excel_path (Pathlike): The path of the workbook
+        firstrow_spec (integer): The row of each sheet that contains the headers of the
+            columns.  Data is assumed to be below this row.
+        chunk_size (integer): The most rows in each chunk, or 0 for a chunk per sheet
+        max_workers (integer): The number of processes parsing sheets.  Defaults to the
+            number of cores.
+
+    Returns:
+        chunks (iterator): pandas.DataFrame chunks of the sheets, in order, with a
+            continuous index.
+
+    """
+    sheet_names = get_excel_sheet_names(excel_path)
+    max_workers = min(max_workers or os.cpu_count() or 1, len(sheet_names))
+    log.info(f"Reading {len(sheet_names)} sheets with {max_workers} processes")
+
+    nrows = 0
+    for sheet_name, df in iter_excel_sheets(excel_path, sheet_names, firstrow_spec, max_workers):
+        log.info(f"Read {len(df)} rows from sheet {sheet_name}")
+        df.index = pd.RangeIndex(nrows, nrows + len(df))
+        nrows += len(df)
+
+        step = chunk_size if chunk_size > 0 else max(len(df), 1)
+        for start in range(0, len(df), step):
+            yield df.iloc[start : start + step]
+
+
+def iter_excel_sheets(excel_path, sheet_names, firstrow_spec, max_workers):
+    """Yield (sheet name, dataframe) for every sheet, in order, reading ahead in parallel"""
+    if max_workers <= 1:
+        for sheet_name in sheet_names:
+            yield sheet_name, read_excel_sheet(excel_path, sheet_name, firstrow_spec)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = []
+        for sheet_name in sheet_names:
+            pending.append(
+                (sheet_name, executor.submit(read_excel_sheet, excel_path, sheet_name, firstrow_spec))
+            )
+            if len(pending) == max_workers:
+                sheet_name, future = pending.pop(0)
+                yield sheet_name, future.result()
+
+        for sheet_name, future in pending:
+            yield sheet_name, future.result()
 
 
 def load_text_dataframe(df_path, firstrow_spec, delimiter_spec):
@@ -26,32 +264,171 @@ def load_text_dataframe(df_path, firstrow_spec, delimiter_spec):
         df (pandas.DataFrame): The delimited text file, imported to dataframe format.
 
     """
-    df = pd.read_table(df_path, delimiter=delimiter_spec, header=firstrow_spec - 1)
+    df = pd.read_table(
+        df_path, delimiter=delimiter_spec, header=firstrow_spec - 1, dtype=LABEL_DTYPES
+    )
     # df.columns = df.columns.str.lower()
-    df = df.where(pd.notnull(df), None)
+    df = to_native(df)
 
     return df
 
 
-def validate_df(df, object_col):
+def iter_text_dataframe(df_path, firstrow_spec, delimiter_spec, chunk_size):
+    """Lazily loads a plain text delimited file as a series of dataframe chunks
+
+    Args:
+        df_path (Pathlike): The path of the file that will be made into dataframes
+        firstrow_spec (integer): The row in the CSV file that contains the headers of
+            the columns.  Data is assumed to be below this row.
+        delimiter_spec (string): The type of delimiter used in this file.
+        chunk_size (integer): The number of rows in each chunk
+
+    Returns:
+        chunks (iterator): pandas.DataFrame chunks of the file, in order, with a
+            continuous index.
+
+    """
+    reader = pd.read_table(
+        df_path,
+        delimiter=delimiter_spec,
+        header=firstrow_spec - 1,
+        dtype=LABEL_DTYPES,
+        chunksize=chunk_size,
+    )
+    for df in reader:
+        yield to_native(df)
 
-    if object_col == "" or object_col is None:
-        log.info("No object column specified, assuming column 1")
-        object_col = df.keys()[0]
-        log.info(f"Using column {object_col}")
 
-    if object_col not in df:
-        log.error(f"Specified column {object_col} not found in CSV file")
-        raise Exception("Column not in CSV")
+def group_chunks_by_session(chunks, chunk_size, key_columns):
+    """Regroup a stream of dataframe chunks so that each session is in a single chunk
 
-    series = df[object_col]
-    if len(series) != series.nunique():
-        log.error(
-            f"Non-unique object names in mapping column.  Filenames must be unique."
-        )
-        raise Exception("Object Mappings Must Be Unique")
+    A session whose rows are spread over several chunks would be read and written
+    once per chunk.  The chunks are first spilled to a temporary directory, checking
+    whether the rows of each session (the rows with the same `key_columns`) follow each
+    other in the file:
 
-    return object_col
+    * if they do, the chunks are given back in order, the rows of the last session of
+      each chunk being moved to the next one, so the report keeps the order of the
+      file.
+    * if they don't, the rows are partitioned by a hash of their session into spill
+      files of about `chunk_size` rows, and each spill file is given back as a chunk,
+      so memory stays bounded by the chunk size.  The rows of each chunk are in file
+      order, but the chunks are not.
+
+    Either way, the rows keep their index.
+
+    Args:
+        chunks (iterator): pandas DataFrames, e.g. from `iter_text_dataframe`
+        chunk_size (integer): The number of rows in each chunk
+        key_columns (list): The columns that locate the session of a row.  If any of
+            them is missing, the chunks are given back as they are.
+
+    Returns:
+        chunks (iterator): pandas.DataFrame chunks, with every session in one chunk
+
+    """
+    first = next(chunks, None)
+    if first is None:
+        return
+    if not all(column in first for column in key_columns):
+        yield first
+        yield from chunks
+        return
+
+    with tempfile.TemporaryDirectory() as spill_dir:
+        spill_dir = Path(spill_dir)
+        nrows = 0
+        nchunks = 0
+        sessions = set()
+        previous = None
+        contiguous = True
+        for df in itertools.chain([first], chunks):
+            keys = cu.hash_columns(df, key_columns)
+            if contiguous and len(keys):
+                # The sessions that start in this chunk must not have been seen before
+                first_key = ~keys[0] if previous is None else previous
+                starts = keys[keys != np.concatenate([[first_key], keys[:-1]])]
+                contiguous = len(set(starts)) == len(starts) and sessions.isdisjoint(starts)
+                sessions.update(starts)
+                previous = keys[-1]
+            spill(spill_dir / f"chunk-{nchunks}", df)
+            nrows += len(df)
+            nchunks += 1
+
+        chunk_paths = [spill_dir / f"chunk-{number}" for number in range(nchunks)]
+        if contiguous:
+            log.info("The sessions of the file are contiguous, keeping its order")
+            yield from carry_last_sessions(chunk_paths, key_columns)
+            return
+
+        nbuckets = max(-(-nrows // chunk_size), 1)
+        log.info(f"Grouping {nrows} rows by session into {nbuckets} chunks")
+        for path in chunk_paths:
+            for df in read_spill(path):
+                buckets = cu.hash_columns(df, key_columns) % np.uint64(nbuckets)
+                for bucket, rows in df.groupby(buckets, sort=False):
+                    spill(spill_dir / f"bucket-{bucket}", rows)
+            path.unlink()
+
+        for bucket in range(nbuckets):
+            path = spill_dir / f"bucket-{bucket}"
+            if path.exists():
+                yield pd.concat(read_spill(path)).sort_index()
+                path.unlink()
+
+
+def carry_last_sessions(chunk_paths, key_columns):
+    """Yield spilled chunks in order, moving the rows of a chunk's last session to the next"""
+    carry = None
+    for path in chunk_paths:
+        for df in read_spill(path):
+            if carry is not None:
+                df = pd.concat([carry, df])
+            keys = cu.hash_columns(df, key_columns)
+            last_session = keys == keys[-1]
+            carry = df[last_session]
+            if not last_session.all():
+                yield df[~last_session]
+    if carry is not None:
+        yield carry
+
+
+def spill(path, df):
+    """Append a dataframe to a spill file"""
+    with open(path, "ab") as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_spill(path):
+    """Read back the dataframes appended to a spill file, in order"""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def to_native(df):
+    """Set the missing values of the text (and other non-numeric) columns to None
+
+    Numeric columns keep their dtype, and their missing values stay NaN, rather than
+    boxing every cell as a python object.  Their values are converted to python values
+    (and NaN to None) a column at a time, when the ROI's are built from them (see
+    `cu.to_python_list`).
+
+    Args:
+        df (pandas.DataFrame): The dataframe as it was read
+
+    Returns:
+        df (pandas.DataFrame): The dataframe, with None for the missing values of its
+            non-numeric columns
+
+    """
+    for name, values in df.items():
+        if not pd.api.types.is_numeric_dtype(values) and values.hasnans:
+            df[name] = values.astype(object).where(values.notnull(), None)
+    return df
 
 
 # def load_yaml(yaml_path):
@@ -0,0 +1,236 @@
+from collections import Counter
+from contextlib import contextmanager
+import json
+import logging
+import re
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_FILE = "Data_Import_Metrics.json"
+
+# Container ID's in request paths, replaced with "{id}" to group them by endpoint
+ID_PATTERN = re.compile(r"/[0-9a-f]{24}(?=/|$)")
+
+
+class EndpointStats:
+    """Counts, latencies and payload sizes of the requests made to one endpoint"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, seconds, request_bytes=0, response_bytes=0, error=False):
+        self.calls += 1
+        self.errors += int(error)
+        self.total_time += seconds
+        self.max_time = max(self.max_time, seconds)
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+
+        bucket = len(LATENCY_BUCKETS)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                bucket = i
+                break
+        self.histogram[bucket] += 1
+
+    def percentile(self, fraction):
+        """The upper bound of the histogram bucket holding the given percentile"""
+        target = fraction * self.calls
+        count = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, self.histogram):
+            count += bucket_count
+            if count >= target:
+                return bound
+        return self.max_time
+
+    def to_dict(self):
+        buckets = [f"le_{bound}" for bound in LATENCY_BUCKETS] + ["le_inf"]
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_seconds": round(self.total_time, 6),
+            "mean_seconds": round(self.total_time / self.calls, 6) if self.calls else 0,
+            "max_seconds": round(self.max_time, 6),
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "latency_histogram": dict(zip(buckets, self.histogram)),
+        }
+
+
+class Metrics:
+    """Thread safe accounting of API calls (per endpoint) and gear phase durations
+
+    Phase durations are summed over every worker that runs them, so with several
+    workers a phase may add up to more than the wall time of the gear.
+    """
+
+    def __init__(self):
+        self.endpoints = {}
+        self.phases = {}
+        self.retries = Counter()
+        self.retries_exhausted = 0
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, request_bytes=0, response_bytes=0, error=False):
+        with self._lock:
+            stats = self.endpoints.setdefault(endpoint, EndpointStats())
+            stats.add(seconds, request_bytes, response_bytes, error)
+
+    def record_retry(self, kind, exhausted=False):
+        """Count a retried request (or, if `exhausted`, one that ran out of retries)"""
+        with self._lock:
+            if exhausted:
+                self.retries_exhausted += 1
+            else:
+                self.retries[kind] += 1
+
+    def total_calls(self):
+        with self._lock:
+            return sum(s.calls for s in self.endpoints.values())
+
+    def add_phase(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "wall_seconds": round(time.perf_counter() - self._start, 6),
+                "total_calls": sum(s.calls for s in self.endpoints.values()),
+                "phases": {name: round(s, 6) for name, s in self.phases.items()},
+                "retries": dict(self.retries),
+                "retries_exhausted": self.retries_exhausted,
+                "endpoints": {
+                    endpoint: stats.to_dict()
+                    for endpoint, stats in sorted(self.endpoints.items())
+                },
+            }
+
+    def summary(self):
+        """A few lines describing the time spent in each phase and on each endpoint"""
+        with self._lock:
+            phases = ", ".join(f"{name} {s:.2f} s" for name, s in self.phases.items())
+            lines = [f"Phases: {phases}"] if phases else []
+            if self.retries or self.retries_exhausted:
+                retries = ", ".join(f"{kind} x{n}" for kind, n in sorted(self.retries.items()))
+                lines.append(
+                    f"Retries: {retries or 'none'} "
+                    f"({self.retries_exhausted} requests ran out of retries)"
+                )
+
+            endpoints = sorted(self.endpoints.items(), key=lambda e: -e[1].total_time)
+            for endpoint, stats in endpoints:
+                lines.append(
+                    f"{endpoint}: {stats.calls} calls ({stats.errors} errors), "
+                    f"{stats.total_time:.2f} s total, "
+                    f"mean {stats.total_time / stats.calls * 1000:.1f} ms, "
+                    f"p95 <= {stats.percentile(0.95) * 1000:.0f} ms, "
+                    f"max {stats.max_time * 1000:.1f} ms, "
+                    f"{stats.request_bytes} bytes sent, {stats.response_bytes} bytes received"
+                )
+        return "\n".join(lines)
+
+    def save(self, output_dir):
+        """Write the metrics as json to `output_dir`, next to the status report"""
+        output_path = output_dir / METRICS_FILE
+        with open(output_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        log.info(f"Saved metrics to {output_path}")
+
+
+class InstrumentedClient:
+    """Wraps a flywheel.Client, recording every API call it makes in a `Metrics`
+
+    The calls are timed at the SDK's `api_client`, so every method of the client is
+    covered and grouped by its endpoint template (e.g. "GET /sessions/{session_id}").
+    Every other attribute is passed through to the wrapped client.
+    """
+
+    def __init__(self, fw, metrics=None):
+        self.fw = fw
+        self.metrics = metrics or Metrics()
+
+        api_client = fw.api_client
+        call_api = api_client.call_api
+        request = api_client.request
+        sizes = threading.local()
+
+        def timed_call_api(resource_path, method, *args, **kwargs):
+            sizes.request = sizes.response = 0
+            error = False
+            start = time.perf_counter()
+            try:
+                return call_api(resource_path, method, *args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                self.metrics.record(
+                    f"{method} {resource_path}",
+                    time.perf_counter() - start,
+                    sizes.request,
+                    sizes.response,
+                    error,
+                )
+
+        def sized_request(method, url, *args, **kwargs):
+            body = kwargs.get("body")
+            if body is not None:
+                sizes.request = len(json.dumps(body))
+            response = request(method, url, *args, **kwargs)
+            sizes.response = len(getattr(response, "data", None) or b"")
+            return response
+
+        api_client.call_api = timed_call_api
+        api_client.request = sized_request
+
+    def __getattr__(self, name):
+        return getattr(self.fw, name)
+
+
+def endpoint_from_path(method, path):
+    """Group a request path by endpoint, e.g. "PATCH /sessions/{id}/info" """
+    return f"{method} {ID_PATTERN.sub('/{id}', path)}"
+
+
+def get_metrics(fw):
+    """The `Metrics` of an instrumented client (possibly wrapped again), or None"""
+    metrics = getattr(fw, "metrics", None)
+    return metrics if isinstance(metrics, Metrics) else None
+
+
+@contextmanager
+def phase(fw, name):
+    """Time a phase of the gear, if the client is instrumented
+
+    Args:
+        fw (flywheel.Client): the flywheel Client
+        name (string): The phase: "load", "validate", "match", "build", "write" or
+            "report"
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = get_metrics(fw)
+        if metrics is not None:
+            metrics.add_phase(name, time.perf_counter() - start)
+
+
+def get_metrics_summary(fw):
+    metrics = get_metrics(fw)
+    if metrics is None:
+        return None
+    return metrics.summary()
@@ -0,0 +1,165 @@
+import gzip
+import json
+import logging
+from pathlib import Path
+import tempfile
+import threading
+
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+PLAN_FILE = "Data_Import_Plan.jsonl.gz"
+
+# The status of rows that a dry run has planned to write, which are listed in their
+# session's entry rather than with the other rows' outcomes
+PLANNED_STATUS = "Dry-Run Success"
+
+
+class Plan:
+    """The writes a dry run resolved, to be applied later without resolving them again
+
+    Each line of the (gzip-compressed) file is a json object, either:
+
+    * a session to write: its ID and, for every row planned on it, the row's index and
+      content hash (see `cu.get_row_hashes`), the ID of the file the ROI is attached
+      to, its flywheel path and the fully built measurement, or
+    * the outcome of a row that won't be written (it failed, was invalid, unchanged or
+      already committed), so applying the plan reports it the same way.
+
+    Lines are written as each session is built, so the plan of a large dry run is never
+    held in memory.
+
+    Args:
+        path (Pathlike): The plan file to write
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.sessions = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._file = gzip.open(self.path, "wt", compresslevel=1)
+
+    def record(self, session_id, rows):
+        """Append the rows planned on one session
+
+        Args:
+            session_id (string): The ID of the session the rows are written to
+            rows (list): (index, row hash, file ID, address, measurement) tuples
+        """
+        entry = {
+            "session_id": session_id,
+            "rows": [
+                {
+                    "index": int(index),
+                    "row": row_hash,
+                    "file_id": file_id,
+                    "address": address,
+                    "measurement": measurement,
+                }
+                for index, row_hash, file_id, address, measurement in rows
+            ],
+        }
+        with self._lock:
+            self._write([entry])
+            self.sessions += 1
+            self.rows += len(rows)
+
+    def record_results(self, df):
+        """Append the outcome of each row of a dataframe that is not planned on a session"""
+        done = df[df["Gear_Status"] != PLANNED_STATUS]
+        entries = [
+            {
+                "index": int(index),
+                "status": status,
+                "address": None if pd.isnull(address) else address,
+                "error": None if pd.isnull(error) else error,
+            }
+            for index, status, address, error in zip(
+                done.index, done["Gear_Status"], done["Gear_FW_Location"], done["Gear_Error"]
+            )
+        ]
+        with self._lock:
+            self._write(entries)
+
+    def _write(self, entries):
+        for entry in entries:
+            self._file.write(json.dumps(entry) + "\n")
+
+    def close(self):
+        self._file.close()
+        log.info(f"Planned {self.rows} ROI's on {self.sessions} sessions in {self.path}")
+
+
+def read_plan(path):
+    """Read a plan written by a dry run
+
+    Args:
+        path (Pathlike): The plan file
+
+    Returns:
+        entries (PlanEntries): row index -> the row's entry.  The entry of a row planned
+            on a session has its "session_id", "row" hash, "file_id", "address" and
+            "measurement", and that of any other row its "status", "address" and
+            "error".
+
+    """
+    return PlanEntries(path)
+
+
+class PlanEntries:
+    """The entries of a plan, read back a row at a time
+
+    The plan is read through once, and the entry of every row is copied, one per line,
+    to an uncompressed temporary file.  Only the offset of each row's line is kept in
+    memory, and its entry (with the measurement) is read back when it is looked up, so
+    applying a plan a chunk at a time never holds the whole plan in memory.
+
+    Args:
+        path (Pathlike): The plan file
+    """
+
+    def __init__(self, path):
+        self.offsets = {}
+        self._lock = threading.Lock()
+        self._file = tempfile.TemporaryFile()
+
+        sessions = set()
+        nrows = 0
+        with gzip.open(path, "rt") as f:
+            for line in f:
+                entry = json.loads(line)
+                if "session_id" not in entry:
+                    self._add(entry)
+                    continue
+                sessions.add(entry["session_id"])
+                for row in entry["rows"]:
+                    row["session_id"] = entry["session_id"]
+                    self._add(row)
+                    nrows += 1
+
+        log.info(f"Read a plan of {nrows} ROI's on {len(sessions)} sessions")
+
+    def _add(self, entry):
+        self.offsets[entry["index"]] = self._file.tell()
+        self._file.write(json.dumps(entry).encode() + b"\n")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, index):
+        return index in self.offsets
+
+    def get(self, index, default=None):
+        """The entry of a row, or `default` if the row is not in the plan"""
+        offset = self.offsets.get(index)
+        if offset is None:
+            return default
+        with self._lock:
+            self._file.seek(offset)
+            line = self._file.readline()
+        return json.loads(line)
+
+    def close(self):
+        self._file.close()
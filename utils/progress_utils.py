@@ -0,0 +1,92 @@
+from collections import Counter
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Messages logged once per row (or per session) go to this logger, so that they can be
+# turned off on their own for large imports (see `set_row_logging`)
+ROW_LOGGER = "rows"
+
+
+def set_row_logging(enabled):
+    """Turn the per-row INFO and DEBUG messages on or off
+
+    Warnings and errors about a row are always logged.  Per-row messages are logged with
+    lazy %-style arguments, so while they are off they are not even formatted.
+    """
+    level = logging.NOTSET if enabled else logging.WARNING
+    logging.getLogger(ROW_LOGGER).setLevel(level)
+
+
+class ProgressReporter:
+    """Logs a progress line at most every `interval` seconds as rows are imported
+
+    The line gives the rows done (and their statuses), the rows and API calls per
+    second, and the time left if the total number of rows is known.
+
+    Args:
+        total (integer): The number of rows to import, or None if it is not known (e.g.
+            when the CSV file is streamed)
+        interval (float): The least number of seconds between two progress lines.  0
+            to never log progress.
+        metrics (mu.Metrics): The metrics of the flywheel client, to report API calls
+    """
+
+    def __init__(self, total=None, interval=30, metrics=None):
+        self.total = total
+        self.interval = interval
+        self.metrics = metrics
+
+        self.done = 0
+        self.statuses = Counter()
+        self._start = time.perf_counter()
+        self._last = self._start
+        self._lock = threading.Lock()
+
+    def update(self, statuses):
+        """Count rows that are finished, and log progress if it is time to
+
+        Args:
+            statuses (iterable): The status of each row that finished
+        """
+        with self._lock:
+            for status in statuses:
+                self.statuses[status] += 1
+                self.done += 1
+
+            now = time.perf_counter()
+            if not self.interval or now - self._last < self.interval:
+                return
+            self._last = now
+            line = self.progress_line(now - self._start)
+
+        log.info(line)
+
+    def progress_line(self, elapsed):
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        statuses = ", ".join(f"{n} {status}" for status, n in sorted(self.statuses.items()))
+        line = f"Progress: {self.done}"
+        if self.total is not None:
+            line += f"/{self.total}"
+        line += f" rows ({statuses or 'none finished'}), {rate:.1f} rows/s"
+
+        if self.metrics is not None and elapsed > 0:
+            line += f", {self.metrics.total_calls() / elapsed:.1f} API calls/s"
+
+        if self.total is not None and rate > 0:
+            line += f", ETA {format_duration((self.total - self.done) / rate)}"
+        return line
+
+
+def format_duration(seconds):
+    """e.g. "1h02m05s", "3m20s" or "12s" """
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m{seconds:02d}s"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
@@ -0,0 +1,227 @@
+import asyncio
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import logging
+import random
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Status codes that a busy flywheel site returns for requests worth trying again
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Status codes that ask every request, not just the failed one, to slow down
+THROTTLE_STATUSES = (429, 503)
+
+
+class TokenBucket:
+    """A thread safe token bucket, refilled at `rate` tokens per second
+
+    Args:
+        rate (float): The sustained number of requests per second.  0 for no limit.
+        burst (integer): The most requests that can be made at once after the bucket
+            has been idle.  Defaults to one second's worth of tokens.
+    """
+
+    def __init__(self, rate=0, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token, and return the seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self._paused_until - now, 0.0)
+            if self.rate > 0:
+                elapsed = now - self._updated
+                self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+                self._updated = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens / self.rate)
+            return wait
+
+    def pause(self, seconds):
+        """Hold back every request for the given number of seconds"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class RequestScheduler:
+    """Paces requests with a token bucket, and retries transient failures
+
+    Requests that fail with one of `RETRY_STATUSES`, or with a connection error, are
+    retried up to `max_retries` times, waiting the server's `Retry-After` if it sent one
+    and a jittered exponential backoff otherwise.  A 429 or 503 also pauses the bucket,
+    so that every worker backs off, not just the one that was refused.
+
+    Retries are counted per class (the status code, or "connection"), in `retries`
+    and in `metrics` if it is given, along with the requests that ran out of retries.
+
+    Args:
+        rate (float): The most requests per second.  0 for no limit.
+        max_retries (integer): The number of times to retry a request.
+        backoff (float): The base of the exponential backoff, in seconds.
+        max_backoff (float): The longest to wait between two attempts, in seconds.
+        metrics (mu.Metrics): Where to record retries, if anywhere.
+    """
+
+    def __init__(self, rate=0, max_retries=5, backoff=0.5, max_backoff=60, metrics=None):
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.metrics = metrics
+
+        self.retries = Counter()
+        self.exhausted = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self.bucket.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        delay = self.bucket.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def retry_delay(self, attempt, status=None, error=None, retry_after=None):
+        """Decide if a failed attempt is retried, and how long to wait first
+
+        Args:
+            attempt (integer): The number of attempts already retried
+            status (integer): The HTTP status of the response, if there was one
+            error (Exception): The error raised, if any
+            retry_after (string): The `Retry-After` header of the response, if any
+
+        Returns:
+            delay (float): The seconds to wait before retrying, or None to give up
+
+        """
+        if status in RETRY_STATUSES:
+            kind = str(status)
+        elif status is None and is_connection_error(error):
+            kind = "connection"
+        else:
+            return None
+
+        if attempt >= self.max_retries:
+            with self._lock:
+                self.exhausted += 1
+            if self.metrics is not None:
+                self.metrics.record_retry(kind, exhausted=True)
+            log.warning(f"Giving up after {attempt} retries ({kind})")
+            return None
+
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        server_delay = parse_retry_after(retry_after)
+        if server_delay is not None:
+            delay = max(delay, min(server_delay, self.max_backoff))
+        if status in THROTTLE_STATUSES:
+            self.bucket.pause(delay)
+
+        with self._lock:
+            self.retries[kind] += 1
+        if self.metrics is not None:
+            self.metrics.record_retry(kind)
+
+        log.debug(f"Retrying request ({kind}) in {delay:.2f} s")
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        """Call `func` once a token is available, retrying it if it fails transiently"""
+        attempt = 0
+        while True:
+            self.wait()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                headers = getattr(e, "headers", None) or {}
+                delay = self.retry_delay(
+                    attempt, getattr(e, "status", None), e, headers.get("Retry-After")
+                )
+                if delay is None:
+                    raise
+
+            time.sleep(delay)
+            attempt += 1
+
+
+class ScheduledClient:
+    """Wraps a flywheel.Client, so that all its API calls go through a `RequestScheduler`
+
+    Like `mu.InstrumentedClient`, the calls are intercepted at the SDK's `api_client`.
+    If the client is already instrumented, each attempt is recorded separately.  Every
+    other attribute is passed through to the wrapped client.
+    """
+
+    def __init__(self, fw, scheduler):
+        self.fw = fw
+        self.scheduler = scheduler
+
+        api_client = fw.api_client
+        call_api = api_client.call_api
+
+        def attempt_call_api(*args, **kwargs):
+            # The SDK updates the (header) dicts it is given in place, so every attempt
+            # gets its own copies
+            args = [dict(a) if isinstance(a, dict) else a for a in args]
+            kwargs = {k: dict(v) if isinstance(v, dict) else v for k, v in kwargs.items()}
+            return call_api(*args, **kwargs)
+
+        def scheduled_call_api(*args, **kwargs):
+            return scheduler.call(attempt_call_api, *args, **kwargs)
+
+        api_client.call_api = scheduled_call_api
+        disable_sdk_retries(api_client)
+
+    def __getattr__(self, name):
+        return getattr(self.fw, name)
+
+
+def disable_sdk_retries(api_client):
+    """Turn off the retries of the SDK's own http transport, if it has any
+
+    Newer SDK's retry transient errors in their transport.  With the scheduler on top,
+    the retries would stack, and the scheduler could neither count them nor pace them.
+    """
+    client = getattr(getattr(api_client, "rest_client", None), "client", None)
+    transports = [getattr(client, "_transport", None)]
+    transports.extend(getattr(client, "_mounts", {}).values())
+    for transport in transports:
+        if hasattr(transport, "status_forcelist") and hasattr(transport, "total"):
+            transport.total = 0
+
+
+def is_connection_error(error):
+    """True for the connection errors and timeouts of requests, httpx and the SDK"""
+    if error is None:
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return bool(names & {"TransportError", "ConnectionError", "Timeout", "TimeoutException"})
+
+
+def parse_retry_after(value):
+    """The seconds to wait from a `Retry-After` header (in seconds or an HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)